@@ -0,0 +1,281 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+"""
+The benchmark suite. Every case runs in its own fresh interpreter, so its peak memory is its own and nothing is warmed
+up by the cases before it, and reports:
+    wall time, RHS evaluations per second (counted per neuron), peak RSS and simulated ms per wall second.
+
+Results are appended to a JSON history file along with the commit they were measured at, and every run is compared
+against the last entry in the history so regressions between commits stand out.
+
+    python benchmark.py                  # the default cases
+    python benchmark.py --full           # also the 100k neuron population and the Brian2 script
+    python benchmark.py --case chain_30  # just one case
+"""
+
+#####################################################################
+
+HISTORY = "benchmark_history.json"
+
+# A case slower than the last recorded run by more than this fraction is flagged
+REGRESSION = 0.1
+
+
+def count_rhs(neuron):
+    """
+    Wraps a Neuron's f so every call odeint makes to it is counted.
+
+    :return: a one element list holding the count so far
+    """
+    count = [0]
+    f = neuron.f
+
+    def counted(init, t):
+        count[0] += 1
+        return f(init, t)
+    neuron.f = counted
+    return count
+
+
+def neuron_run():
+    """
+    Neuron.run for 100 ms, from the default initial conditions.
+    """
+    from neuron import Neuron
+
+    neuron = Neuron([], 1)
+    count = count_rhs(neuron)
+    neuron.run(100, 0)
+    return {"simulated_ms": 100.0, "rhs": count[0]}
+
+
+def get_data_behind():
+    """
+    The get_data_behind protocol of a single neuron: the activation ramp, the pulse and the 30 ms tail.
+    """
+    from neuron import Neuron
+
+    neuron = Neuron([], 1)
+    count = count_rhs(neuron)
+    with contextlib.redirect_stdout(io.StringIO()):
+        neuron.get_data_behind()
+    return {"simulated_ms": neuron.clock.t, "rhs": count[0]}
+
+
+def chain(size):
+    """
+    The chain of line_of_neurons_model.py, without the plotting.
+    """
+    def case():
+        from network import Network
+
+        neurons = Network.chain(size).to_neurons()
+        counts = [count_rhs(neuron) for neuron in neurons]
+        with contextlib.redirect_stdout(io.StringIO()):
+            neurons[0].get_data_behind()
+            neurons[0].send_data_forward()
+        # The time the whole chain has reached, the end of the last neuron's action potential
+        return {"simulated_ms": max(neuron.clock.t for neuron in neurons), "rhs": sum(count[0] for count in counts)}
+    return case
+
+
+def population(size, method="rush_larsen"):
+    """
+    A population of size neurons through 5 ms of rest, a 3 ms pulse and 2 ms more, on the native engine.
+    """
+    def case():
+        from population import NeuronPopulation
+        from stimulus import StimulusProtocol
+
+        cells = NeuronPopulation(size, at_rest=True)
+        protocol = StimulusProtocol().rest(5).hold(3, 1).rest(2)
+        cells.run_protocol(protocol, samples=101, method=method, dt=0.01)
+        return {"simulated_ms": protocol.duration, "rhs": cells.solver_stats["nfe"] * size, "neurons": size}
+    return case
+
+
+def threaded(size, threads=None):
+    """
+    The population case, stepped in chunks on a pool of threads (threaded.ThreadedStepper) with rush_larsen.
+    """
+    def case():
+        from population import NeuronPopulation
+        from threaded import ThreadedStepper
+
+        cells = NeuronPopulation(size, at_rest=True)
+        with ThreadedStepper(cells, threads) as stepper:
+            stepper.run(5, 0, samples=51)
+            stepper.run(3, 1, samples=31)
+            stepper.run(2, 0, samples=21)
+        return {"simulated_ms": 10.0, "rhs": 1000 * size, "neurons": size}
+    return case
+
+
+def brian():
+    """
+    brian_singleneuron.py as a reference, with plotting going nowhere.
+    """
+    import importlib.util
+    if importlib.util.find_spec("brian2") is None:
+        return {"skipped": "brian2 is not installed"}
+
+    os.environ["MPLBACKEND"] = "Agg"
+    import runpy
+    runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "brian_singleneuron.py"))
+    # 50 ms, 3 ms at 1 uA and 50 ms
+    return {"simulated_ms": 103.0, "rhs": None}
+
+
+CASES = {
+    "neuron_run_100ms": neuron_run,
+    "get_data_behind": get_data_behind,
+    "chain_3": chain(3),
+    "chain_10": chain(10),
+    "chain_30": chain(30),
+    "population_10": population(10),
+    "population_100": population(100),
+    "population_1000": population(1000),
+    "population_10000": population(10000),
+    "population_odeint_1000": population(1000, "odeint"),
+    "population_threaded_10000": threaded(10000),
+}
+
+# Only run with --full, as they take a while or need extra packages
+FULL_CASES = {
+    "population_100000": population(100000),
+    "population_threaded_100000": threaded(100000),
+    "brian_singleneuron": brian,
+}
+
+
+def peak_rss_mb():
+    """
+    :return: the peak resident memory of this process in MB
+    """
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, macOS bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def run_case(name, repeats=3):
+    """
+    Runs one case in this process and works out its metrics, keeping the fastest of several repeats.
+
+    :return: a dict of the case's results
+    """
+    # Importing everything first, so the imports aren't timed as part of the first case
+    import network, population, stimulus, threaded  # noqa: F401
+
+    case = {**CASES, **FULL_CASES}[name]
+    wall = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = case()
+        wall = min(wall, time.perf_counter() - start)
+        if "skipped" in result:
+            return result
+
+    result["wall_s"] = wall
+    result["simulated_ms_per_s"] = result["simulated_ms"] / wall
+    result["rhs_per_s"] = None if result["rhs"] is None else result["rhs"] / wall
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def run_isolated(name, repeats=3):
+    """
+    Runs one case in a fresh interpreter.
+
+    :return: the case's results
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--worker", name, "--repeats", str(repeats)]
+    output = subprocess.run(command, capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+#####################################################################
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return json.load(file)
+
+
+def report(results, previous=None):
+    """
+    Prints a table of the results, with the change in wall time from the previous entry of the history.
+    """
+    previous = {} if previous is None else previous["results"]
+    print(f"{'case':<24}{'wall s':>9}{'sim ms/s':>11}{'RHS/s':>11}{'peak MB':>9}{'change':>9}")
+    for name, result in results.items():
+        if "skipped" in result:
+            print(f"{name:<24} skipped: {result['skipped']}")
+            continue
+        change = ""
+        before = previous.get(name, {}).get("wall_s")
+        if before:
+            ratio = result["wall_s"] / before - 1
+            change = f"{ratio:+.0%}" + (" !" if ratio > REGRESSION else "")
+        rhs = "-" if result["rhs_per_s"] is None else f"{result['rhs_per_s']:.3g}"
+        print(f"{name:<24}{result['wall_s']:9.3f}{result['simulated_ms_per_s']:11.4g}{rhs:>11}"
+              f"{result['peak_rss_mb']:9.1f}{change:>9}")
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmark the HH simulations and keep a JSON history.")
+    parser.add_argument("--case", action="append", help="run only these cases (can be repeated)")
+    parser.add_argument("--full", action="store_true", help="also run the long and optional cases")
+    parser.add_argument("--history", default=HISTORY, help="the JSON history file to append to")
+    parser.add_argument("--no-save", action="store_true", help="don't add this run to the history")
+    parser.add_argument("--repeats", type=int, default=3, help="times to run every case, keeping the fastest")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    arguments = parser.parse_args(arguments)
+
+    if arguments.worker:
+        print(json.dumps(run_case(arguments.worker, arguments.repeats)))
+        return
+
+    names = arguments.case or list(CASES) + (list(FULL_CASES) if arguments.full else [])
+    results = {name: run_isolated(name, arguments.repeats) for name in names}
+
+    history = load_history(arguments.history)
+    report(results, history[-1] if history else None)
+
+    if not arguments.no_save:
+        history.append({
+            "commit": git_commit(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "results": results,
+        })
+        with open(arguments.history, "w") as file:
+            json.dump(history, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+import time
+
+import numpy as np
+from scipy.linalg import solve_banded
+
+from integrators import gate_step
+from neuron import f_alphan, f_betan, f_alpham, f_betam, f_alphah, f_betah
+
+"""
+A multi-compartment cable model, the native counterpart of the SpatialNeuron in brian_singleneuron.py. A cylinder (or a
+branched tree of them) is split into compartments, each with its own HH channels, joined by the axial resistance of the
+cytoplasm. Instead of faking propagation with a chain of separate neurons, the signal travels along the cable itself.
+
+Units are the usual ones for cable models: lengths and diameters in um, Ri in ohm cm, Cm in uF/cm^2, conductances in
+mS/cm^2, voltages in mV, time in ms and injected currents in nA.
+"""
+
+#####################################################################
+
+
+class Morphology:
+    """
+    A class to represent the shape of a neuron as a tree of cylindrical compartments.
+
+    ...
+
+    Attributes
+    ----------
+    parent : np.ndarray
+        the compartment each compartment is attached to, -1 for the root. Parents always come before their children
+        (Hines ordering), which is what lets the axial currents be solved in O(N).
+    length, diameter : np.ndarray
+        the length and diameter of each compartment in um
+
+    Methods
+    -------
+    cylinder(length, diameter, compartments):
+        An unbranched cylinder, like brian2's Cylinder.
+
+    add_branch(parent, length, diameter, compartments):
+        Attaches a new cylinder to an existing compartment.
+    """
+
+    def __init__(self, parent, length, diameter):
+        parent = np.asarray(parent, dtype=np.intp)
+        if len(parent) == 0 or parent[0] != -1 or np.any(parent[1:] < 0) or \
+                np.any(parent[1:] >= np.arange(1, len(parent))):
+            raise ValueError("Compartment 0 must be the root and every other compartment's parent must come before it")
+        self.parent = parent
+        self.length = np.broadcast_to(np.asarray(length, dtype=float), parent.shape).copy()
+        self.diameter = np.broadcast_to(np.asarray(diameter, dtype=float), parent.shape).copy()
+
+    @classmethod
+    def cylinder(cls, length, diameter, compartments):
+        """
+        :param length: the total length of the cylinder in um
+        :param diameter: its diameter in um
+        :param compartments: the number of compartments to split it into
+        :return: the Morphology
+        """
+        return cls(np.arange(compartments) - 1, length / compartments, diameter)
+
+    def add_branch(self, parent, length, diameter, compartments):
+        """
+        Attaches a new cylinder to the end of an existing compartment.
+
+        :param parent: the compartment to attach to
+        :param length: the total length of the branch in um
+        :param diameter: its diameter in um
+        :param compartments: the number of compartments to split it into
+        :return: the indices of the new compartments
+        """
+        start = len(self.parent)
+        new = np.arange(start, start + compartments)
+        self.parent = np.concatenate((self.parent, np.concatenate(([parent], new[:-1]))))
+        self.length = np.concatenate((self.length, np.full(compartments, length / compartments)))
+        self.diameter = np.concatenate((self.diameter, np.full(compartments, float(diameter))))
+        return new
+
+    def __len__(self):
+        return len(self.parent)
+
+    @property
+    def unbranched(self):
+        return bool(np.all(self.parent[1:] == np.arange(len(self.parent) - 1)))
+
+    @property
+    def area(self):
+        """
+        :return: the membrane area of each compartment in cm^2
+        """
+        return np.pi * self.diameter * self.length * 1e-8
+
+    def distance(self):
+        """
+        :return: the distance from the start of the root to the middle of each compartment, in um
+        """
+        distance = np.empty(len(self))
+        for i, parent in enumerate(self.parent):
+            start = 0 if parent < 0 else distance[parent] + self.length[parent] / 2
+            distance[i] = start + self.length[i] / 2
+        return distance
+
+
+def hines_solve(parent, diagonal, upper, lower, rhs):
+    """
+    Solves the linear system of a tree of compartments in O(N) with the Hines algorithm. Row i of the matrix has
+    diagonal[i] on the diagonal, upper[i] in the column of its parent, and lower[i] in row parent[i] at column i. With
+    parents numbered before their children there is no fill-in: eliminating from the leaves up to the root then
+    substituting back down visits every compartment twice.
+
+    For an unbranched cable this is the Thomas algorithm for a tridiagonal matrix, so that case goes to LAPACK's
+    banded solver, which does the same elimination without the Python loop.
+
+    :return: the solution of the system
+    """
+    size = len(diagonal)
+    if size > 1 and np.all(parent[1:] == np.arange(size - 1)):
+        banded = np.zeros((3, size))
+        banded[0, 1:] = lower[1:]
+        banded[1] = diagonal
+        banded[2, :-1] = upper[1:]
+        return solve_banded((1, 1), banded, rhs, overwrite_ab=True, check_finite=False)
+
+    # Plain lists are much quicker than NumPy arrays to index one element at a time
+    parent = parent.tolist()
+    diagonal = diagonal.tolist()
+    upper = upper.tolist()
+    lower = lower.tolist()
+    rhs = rhs.tolist()
+
+    for i in range(size - 1, 0, -1):
+        p = parent[i]
+        factor = lower[i] / diagonal[i]
+        diagonal[p] -= factor * upper[i]
+        rhs[p] -= factor * rhs[i]
+
+    v = [0.0] * size
+    v[0] = rhs[0] / diagonal[0]
+    for i in range(1, size):
+        v[i] = (rhs[i] - upper[i] * v[parent[i]]) / diagonal[i]
+    return np.array(v)
+
+
+#####################################################################
+
+
+class CableNeuron:
+    """
+    A class to represent a neuron with a spatial extent, with HH channels in every compartment.
+
+    ...
+
+    Attributes
+    ----------
+    morphology : Morphology
+        the compartments and how they connect
+    n, m, h, v : np.ndarray
+        the state of every compartment
+    time : float
+        the current simulation time in ms
+
+    Methods
+    -------
+    step(dt, injected):
+        Advances every compartment by one implicit step.
+
+    run(duration, dt, stimuli, record, record_every):
+        Runs the cable for a length of time, recording the voltage of chosen compartments.
+    """
+
+    def __init__(self, morphology, Ri=35.4, Cm=1.0, gNa=120.0, gK=36.0, gL=0.3, ENa=50.0, EK=-77.0, EL=-54.387,
+                 v=-65.0):
+        """
+        The defaults are the parameters of brian_singleneuron.py, with the voltages moved from its 0 mV resting
+        convention to the -65 mV one the rate functions in neuron.py use.
+
+        :param morphology: the Morphology to simulate
+        :param Ri: the axial resistivity in ohm cm
+        :param Cm: the membrane capacitance in uF/cm^2
+        :param gNa, gK, gL: the maximum conductances in mS/cm^2, scalars or one per compartment
+        :param ENa, EK, EL: the reversal potentials in mV
+        :param v: the starting voltage. The gates start at their steady state for it.
+        """
+        self.morphology = morphology
+        size = len(morphology)
+        self.Cm = Cm
+        self.gNa = np.broadcast_to(np.asarray(gNa, dtype=float), (size,)).copy()
+        self.gK = np.broadcast_to(np.asarray(gK, dtype=float), (size,)).copy()
+        self.gL = np.broadcast_to(np.asarray(gL, dtype=float), (size,)).copy()
+        self.ENa = ENa
+        self.EK = EK
+        self.EL = EL
+
+        self.v = np.full(size, float(v))
+        alphan, betan, alpham, betam, alphah, betah = self.rates(self.v)
+        self.n = alphan / (alphan + betan)
+        self.m = alpham / (alpham + betam)
+        self.h = alphah / (alphah + betah)
+        self.time = 0.0
+
+        # The axial conductance between every compartment and its parent, in mS, from the resistance of half of each
+        area = morphology.area
+        parent = morphology.parent
+        half_resistance = Ri * (morphology.length / 2 * 1e-4) / (np.pi * (morphology.diameter / 2 * 1e-4)**2)
+        conductance = np.zeros(size)
+        conductance[1:] = 1e3 / (half_resistance[1:] + half_resistance[parent[1:]])
+        self.area = area
+        # Divided by the area of the compartment whose equation it appears in, giving mS/cm^2
+        self.upper = np.zeros(size)
+        self.lower = np.zeros(size)
+        self.upper[1:] = -conductance[1:] / area[1:]
+        self.lower[1:] = -conductance[1:] / area[parent[1:]]
+        self.axial = -self.upper.copy()
+        np.add.at(self.axial, parent[1:], -self.lower[1:])
+
+    @classmethod
+    def brian_singleneuron(cls, compartments=1):
+        """
+        The axon brian_singleneuron.py simulates: a 1 cm long, 500 um wide cylinder. Brian's voltages are these plus
+        65 mV (and its plot then subtracts 70 mV).
+
+        :param compartments: the number of compartments (the Brian script uses 1)
+        """
+        return cls(Morphology.cylinder(1e4, 500, compartments))
+
+    def rates(self, v):
+        return f_alphan(v), f_betan(v), f_alpham(v), f_betam(v), f_alphah(v), f_betah(v)
+
+    def step(self, dt, injected=None):
+        """
+        Advances the cable by dt. The gates take exact exponential steps with the rates at the current voltage, then
+        the voltages of all compartments are solved for together with a backward Euler step, so the axial currents
+        never limit dt however short the compartments are.
+
+        :param dt: the step in ms
+        :param injected: optionally the current injected into every compartment in nA
+        """
+        alphan, betan, alpham, betam, alphah, betah = self.rates(self.v)
+        self.n = gate_step(self.n, alphan, betan, dt)
+        self.m = gate_step(self.m, alpham, betam, dt)
+        self.h = gate_step(self.h, alphah, betah, dt)
+
+        gK = self.gK * self.n**4
+        gNa = self.gNa * self.m**3 * self.h
+        capacitance = self.Cm / dt
+
+        diagonal = capacitance + gK + gNa + self.gL + self.axial
+        rhs = capacitance * self.v + gK * self.EK + gNa * self.ENa + self.gL * self.EL
+        if injected is not None:
+            # nA / cm^2 to uA / cm^2
+            rhs = rhs + injected * 1e-3 / self.area
+
+        self.v = hines_solve(self.morphology.parent, diagonal, self.upper, self.lower, rhs)
+        self.time += dt
+
+    def run(self, duration, dt=0.01, stimuli=(), record=None, record_every=1):
+        """
+        Runs the cable for a length of time.
+
+        :param duration: the length of time to run for in ms
+        :param dt: the step in ms
+        :param stimuli: a list of (compartment, current) pairs, where current is a constant in nA or a
+                        stimulus.StimulusProtocol (in nA) that starts with this run
+        :param record: the compartments to record the voltage of, by default all of them
+        :param record_every: keep every k-th step
+        :return: the recorded times and a (samples, compartments) array of voltages
+        """
+        size = len(self.morphology)
+        record = np.arange(size) if record is None else np.asarray(record)
+        steps = int(round(duration / dt))
+
+        samples = steps // record_every + 1
+        times = np.empty(samples)
+        voltages = np.empty((samples, len(record)))
+        times[0] = self.time
+        voltages[0] = self.v[record]
+
+        injected = np.zeros(size)
+        start_time = self.time
+        sample = 1
+        for i in range(1, steps + 1):
+            injected[:] = 0
+            for compartment, current in stimuli:
+                if hasattr(current, "current"):
+                    current = current.current(self.time + dt / 2 - start_time)
+                injected[compartment] += current
+            self.step(dt, injected if stimuli else None)
+            if i % record_every == 0:
+                times[sample] = self.time
+                voltages[sample] = self.v[record]
+                sample += 1
+
+        return times, voltages
+
+    def conduction_velocity(self, times, voltages, record=None, threshold=0.0):
+        """
+        Fits a straight line to the time each recorded compartment first crossed a threshold against its position.
+
+        :param times: the recorded times
+        :param voltages: the (samples, compartments) recorded voltages
+        :param record: the compartments that were recorded, by default all of them
+        :param threshold: the voltage a spike crosses
+        :return: the conduction velocity in m/s, or NaN if fewer than two compartments spiked
+        """
+        record = np.arange(len(self.morphology)) if record is None else np.asarray(record)
+        crossed = voltages >= threshold
+        spiked = crossed.any(axis=0)
+        if spiked.sum() < 2:
+            return np.nan
+        arrival = times[crossed[:, spiked].argmax(axis=0)]
+        position = self.morphology.distance()[record[spiked]]
+        # um per ms is mm per s
+        return np.polyfit(arrival, position, 1)[0] * 1e-3
+
+
+if __name__ == "__main__":
+    from stimulus import StimulusProtocol
+
+    for compartments in (100, 1000, 5000):
+        axon = CableNeuron.brian_singleneuron(compartments)
+        start = time.perf_counter()
+        times, voltages = axon.run(10, dt=0.01, stimuli=[(0, StimulusProtocol().hold(1, 5000).rest(9))],
+                                   record_every=10)
+        elapsed = time.perf_counter() - start
+        velocity = axon.conduction_velocity(times, voltages)
+        print(f"1 cm axon, {compartments} compartments: 10 ms in {elapsed:.2f} s, peak {voltages.max():.1f} mV, "
+              f"conduction velocity {velocity:.1f} m/s")
+
+    branched = Morphology.cylinder(2000, 2, 200)
+    branched.add_branch(99, 1000, 1, 100)
+    cell = CableNeuron(branched)
+    start = time.perf_counter()
+    times, voltages = cell.run(10, dt=0.025, stimuli=[(0, StimulusProtocol().hold(1, 1).rest(9))], record_every=4)
+    print(f"Branched tree, {len(branched)} compartments: 10 ms in {time.perf_counter() - start:.2f} s, "
+          f"peak at branch tip {voltages[:, -1].max():.1f} mV")
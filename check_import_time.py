@@ -0,0 +1,71 @@
+import argparse
+import json
+import subprocess
+import sys
+
+"""
+Import-time budget check for the simulation core. Every module here is imported in a fresh interpreter, so nothing is
+already cached, and the check fails if that takes longer than the budget or pulls in plotting or GUI packages. Worker
+processes (e.g. in sweep.py) pay this cost every time they start, so it is worth keeping small.
+
+    python check_import_time.py --budget 1.5
+exits with status 1 if the core is over budget.
+"""
+
+#####################################################################
+
+# The modules a simulation needs, which must all import headless
+CORE_MODULES = (
+    "neuron", "population", "integrators", "rate_tables", "jacobian", "recorder", "trace_files", "stimulus",
+    "scheduler", "network", "clock", "snapshot", "steady_state", "waveform_cache", "cable", "sweep", "equations",
+    "threaded", "distributed", "synapses", "delays",
+)
+
+# Packages none of them may import
+FORBIDDEN = ("matplotlib", "brian2", "gui", "tkinter", "PyQt5", "PySide2")
+
+MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+for module in {modules!r}:
+    __import__(module)
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "forbidden": sorted(name for name in {forbidden!r} if name in sys.modules)}}))
+"""
+
+
+def measure(modules=CORE_MODULES, repeats=3):
+    """
+    :param modules: the modules to import together
+    :param repeats: the number of fresh interpreters to time. The fastest is kept, as the others only add noise.
+    :return: the fastest import time in seconds, and any forbidden packages that were imported
+    """
+    results = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", MEASURE.format(modules=modules, forbidden=FORBIDDEN)],
+                                capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output))
+    return min(result["seconds"] for result in results), results[0]["forbidden"]
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Check the simulation core imports quickly and headless.")
+    parser.add_argument("--budget", type=float, default=1.5, help="the most seconds a cold import may take")
+    parser.add_argument("--repeats", type=int, default=3, help="fresh interpreters to time")
+    arguments = parser.parse_args(arguments)
+
+    seconds, forbidden = measure(repeats=arguments.repeats)
+    print(f"Cold import of {len(CORE_MODULES)} core modules: {seconds * 1e3:.0f} ms "
+          f"(budget {arguments.budget * 1e3:.0f} ms)")
+    failed = False
+    if forbidden:
+        print(f"FAIL: the core imported {', '.join(forbidden)}")
+        failed = True
+    if seconds > arguments.budget:
+        print("FAIL: over budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""
+The simulation clock. Every simulation keeps its own Clock, which only ever moves forward, so one run carries on exactly
+where the last finished rather than having its start time worked out from the timestamps of the previous run.
+"""
+
+#####################################################################
+
+
+class Clock:
+    """
+    A class to represent the time a simulation has reached.
+
+    ...
+
+    Attributes
+    ----------
+    t : float
+        the current time in ms
+
+    Methods
+    -------
+    advance_to(t):
+        Moves the clock forward to a later time.
+    """
+
+    def __init__(self, t=0.0):
+        self.t = float(t)
+
+    def advance_to(self, t):
+        """
+        :param t: the time the simulation has reached. Moving backwards is an error.
+        """
+        t = float(t)
+        if t < self.t:
+            raise ValueError(f"The clock can't go back from {self.t} ms to {t} ms")
+        self.t = t
+
+    def state_snapshot(self):
+        return {"t": self.t}
+
+    def restore(self, snapshot):
+        self.t = float(snapshot["t"])
+
+    def __repr__(self):
+        return f"Clock(t={self.t})"
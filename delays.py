@@ -0,0 +1,91 @@
+import numpy as np
+
+"""
+Conduction delays for step-by-step network simulations. Every connection's delay is a whole number of steps, and the
+input still to arrive at each neuron is kept in a circular buffer with one slot per future step, as many as the longest
+delay. Sending spikes is one scatter-add of their weights into the slots they arrive in, and every step takes the
+front slot off, so no spike is ever sorted or kept as an object of its own however many are in flight. The slot taken
+off can be added straight to the voltages, or handed to synapses.ExponentialSynapses.add as the weights arriving.
+"""
+
+#####################################################################
+
+
+class DelayRingBuffer:
+    """
+    A class to represent the input still to arrive at N neurons over the next max_delay + 1 steps.
+
+    ...
+
+    Attributes
+    ----------
+    size : int
+        the number of neurons
+    slots : int
+        the number of future steps held, the longest delay plus one
+    buffer : np.ndarray
+        the (slots, N) input arriving at each neuron, slot k being for step k modulo slots
+    step : int
+        the step the front slot is for, the next one pop() takes
+
+    Methods
+    -------
+    schedule(delays, neurons, weights):
+        Adds input arriving some number of steps after the front step.
+
+    pop(out):
+        Takes the front slot off, for the step about to be simulated.
+    """
+
+    def __init__(self, size, max_delay, step=0):
+        """
+        :param size: the number of neurons
+        :param max_delay: the longest delay in steps that will ever be scheduled
+        :param step: the number of the first step
+        """
+        self.size = size
+        self.slots = max_delay + 1
+        self.buffer = np.zeros((self.slots, size))
+        self.step = step
+        # Whether anything has been scheduled into each slot, so empty steps cost nothing
+        self.pending = np.zeros(self.slots, dtype=bool)
+
+    def schedule(self, delays, neurons, weights):
+        """
+        :param delays: the number of steps after the front step each input arrives at, 0 to max_delay
+        :param neurons: the neuron each input arrives at
+        :param weights: the size of each input. Inputs to the same neuron and step are added up in the order given.
+        """
+        delays = np.asarray(delays)
+        if not len(delays):
+            return
+        if delays.min() < 0 or delays.max() >= self.slots:
+            raise ValueError(f"Delays must be between 0 and {self.slots - 1} steps")
+        slots = (self.step + delays) % self.slots
+        np.add.at(self.buffer, (slots, neurons), weights)
+        self.pending[slots] = True
+
+    def pop(self, out=None):
+        """
+        Takes the input for the front step off and moves on to the next step.
+
+        :param out: if given, the input is added into this array in place rather than returned
+        :return: the (N,) input arriving at the front step, or None if nothing arrives then (or out was given)
+        """
+        slot = self.step % self.slots
+        self.step += 1
+        if not self.pending[slot]:
+            return None
+        self.pending[slot] = False
+        values = self.buffer[slot]
+        if out is not None:
+            out += values
+            values[:] = 0
+            return None
+        arrived = values.copy()
+        values[:] = 0
+        return arrived
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes
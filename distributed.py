@@ -0,0 +1,402 @@
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+
+from delays import DelayRingBuffer
+from integrators import rush_larsen_step
+from network import Network, csr_runs
+from population import NeuronPopulation
+from synapses import ExponentialSynapses
+
+"""
+A network simulation split across processes. The neurons of a network.Network are divided into partitions with as few
+connections between them as possible, and every worker process steps its own partition with Rush-Larsen. A spike only
+reaches another neuron after its connection's delay, so nothing a neuron does can affect any other neuron sooner than
+the shortest delay in the network. The workers therefore run independently for a window that long, and only then swap
+the spikes of the window, through ring buffers in multiprocessing.shared_memory rather than by pickling them.
+
+A spike is an upward crossing of the threshold between two steps. Arriving through a connection, it adds the
+connection's weight (in mV) to the postsynaptic neuron's voltage after the connection's delay, or with a synapse type
+given, adds the weight (a peak conductance) to the postsynaptic neuron's synapses.ExponentialSynapses of that type.
+
+Spikes are always delivered in the same order (by spike step, then presynaptic neuron, then connection), so a run gives
+exactly the same result however many processes it is split over.
+"""
+
+#####################################################################
+
+# The number of windows of spikes every worker's ring buffer holds. Two is enough: a window's slot is only written
+# again two windows later, by which time every worker has passed the barrier after reading it.
+RING_SLOTS = 2
+
+
+def cut_edges(network, parts):
+    """
+    :param network: the network.Network
+    :param parts: the partition of every neuron
+    :return: the number of connections between neurons in different partitions
+    """
+    return int(np.count_nonzero(parts[network.pre] != parts[network.post]))
+
+
+def partition(network, parts, imbalance=0.05, passes=10):
+    """
+    Divides the neurons of a network into partitions of (nearly) equal size with few connections between them.
+
+    The neurons are first ordered by reverse Cuthill-McKee, which puts connected neurons close together, and the order
+    is cut into equal blocks. Neurons are then moved to the partition most of their connections are in, as long as that
+    takes connections out of the cut and no partition grows more than imbalance over its fair share.
+
+    :param network: the network.Network
+    :param parts: the number of partitions
+    :param imbalance: how much bigger than size / parts a partition may grow, as a fraction
+    :param passes: the most rounds of moving neurons
+    :return: the partition of every neuron, an int array of length N
+    """
+    size = network.size
+    adjacency = network.matrix.astype(bool).astype(np.float64)
+    adjacency = csr_matrix(adjacency + adjacency.T)
+
+    # Cutting the neurons' own numbering into blocks is kept instead, if that is better already (e.g. for a ring,
+    # which reverse Cuthill-McKee orders from both sides at once)
+    blocks = np.arange(size) * parts // max(size, 1)
+    assignment = np.empty(size, dtype=np.int64)
+    assignment[reverse_cuthill_mckee(adjacency, symmetric_mode=True)] = blocks
+    if cut_edges(network, blocks) <= cut_edges(network, assignment):
+        assignment = blocks.astype(np.int64)
+    if parts == 1:
+        return assignment
+
+    capacity = int(np.ceil(size / parts * (1 + imbalance)))
+    for _ in range(passes):
+        # The number of connections every neuron has into each partition
+        links = np.asarray((adjacency @ csr_matrix((np.ones(size), (np.arange(size), assignment)),
+                                                   shape=(size, parts))).todense())
+        best = links.argmax(axis=1)
+        gain = links[np.arange(size), best] - links[np.arange(size), assignment]
+        candidates = np.flatnonzero(gain > 0)
+        if not len(candidates):
+            break
+
+        sizes = np.bincount(assignment, minlength=parts)
+        moved = 0
+        for neuron in candidates[np.argsort(-gain[candidates], kind="stable")]:
+            target = best[neuron]
+            # Moving a neighbour earlier in this pass may have changed the gain, so it is checked again
+            current = assignment[neuron]
+            if sizes[target] >= capacity or adjacency[neuron].indices.size == 0:
+                continue
+            neighbours = assignment[adjacency[neuron].indices]
+            if np.count_nonzero(neighbours == target) <= np.count_nonzero(neighbours == current):
+                continue
+            sizes[target] += 1
+            sizes[current] -= 1
+            assignment[neuron] = target
+            moved += 1
+        if not moved:
+            break
+    return assignment
+
+
+#####################################################################
+
+
+class LocalExchange:
+    """
+    The spike exchange of a run in a single process, which only has its own spikes to swap.
+    """
+
+    def swap(self, window, neurons, steps):
+        return neurons, steps
+
+
+class SharedMemoryExchange:
+    """
+    A class to represent the spike ring buffers of every worker, in shared memory.
+
+    ...
+
+    Every worker has RING_SLOTS slots of capacity spikes, as (neuron, step) pairs, and a count per slot. After a window
+    each worker writes its spikes into the slot for that window, waits at the barrier for the others, and reads every
+    worker's slot.
+
+    Attributes
+    ----------
+    workers : int
+        the number of workers sharing the buffers
+    capacity : int
+        the most spikes a worker can send in one window
+    worker : int or None
+        the worker this process is, None in the main process
+
+    Methods
+    -------
+    swap(window, neurons, steps):
+        Sends this worker's spikes for a window and returns every worker's.
+
+    attach(worker) / close() / unlink():
+        Opens the buffers in a worker process, and closes or frees them.
+    """
+
+    def __init__(self, workers, capacity, barrier, name=None):
+        """
+        :param workers: the number of workers
+        :param capacity: the most spikes a worker can send in one window
+        :param barrier: the multiprocessing.Barrier the workers wait at
+        :param name: the name of existing shared memory to open, otherwise new shared memory is made
+        """
+        self.workers = workers
+        self.capacity = capacity
+        self.barrier = barrier
+        self.worker = None
+        nbytes = workers * RING_SLOTS * (capacity * 8 + 8)
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=nbytes)
+        self.name = self.memory.name
+
+        # Laid out as the counts, then the neurons, then the steps of every slot of every worker
+        counts_bytes = workers * RING_SLOTS * 8
+        self.counts = np.ndarray((workers, RING_SLOTS), dtype=np.int64, buffer=self.memory.buf)
+        self.neurons = np.ndarray((workers, RING_SLOTS, capacity), dtype=np.int32, buffer=self.memory.buf,
+                                  offset=counts_bytes)
+        self.steps = np.ndarray((workers, RING_SLOTS, capacity), dtype=np.int32, buffer=self.memory.buf,
+                                offset=counts_bytes + workers * RING_SLOTS * capacity * 4)
+
+    def __getstate__(self):
+        # Only the name is sent to a worker, which opens the same memory
+        return {"workers": self.workers, "capacity": self.capacity, "barrier": self.barrier, "name": self.name}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def attach(self, worker):
+        self.worker = worker
+
+    def swap(self, window, neurons, steps):
+        """
+        :param window: the index of the window the spikes are from
+        :param neurons: the global index of the neuron of every spike this worker had in the window
+        :param steps: the step of every spike
+        :return: the neurons and steps of the spikes of every worker in the window
+        """
+        if len(neurons) > self.capacity:
+            self.barrier.abort()
+            raise RuntimeError(f"Worker {self.worker} had {len(neurons)} spikes in a window, more than the ring buffer "
+                               f"holds ({self.capacity})")
+        slot = window % RING_SLOTS
+        count = len(neurons)
+        self.neurons[self.worker, slot, :count] = neurons
+        self.steps[self.worker, slot, :count] = steps
+        self.counts[self.worker, slot] = count
+        self.barrier.wait()
+
+        counts = self.counts[:, slot]
+        return (np.concatenate([self.neurons[worker, slot, :counts[worker]] for worker in range(self.workers)]),
+                np.concatenate([self.steps[worker, slot, :counts[worker]] for worker in range(self.workers)]))
+
+    def close(self):
+        # The views onto the memory have to go before it can be closed
+        del self.counts, self.neurons, self.steps
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.unlink()
+
+
+#####################################################################
+
+
+def simulate_partition(network, neurons, current, steps, dt, window, threshold, exchange, synapse=None):
+    """
+    Steps one partition of a network through a whole run, swapping spikes with the other partitions after every window.
+
+    :param network: the network.Network
+    :param neurons: the global indices of the neurons in this partition, in increasing order
+    :param current: the injected current of every neuron in the network
+    :param steps: the number of steps to run for
+    :param dt: the step in ms
+    :param window: the number of steps in a window, at most the shortest delay in steps
+    :param threshold: the voltage an upward crossing of is a spike
+    :param exchange: the LocalExchange or SharedMemoryExchange to swap spikes through
+    :param synapse: a synapses.PRESETS type for the arriving spikes to go into, or None to add them to the voltage
+    :return: the final (4, n) state of the partition, and the neurons and steps of its spikes
+    """
+    synapses = [] if synapse is None else [ExponentialSynapses.preset(synapse, len(neurons))]
+    population = NeuronPopulation(len(neurons), synapses=synapses, I=current[neurons])
+    state = population.state
+    local = np.full(network.size, -1, dtype=np.int64)
+    local[neurons] = np.arange(len(neurons))
+    delay_steps = network.delay_steps(dt)
+    # Only the connections into the partition are ever expanded, and only the spikes of neurons with any of them
+    indptr, incoming = network.incoming(neurons)
+    reaches_here = np.diff(indptr) > 0
+
+    # The input arriving at the partition's neurons at the start of every future step, from step 1 on
+    arrivals = DelayRingBuffer(len(neurons), int(delay_steps.max(initial=0)), step=1)
+    spike_neurons, spike_steps = [], []
+
+    for window_index, first in enumerate(range(0, steps, window)):
+        new_neurons, new_steps = [], []
+        for step in range(first + 1, min(first + window, steps) + 1):
+            below = state[3] < threshold
+            if synapses:
+                arrived = arrivals.pop()
+                if arrived is not None:
+                    synapses[0].add(arrived)
+            else:
+                arrivals.pop(out=state[3])
+            rush_larsen_step(state, population, dt)
+            crossed = np.flatnonzero(below & (state[3] >= threshold))
+            if len(crossed):
+                new_neurons.append(neurons[crossed])
+                new_steps.append(np.full(len(crossed), step))
+
+        new_neurons = np.concatenate(new_neurons) if new_neurons else np.empty(0, dtype=np.int64)
+        new_steps = np.concatenate(new_steps) if new_steps else np.empty(0, dtype=np.int64)
+        spike_neurons.append(new_neurons)
+        spike_steps.append(new_steps)
+
+        pre, spike_step = exchange.swap(window_index, new_neurons, new_steps)
+        relevant = reaches_here[pre]
+        pre, spike_step = pre[relevant].astype(np.int64), spike_step[relevant].astype(np.int64)
+        if not len(pre):
+            continue
+
+        # Every connection of every spike into the partition, in the same order however the spikes were split between
+        # workers
+        order = np.lexsort((pre, spike_step))
+        pre, spike_step = pre[order], spike_step[order]
+        connection = incoming[csr_runs(indptr, pre)]
+        # A spike at the end of step s, after a delay of d steps, arrives at the start of step s + d + 1
+        arrival = np.repeat(spike_step, indptr[pre + 1] - indptr[pre]) + delay_steps[connection] + 1
+        arrivals.schedule(arrival - arrivals.step, local[network.post[connection]], network.weight[connection])
+
+    return state, np.concatenate(spike_neurons), np.concatenate(spike_steps)
+
+
+def _worker(index, network, neurons, current, steps, dt, window, threshold, exchange, synapse, final_state, results):
+    """
+    The body of a worker process: runs one partition and puts its spikes on the results queue. The final state is
+    written straight into shared memory.
+    """
+    exchange.attach(index)
+    memory = shared_memory.SharedMemory(name=final_state)
+    try:
+        state, spike_neurons, spike_steps = simulate_partition(network, neurons, current, steps, dt, window,
+                                                               threshold, exchange, synapse)
+        np.ndarray((4, network.size), buffer=memory.buf)[:, neurons] = state
+        results.put((index, spike_neurons, spike_steps))
+    except BaseException as error:
+        exchange.barrier.abort()
+        results.put((index, None, repr(error)))
+        raise
+    finally:
+        memory.close()
+        exchange.close()
+
+
+def simulate(network, duration, dt=0.01, current=0.0, processes=1, threshold=0.0, parts=None, synapse=None):
+    """
+    Simulates every neuron of a network, split over a number of processes. The neurons start from the initial
+    conditions of neuron.Neuron.
+
+    :param network: the network.Network. Every connection must have a delay of at least one step.
+    :param duration: the length of time to run for in ms
+    :param dt: the step in ms
+    :param current: the injected current, a scalar or one value per neuron
+    :param processes: the number of worker processes. With 1 everything runs in this process.
+    :param threshold: the voltage an upward crossing of is a spike
+    :param parts: the partition of every neuron, by default from partition()
+    :param synapse: a synapses.PRESETS type, e.g. "AMPA", for spikes to arrive through with the connection weights as
+                    peak conductances in mS/cm^2. By default they add the weights to the voltage instead.
+    :return: the final (4, N) state after ceil(duration / dt) steps, and the neuron and time in ms of every spike,
+             sorted by time then neuron
+    """
+    steps = max(int(np.ceil(duration / dt - 1e-9)), 1)
+    delay_steps = network.delay_steps(dt)
+    window = int(delay_steps.min()) if len(delay_steps) else steps
+    if window < 1:
+        raise ValueError(f"The shortest delay ({network.delay.min()} ms) must be at least one step ({dt} ms)")
+    current = np.broadcast_to(np.asarray(current, dtype=float), network.size)
+
+    if processes == 1:
+        state, spike_neurons, spike_steps = simulate_partition(network, np.arange(network.size), current, steps, dt,
+                                                               window, threshold, LocalExchange(), synapse)
+    else:
+        if parts is None:
+            parts = partition(network, processes)
+        partitions = [np.flatnonzero(parts == index) for index in range(processes)]
+        # A neuron crosses the threshold at most every other step
+        capacity = max(len(neurons) for neurons in partitions) * (window // 2 + 1)
+
+        context = multiprocessing.get_context()
+        exchange = SharedMemoryExchange(processes, capacity, context.Barrier(processes))
+        final = shared_memory.SharedMemory(create=True, size=4 * network.size * 8)
+        results = context.Queue()
+        workers = [context.Process(target=_worker, args=(index, network, neurons, current, steps, dt, window,
+                                                         threshold, exchange, synapse, final.name, results))
+                   for index, neurons in enumerate(partitions)]
+        try:
+            for worker in workers:
+                worker.start()
+            collected = [results.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+            failed = [message for _, neurons, message in collected if neurons is None]
+            if failed:
+                raise RuntimeError(f"A worker failed: {failed[0]}")
+            state = np.ndarray((4, network.size), buffer=final.buf).copy()
+            spike_neurons = np.concatenate([neurons for _, neurons, _ in collected])
+            spike_steps = np.concatenate([steps for _, _, steps in collected])
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+            exchange.close()
+            exchange.unlink()
+            final.close()
+            final.unlink()
+
+    order = np.lexsort((spike_neurons, spike_steps))
+    return state, spike_neurons[order], spike_steps[order] * dt
+
+
+#####################################################################
+
+
+def weak_scaling(neurons_per_process=20000, processes=(1, 2, 4, 8), duration=20.0, connections_per_neuron=10):
+    """
+    Weak scaling: the network grows with the number of processes, so every process always has the same number of
+    neurons. Ideally the wall time stays the same.
+
+    :return: a list of dicts of the process count, neurons, cut connections and wall time
+    """
+    results = []
+    for count in processes:
+        size = neurons_per_process * count
+        # Mostly local connections (within 50 neurons either side), as in a sheet of cortex, with delays of 1-5 ms
+        rng = np.random.default_rng(0)
+        pre = np.repeat(np.arange(size), connections_per_neuron)
+        post = (pre + rng.integers(-50, 51, len(pre))) % size
+        network = Network(size, pre, post, weight=rng.uniform(0, 10, len(pre)), delay=rng.uniform(1, 5, len(pre)))
+        current = rng.uniform(0, 10, size)
+
+        parts = partition(network, count)
+        start = time.perf_counter()
+        _, spike_neurons, _ = simulate(network, duration, current=current, processes=count, parts=parts)
+        results.append({"processes": count, "neurons": size, "cut": cut_edges(network, parts),
+                        "connections": network.connections, "spikes": len(spike_neurons),
+                        "seconds": time.perf_counter() - start})
+    return results
+
+
+if __name__ == "__main__":
+    print(f"{os.cpu_count()} CPUs")
+    print(f"{'processes':>10}{'neurons':>9}{'cut':>9}{'spikes':>9}{'seconds':>9}")
+    for result in weak_scaling():
+        print(f"{result['processes']:>10}{result['neurons']:>9}{result['cut']:>9}{result['spikes']:>9}"
+              f"{result['seconds']:9.2f}")
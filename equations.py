@@ -0,0 +1,706 @@
+import ast
+import hashlib
+import re
+
+import numpy as np
+from scipy.integrate import odeint
+from scipy.special import exprel
+
+from clock import Clock
+from instrumentation import INSTRUMENTS
+from jacobian import banded_jacobian, exprel_derivative, odeint_stats, sparse_jacobian
+
+"""
+Models written as equations rather than code. A block of equations in the style of the eqs string in
+brian_singleneuron.py:
+
+    dv/dt = (I + Im) / C : mV
+    Im = gK * n**4 * (EK - v) + gNa * m**3 * h * (ENa - v) + gL * (EL - v) : uA
+    I : uA  # applied current
+
+is parsed into a differential equation for every dx/dt line, subexpressions for the name = expr lines and parameters
+for everything else. The subexpressions are substituted in, the Jacobian is found by differentiating the expressions
+symbolically, and both are turned into the source of one vectorised NumPy function each, with every expression that
+appears more than once worked out only once. The compiled model is cached by the hash of its equations, so making the
+same model again costs nothing.
+
+Everything is in the units neuron.py uses (mV, ms, uA, mS, uF); the unit after the colon is only kept as a label. Unit
+names can still appear inside expressions, as in the Brian equations, and stand for their size in those units.
+"""
+
+#####################################################################
+
+# Functions the equations can use, and what they are in the generated code
+FUNCTIONS = {
+    "exp": np.exp, "log": np.log, "sqrt": np.sqrt, "sin": np.sin, "cos": np.cos, "tanh": np.tanh, "exprel": exprel,
+    "exprel_derivative": exprel_derivative,
+}
+
+# The size of each unit name in the units of the native engine, used where one appears inside an expression
+UNITS = {
+    "mV": 1.0, "volt": 1e3, "ms": 1.0, "second": 1e3, "Hz": 1e-3, "kHz": 1.0, "uA": 1.0, "nA": 1e-3, "amp": 1e6,
+    "uF": 1.0, "farad": 1e6, "mS": 1.0, "msiemens": 1.0, "siemens": 1e3, "cm": 1.0, "meter": 100.0, "um": 1e-4,
+}
+
+# The Hodgkin-Huxley equations of neuron.py
+HH_EQUATIONS = """
+dn/dt = alphan * (1 - n) - betan * n : 1
+dm/dt = alpham * (1 - m) - betam * m : 1
+dh/dt = alphah * (1 - h) - betah * h : 1
+dv/dt = (I + Im) / C : mV
+Im = gK * n**4 * (EK - v) + gNa * m**3 * h * (ENa - v) + gL * (EL - v) : uA
+I : uA  # applied current
+# exprel keeps the alpha rates accurate where the usual form is 0/0 (v = -55 and v = -40)
+alphan = 0.1 / exprel(-(v + 55) / 10) : 1/ms
+betan = 0.125 * exp(-(v + 65) / 80) : 1/ms
+alpham = 1 / exprel(-(v + 40) / 10) : 1/ms
+betam = 4 * exp(-(v + 65) / 18) : 1/ms
+alphah = 0.07 * exp(-(v + 65) / 20) : 1/ms
+betah = 1 / (1 + exp(-(v + 35) / 10)) : 1/ms
+"""
+
+# The neuron variants, as equations and the values they start with. They only differ in their initial voltage.
+_HH_CONSTANTS = {"EL": -54.4, "ENa": 50, "EK": -70, "gL": 0.3, "gNa": 120, "gK": 36, "C": 1e-6, "I": 0}
+PRESETS = {
+    "defaultHH": (HH_EQUATIONS, {**_HH_CONSTANTS, "n": 0.5, "m": 0, "h": 0, "v": -65}),
+    "modifiedHH": (HH_EQUATIONS, {**_HH_CONSTANTS, "n": 0.5, "m": 0, "h": 0, "v": -62}),
+}
+
+_DERIVATIVE = re.compile(r"^d(\w+)/dt$")
+
+# Compiled models, by the hash of their equations
+_compiled = {}
+
+
+#####################################################################
+
+# The expressions are kept as nested tuples, e.g. ("add", ("name", "v"), ("const", 55.0)), so identical expressions
+# compare and hash equal. Building them through these functions folds constants and drops the zeros and ones that
+# differentiating leaves behind.
+
+ZERO = ("const", 0.0)
+ONE = ("const", 1.0)
+
+
+def const(value):
+    return ("const", float(value))
+
+
+def is_const(e, value=None):
+    return e[0] == "const" and (value is None or e[1] == value)
+
+
+def add(a, b):
+    if is_const(a) and is_const(b):
+        return const(a[1] + b[1])
+    if is_const(a, 0):
+        return b
+    if is_const(b, 0):
+        return a
+    return ("add", a, b)
+
+
+def sub(a, b):
+    if is_const(a) and is_const(b):
+        return const(a[1] - b[1])
+    if is_const(b, 0):
+        return a
+    if is_const(a, 0):
+        return neg(b)
+    if a == b:
+        return ZERO
+    return ("sub", a, b)
+
+
+def mul(a, b):
+    if is_const(a) and is_const(b):
+        return const(a[1] * b[1])
+    if is_const(a, 0) or is_const(b, 0):
+        return ZERO
+    if is_const(a, 1):
+        return b
+    if is_const(b, 1):
+        return a
+    if is_const(a, -1):
+        return neg(b)
+    if is_const(b, -1):
+        return neg(a)
+    return ("mul", a, b)
+
+
+def div(a, b):
+    if is_const(a) and is_const(b) and b[1] != 0:
+        return const(a[1] / b[1])
+    if is_const(a, 0):
+        return ZERO
+    if is_const(b, 1):
+        return a
+    return ("div", a, b)
+
+
+def power(a, b):
+    if is_const(a) and is_const(b):
+        return const(a[1] ** b[1])
+    if is_const(b, 0):
+        return ONE
+    if is_const(b, 1):
+        return a
+    return ("pow", a, b)
+
+
+def neg(a):
+    if is_const(a):
+        return const(-a[1])
+    if a[0] == "neg":
+        return a[1]
+    return ("neg", a)
+
+
+def call(function, a):
+    return ("call", function, a)
+
+
+_BINARY = {ast.Add: add, ast.Sub: sub, ast.Mult: mul, ast.Div: div, ast.Pow: power}
+
+
+def from_ast(node, line):
+    """
+    Turns a parsed Python expression into the tuple form, rejecting anything an equation can't contain.
+
+    :param node: the ast node
+    :param line: the equation it came from, for the error message
+    """
+    if isinstance(node, ast.Expression):
+        return from_ast(node.body, line)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return const(node.value)
+    if isinstance(node, ast.Name):
+        return ("name", node.id)
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+        return _BINARY[type(node.op)](from_ast(node.left, line), from_ast(node.right, line))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        operand = from_ast(node.operand, line)
+        return neg(operand) if isinstance(node.op, ast.USub) else operand
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS
+            and len(node.args) == 1 and not node.keywords):
+        return call(node.func.id, from_ast(node.args[0], line))
+    raise ValueError(f"Unsupported expression {ast.unparse(node)!r} in equation {line!r}")
+
+
+def names(e):
+    """
+    :return: the set of names an expression uses
+    """
+    if e[0] == "name":
+        return {e[1]}
+    if e[0] == "const":
+        return set()
+    found = set()
+    for child in e[2:] if e[0] == "call" else e[1:]:
+        found |= names(child)
+    return found
+
+
+def substitute(e, values):
+    """
+    :param values: a dict of name: expression to put in place of those names
+    :return: the expression with the names replaced
+    """
+    if e[0] == "name":
+        return values.get(e[1], e)
+    if e[0] == "const":
+        return e
+    if e[0] == "call":
+        return call(e[1], substitute(e[2], values))
+    if e[0] == "neg":
+        return neg(substitute(e[1], values))
+    build = {"add": add, "sub": sub, "mul": mul, "div": div, "pow": power}[e[0]]
+    return build(substitute(e[1], values), substitute(e[2], values))
+
+
+def differentiate(e, x):
+    """
+    :param e: an expression
+    :param x: the name of the variable to differentiate with respect to
+    :return: de/dx as an expression
+    """
+    kind = e[0]
+    if kind == "const":
+        return ZERO
+    if kind == "name":
+        return ONE if e[1] == x else ZERO
+    if kind == "neg":
+        return neg(differentiate(e[1], x))
+    if kind == "call":
+        function, a = e[1], e[2]
+        da = differentiate(a, x)
+        if is_const(da, 0):
+            return ZERO
+        outer = {
+            "exp": lambda: e,
+            "log": lambda: div(ONE, a),
+            "sqrt": lambda: div(const(0.5), e),
+            "sin": lambda: call("cos", a),
+            "cos": lambda: neg(call("sin", a)),
+            "tanh": lambda: sub(ONE, power(e, const(2))),
+            "exprel": lambda: call("exprel_derivative", a),
+        }
+        if function not in outer:
+            raise ValueError(f"Can't differentiate {function}")
+        return mul(outer[function](), da)
+
+    a, b = e[1], e[2]
+    da, db = differentiate(a, x), differentiate(b, x)
+    if kind == "add":
+        return add(da, db)
+    if kind == "sub":
+        return sub(da, db)
+    if kind == "mul":
+        return add(mul(da, b), mul(a, db))
+    if kind == "div":
+        return sub(div(da, b), div(mul(a, db), power(b, const(2))))
+    # kind == "pow"
+    if is_const(db, 0):
+        if not is_const(b):
+            # An exponent which doesn't depend on x, but isn't a number either
+            return mul(mul(b, power(a, sub(b, ONE))), da)
+        return mul(mul(b, power(a, const(b[1] - 1))), da)
+    return mul(e, add(mul(db, call("log", a)), div(mul(b, da), a)))
+
+
+#####################################################################
+
+# Generating the code
+
+
+def _render(e, emit):
+    """
+    :param emit: turns a child expression into code
+    :return: the Python code for an expression, fully bracketed
+    """
+    kind = e[0]
+    if kind == "const":
+        return repr(e[1])
+    if kind == "name":
+        return e[1]
+    if kind == "neg":
+        return f"(-{emit(e[1])})"
+    if kind == "call":
+        return f"{e[1]}({emit(e[2])})"
+    symbol = {"add": "+", "sub": "-", "mul": "*", "div": "/", "pow": "**"}[kind]
+    return f"({emit(e[1])} {symbol} {emit(e[2])})"
+
+
+def _subtrees(e, counts):
+    """
+    Counts how many times every expression (not just the leaves) appears within e.
+    """
+    if e[0] in ("const", "name"):
+        return
+    counts[e] = counts.get(e, 0) + 1
+    if counts[e] > 1:
+        # Its own parts have been counted already, and will be computed once along with it
+        return
+    for child in e[2:] if e[0] == "call" else e[1:]:
+        _subtrees(child, counts)
+
+
+def generate(name, arguments, header, outputs, footer):
+    """
+    Writes the source of a function that evaluates several expressions. Every expression appearing more than once
+    across them is computed once into a temporary first (common subexpression elimination).
+
+    :param name: the function's name
+    :param arguments: its arguments
+    :param header: lines setting up the names the expressions use
+    :param outputs: a list of (target, expression) pairs, each becoming the line target = expression
+    :param footer: the lines ending the function
+    :return: the source code
+    """
+    counts = {}
+    for _, e in outputs:
+        _subtrees(e, counts)
+
+    lines = list(header)
+    temporaries = {}
+
+    def emit(e):
+        if e in temporaries:
+            return temporaries[e]
+        code = _render(e, emit)
+        if counts.get(e, 0) > 1:
+            temporaries[e] = f"_{len(temporaries)}"
+            lines.append(f"{temporaries[e]} = {code}")
+            return temporaries[e]
+        return code
+
+    for target, e in outputs:
+        lines.append(f"{target} = {emit(e)}")
+    lines += footer
+    return f"def {name}({', '.join(arguments)}):\n" + "".join(f"    {line}\n" for line in lines)
+
+
+def parse_equations(equations):
+    """
+    :param equations: the block of equations
+    :return: the differential equations, subexpressions and units, as dicts in the order they were written, and the
+             names declared as parameters
+    """
+    differential, subexpressions, units, declared = {}, {}, {}, []
+    for line in equations.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        text, _, unit = line.partition(":")
+        # Anything in brackets after the unit are Brian flags, e.g. (point current)
+        unit = unit.split("(", 1)[0].strip()
+        if "=" not in text:
+            name = text.strip()
+            if not name.isidentifier():
+                raise ValueError(f"Can't parse equation {line!r}")
+            declared.append(name)
+            units[name] = unit
+            continue
+
+        left, right = (part.strip() for part in text.split("=", 1))
+        try:
+            expression = from_ast(ast.parse(right, mode="eval"), line)
+        except SyntaxError:
+            raise ValueError(f"Can't parse equation {line!r}") from None
+        derivative = _DERIVATIVE.match(left)
+        name = derivative.group(1) if derivative else left
+        if not name.isidentifier():
+            raise ValueError(f"Can't parse equation {line!r}")
+        if name in differential or name in subexpressions:
+            raise ValueError(f"{name} is defined twice")
+        (differential if derivative else subexpressions)[name] = expression
+        units[name] = unit
+
+    for name in list(differential) + list(subexpressions) + declared:
+        if name.startswith("_") or name in FUNCTIONS or name in ("np", "t"):
+            raise ValueError(f"{name} can't be used as a variable name")
+    if not differential:
+        raise ValueError("The equations don't have any differential equations")
+    return differential, subexpressions, units, declared
+
+
+def equations_key(equations):
+    """
+    :return: the hash the compiled model is cached under, which ignores comments and spacing
+    """
+    lines = (" ".join(line.split("#", 1)[0].split()) for line in equations.splitlines())
+    return hashlib.sha256("\n".join(line for line in lines if line).encode()).hexdigest()
+
+
+class Model:
+    """
+    A class to represent a set of equations compiled into vectorised NumPy functions.
+
+    ...
+
+    Attributes
+    ----------
+    key : str
+        the hash of the equations
+    state_variables : tuple
+        the variables with a differential equation, in the order they were written, which is the order of the rows
+        of the state
+    parameters : tuple
+        every other name the equations depend on
+    units : dict
+        the unit written after each variable, subexpression and parameter
+    expressions : dict
+        the right hand side of each differential equation, with the subexpressions substituted in
+    source : str
+        the generated code of rhs and jacobian
+
+    Methods
+    -------
+    rhs(state, t, parameters):
+        The derivative of every state variable for every neuron, as a (S, N) array.
+
+    jacobian(state, t, parameters):
+        The Jacobian of every neuron, as an (N, S, S) array.
+    """
+
+    def __init__(self, equations):
+        """
+        Use compile_equations() rather than this, so the same equations are only compiled once.
+
+        :param equations: the block of equations
+        """
+        differential, subexpressions, self.units, declared = parse_equations(equations)
+        self.key = equations_key(equations)
+        self.state_variables = tuple(differential)
+
+        # Units used inside the expressions stand for their size, unless the name is used for something else
+        defined = set(differential) | set(subexpressions) | set(declared)
+        values = {name: const(size) for name, size in UNITS.items() if name not in defined}
+
+        # Substituting the subexpressions in, in whatever order they depend on each other
+        pending = dict(subexpressions)
+        while pending:
+            ready = [name for name, e in pending.items() if not names(e) & set(pending)]
+            if not ready:
+                raise ValueError(f"The subexpressions {', '.join(pending)} depend on each other in a cycle")
+            for name in ready:
+                values[name] = substitute(pending.pop(name), values)
+
+        self.expressions = {name: substitute(e, values) for name, e in differential.items()}
+        used = set().union(*(names(e) for e in self.expressions.values()))
+        self.parameters = tuple(dict.fromkeys(
+            [name for name in declared if name not in differential] +
+            sorted(used - set(differential) - {"t"} - set(declared))))
+
+        self.source = self._generate()
+        namespace = {"np": np, **FUNCTIONS}
+        exec(compile(self.source, f"<equations {self.key[:12]}>", "exec"), namespace)
+        self.rhs = namespace["rhs"]
+        self.jacobian = namespace["jacobian"]
+
+    def _generate(self):
+        """
+        :return: the source of the rhs and jacobian functions
+        """
+        header = [f"{self.state_variables[0]}, = _state" if len(self.state_variables) == 1 else
+                  f"{', '.join(self.state_variables)} = _state"]
+        header += [f"{name} = _parameters[{name!r}]" for name in self.parameters]
+        header.append("t = _t")
+        arguments = ("_state", "_t", "_parameters")
+
+        rhs = generate("rhs", arguments, header + ["_out = np.empty(_state.shape)"],
+                       [(f"_out[{row}]", e) for row, e in enumerate(self.expressions.values())],
+                       ["return _out"])
+
+        entries = []
+        for row, e in enumerate(self.expressions.values()):
+            for column, x in enumerate(self.state_variables):
+                derivative = differentiate(e, x)
+                if not is_const(derivative, 0):
+                    entries.append((f"_out[:, {row}, {column}]", derivative))
+        size = len(self.state_variables)
+        jacobian = generate("jacobian", arguments, header + [f"_out = np.zeros((_state.shape[1], {size}, {size}))"],
+                            entries, ["return _out"])
+        return rhs + "\n\n" + jacobian
+
+    def __repr__(self):
+        return f"Model(state_variables={self.state_variables}, parameters={self.parameters})"
+
+
+def compile_equations(equations):
+    """
+    :param equations: the block of equations
+    :return: the compiled Model, from the cache if these equations have been compiled before
+    """
+    key = equations_key(equations)
+    if key not in _compiled:
+        _compiled[key] = Model(equations)
+    return _compiled[key]
+
+
+#####################################################################
+
+
+class ModelPopulation:
+    """
+    A class to represent a population of N neurons following any compiled Model, integrated together.
+
+    ...
+
+    Attributes
+    ----------
+    model : Model
+        the equations every neuron follows
+    size : int
+        number of neurons in the population
+    state : np.ndarray
+        contiguous (S, N) array holding the state variables of every neuron, in model.state_variables order
+    values : dict
+        the per-neuron parameters, each an array of length N
+    recorder : recorder.TraceRecorder or None
+        if set, the solution of every run is recorded into it
+    solver_stats : dict
+        the RHS evaluations (nfe), Jacobian evaluations (nje) and steps of the last run
+    clock : clock.Clock
+        the time the population has reached
+
+    The state variables and parameters can also be read and set by name, e.g. population.v or population.gNa.
+
+    Methods
+    -------
+    preset(name, size):
+        A population of one of the PRESETS.
+
+    derivatives(state) / f(init, t) / jacobian(init, t):
+        As in population.NeuronPopulation, from the generated functions.
+
+    run(time_length, current_start):
+        Runs odeint for every neuron over a specified time period in ms.
+    """
+
+    def __init__(self, model, size, recorder=None, **values):
+        """
+        :param model: a Model, or the equations to compile one from
+        :param size: the number of neurons in the population
+        :param recorder: an optional recorder.TraceRecorder that every run() is recorded into
+        :param values: the initial value of every state variable and the value of every parameter, each a scalar
+                       (shared by every neuron) or an array of length N
+        """
+        if isinstance(model, str):
+            model = compile_equations(model)
+        expected = set(model.state_variables) | set(model.parameters)
+        unknown = set(values) - expected
+        if unknown:
+            raise ValueError(f"Unknown model values: {', '.join(sorted(unknown))}")
+        missing = expected - set(values)
+        if missing:
+            raise ValueError(f"Values are needed for: {', '.join(sorted(missing))}")
+
+        object.__setattr__(self, "model", model)
+        object.__setattr__(self, "values", {})
+        self.size = size
+        self.state = np.empty((len(model.state_variables), size))
+        for row, name in enumerate(model.state_variables):
+            self.state[row] = values[name]
+        for name in model.parameters:
+            self.values[name] = np.full(size, values[name], dtype=float)
+
+        self.recorder = recorder
+        self.clock = Clock()
+        self.solver_stats = {}
+
+    @classmethod
+    def preset(cls, name, size, **overrides):
+        """
+        :param name: one of PRESETS, e.g. "defaultHH" or "modifiedHH"
+        :param size: the number of neurons
+        :param overrides: values to use instead of the preset's
+        """
+        equations, values = PRESETS[name]
+        return cls(equations, size, **{**values, **overrides})
+
+    def __len__(self):
+        return self.size
+
+    def __getattr__(self, name):
+        model = object.__getattribute__(self, "model")
+        if name in model.state_variables:
+            return self.state[model.state_variables.index(name)]
+        if name in model.parameters:
+            return self.values[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in self.model.state_variables:
+            self.state[self.model.state_variables.index(name)] = value
+        elif name in self.model.parameters:
+            self.values[name][:] = value
+        else:
+            super().__setattr__(name, value)
+
+    @property
+    def time(self):
+        return self.clock.t
+
+    def derivatives(self, state, t=0.0):
+        """
+        :param state: an (S, N) array of the state variables
+        :return: an (S, N) array of their derivatives
+        """
+        return self.model.rhs(state, t, self.values)
+
+    def f(self, init, t):
+        """
+        The function odeint integrates over. The state is passed neuron by neuron, so the Jacobian is banded.
+
+        :param init: the flattened (N, S) state
+        :param t: the time instant this solution is being made for
+        :return: the flattened (N, S) derivatives
+        """
+        width = len(self.model.state_variables)
+        return self.model.rhs(init.reshape(self.size, width).T, t, self.values).T.ravel()
+
+    def blocks(self, init, t=0.0):
+        """
+        :return: the (N, S, S) per-neuron Jacobians at the flattened state init
+        """
+        width = len(self.model.state_variables)
+        return self.model.jacobian(init.reshape(self.size, width).T, t, self.values)
+
+    def jacobian(self, init, t):
+        """
+        :return: the banded Jacobian of f matching odeint_options(), or the full one for a single neuron
+        """
+        blocks = self.blocks(init, t)
+        if self.size == 1:
+            return blocks[0]
+        return banded_jacobian(blocks)
+
+    def sparse_jacobian(self, init, t=None):
+        """
+        :return: the block-diagonal Jacobian of f as a sparse matrix, for the implicit solve_ivp methods
+        """
+        return sparse_jacobian(self.blocks(init, 0.0 if t is None else t))
+
+    def odeint_options(self):
+        """
+        :return: the odeint keyword arguments giving the generated Jacobian and its bands
+        """
+        if self.size == 1:
+            return {"Dfun": self.jacobian, "mxstep": 5000}
+        bands = len(self.model.state_variables) - 1
+        return {"Dfun": self.jacobian, "ml": bands, "mu": bands, "mxstep": 5000}
+
+    def run(self, time_length, current_start=None, samples=1000):
+        """
+        Runs odeint for the whole population over a specified time period in ms.
+
+        :param time_length: the length of time to run the simulation for
+        :param current_start: the current I to inject, if the model has one. None keeps the current I.
+        :param samples: the number of time points to return the solution at
+        :return: the timestamps (samples,) and the solution as a (samples, S, N) array
+        """
+        if current_start is not None:
+            self.values["I"][:] = current_start
+        width = len(self.model.state_variables)
+
+        with INSTRUMENTS.phase("integrate"):
+            time_region = np.linspace(self.clock.t, self.clock.t + time_length, samples)
+            solution, info = odeint(INSTRUMENTS.rhs(self.f), self.state.T.ravel(), time_region, full_output=True,
+                                    **self.odeint_options())
+            self.solver_stats = odeint_stats(info)
+            solution = solution.reshape(samples, self.size, width).transpose(0, 2, 1)
+            self.state[:] = solution[-1]
+        INSTRUMENTS.solver_call(self.solver_stats)
+
+        self.clock.advance_to(time_region[-1])
+
+        if self.recorder is not None:
+            with INSTRUMENTS.phase("record"):
+                self.recorder.record(time_region, solution, self)
+
+        return time_region, solution
+
+
+if __name__ == "__main__":
+    import time
+    from population import NeuronPopulation
+
+    start = time.perf_counter()
+    model = compile_equations(HH_EQUATIONS)
+    compile_time = time.perf_counter() - start
+    start = time.perf_counter()
+    compile_equations(HH_EQUATIONS)
+    print(f"Compiled in {compile_time * 1e3:.1f} ms, from the cache in {(time.perf_counter() - start) * 1e6:.1f} us")
+    print(model.source)
+
+    # The generated functions against the hand written ones of population.py
+    size = 1000
+    rng = np.random.default_rng(0)
+    values = {"n": rng.uniform(0, 1, size), "m": rng.uniform(0, 1, size), "h": rng.uniform(0, 1, size),
+              "v": rng.uniform(-90, 40, size), "gNa": rng.uniform(100, 140, size), "I": rng.uniform(0, 2, size)}
+    generated = ModelPopulation.preset("defaultHH", size, **values)
+    written = NeuronPopulation(size, **values)
+    init = written.state.T.ravel()
+    print(f"Largest difference in f: {np.abs(generated.f(init, 0) - written.f(init, 0)).max():.2e}, "
+          f"in the Jacobian: {np.abs(generated.jacobian(init, 0) - written.jacobian(init, 0)).max():.2e}")
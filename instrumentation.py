@@ -0,0 +1,190 @@
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+"""
+Instrumentation of the hot paths: counters for solver work and timers for named phases (integrate, record, propagate,
+post-process, plot), per neuron and over a whole run. It is off by default. While it is off, phase() hands back one shared
+do-nothing context and rhs() hands back the function it was given, so the simulation code runs exactly as it would
+without it.
+
+Phases can nest: the rhs phase is time spent inside the solver's calls to f, so it is part of integrate.
+
+    with instrumented() as instruments:
+        neurons[0].get_data_behind()
+        neurons[0].send_data_forward()
+    print(instruments.summary())
+"""
+
+#####################################################################
+
+# Returned by phase() while disabled
+_NO_PHASE = nullcontext()
+
+
+class Instrumentation:
+    """
+    A class to represent a set of counters and phase timers.
+
+    ...
+
+    Attributes
+    ----------
+    enabled : bool
+        whether anything is being counted or timed
+    counters : dict
+        the count of every counter by name: solver_calls, steps, rhs_evaluations, jacobian_evaluations and
+        rejected_steps
+    phases : dict
+        [calls, seconds] for every (phase, neuron) pair timed. neuron is None for phases not tied to one neuron.
+
+    Methods
+    -------
+    phase(name, neuron):
+        A context manager timing a block of code as a phase.
+
+    rhs(f) / solver_call(stats):
+        Instruments an RHS function, and adds the statistics of one solver call.
+
+    summary() / to_json(path):
+        A table of everything counted and timed, or the same as JSON.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.counters = defaultdict(int)
+        self.phases = defaultdict(lambda: [0, 0.0])
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.counters.clear()
+        self.phases.clear()
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] += amount
+
+    def phase(self, name, neuron=None):
+        """
+        :param name: the phase, e.g. "integrate", "record", "propagate" or "post-process"
+        :param neuron: the neuron the time is spent on, if any
+        :return: a context manager timing the code inside it
+        """
+        if not self.enabled:
+            return _NO_PHASE
+        return self._timed(name, neuron)
+
+    @contextmanager
+    def _timed(self, name, neuron):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            totals = self.phases[(name, neuron)]
+            totals[0] += 1
+            totals[1] += time.perf_counter() - start
+
+    def rhs(self, f):
+        """
+        Wraps an odeint-style RHS function f(y, t) so the time spent in it is timed as the "rhs" phase, and every time
+        the solver asks for an earlier time than the last call is counted as a rejected step (it only goes back after
+        throwing a step away).
+
+        :return: the wrapped function, or f itself while disabled
+        """
+        if not self.enabled:
+            return f
+        last_t = [-float("inf")]
+        totals = self.phases[("rhs", None)]
+
+        def timed(y, t):
+            if t < last_t[0]:
+                self.counters["rejected_steps"] += 1
+            last_t[0] = t
+            start = time.perf_counter()
+            result = f(y, t)
+            totals[0] += 1
+            totals[1] += time.perf_counter() - start
+            return result
+        return timed
+
+    def solver_call(self, stats):
+        """
+        Adds the solver statistics of one run, as in Neuron.solver_stats.
+        """
+        if not self.enabled:
+            return
+        self.counters["solver_calls"] += 1
+        self.counters["steps"] += stats.get("steps", 0)
+        self.counters["rhs_evaluations"] += stats.get("nfe", 0)
+        self.counters["jacobian_evaluations"] += stats.get("nje", 0)
+
+    def phase_totals(self):
+        """
+        :return: [calls, seconds] for every phase, summed over neurons
+        """
+        totals = defaultdict(lambda: [0, 0.0])
+        for (name, _), (calls, seconds) in self.phases.items():
+            totals[name][0] += calls
+            totals[name][1] += seconds
+        return dict(totals)
+
+    def summary(self):
+        """
+        :return: a table of the counters and of the calls and time in every phase
+        """
+        lines = [f"{'counter':<22}{'count':>12}"]
+        lines += [f"{name:<22}{count:>12}" for name, count in sorted(self.counters.items())]
+        lines.append("")
+        lines.append(f"{'phase':<22}{'calls':>12}{'seconds':>12}{'per call ms':>14}")
+        for name, (calls, seconds) in sorted(self.phase_totals().items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<22}{calls:>12}{seconds:>12.4f}{seconds / calls * 1e3:>14.4f}")
+        return "\n".join(lines)
+
+    def to_json(self, path=None):
+        """
+        :param path: a file to write to, if given
+        :return: the counters, the phase totals and the per neuron phase times as a JSON string
+        """
+        per_neuron = defaultdict(dict)
+        for (name, neuron), (calls, seconds) in self.phases.items():
+            if neuron is not None:
+                per_neuron[str(neuron)][name] = {"calls": calls, "seconds": seconds}
+        text = json.dumps({
+            "counters": dict(self.counters),
+            "phases": {name: {"calls": calls, "seconds": seconds}
+                       for name, (calls, seconds) in self.phase_totals().items()},
+            "neurons": per_neuron,
+        }, indent=2)
+        if path is not None:
+            with open(path, "w") as file:
+                file.write(text)
+        return text
+
+
+# The instruments the simulation modules report to
+INSTRUMENTS = Instrumentation()
+
+
+@contextmanager
+def instrumented(reset=True):
+    """
+    Turns the instrumentation on for a block of code.
+
+    :param reset: whether to start from zero rather than adding to what was counted before
+    :return: the Instrumentation, to read the results from
+    """
+    if reset:
+        INSTRUMENTS.reset()
+    was_enabled = INSTRUMENTS.enabled
+    INSTRUMENTS.enable()
+    try:
+        yield INSTRUMENTS
+    finally:
+        INSTRUMENTS.enabled = was_enabled
@@ -0,0 +1,223 @@
+import time
+
+import numpy as np
+from scipy.integrate import odeint
+
+from synapses import advance_synapses, synaptic_terms
+
+"""
+Fixed-step integrators for the HH equations, as an alternative to odeint. Between steps every gating variable follows
+dx/dt = alpha - (alpha + beta) x, which is linear in x, so with the rates held for one step it can be advanced with its
+exact exponential solution. The voltage is then advanced with a step that stays stable however small C makes the
+membrane time constant, so dt only has to resolve the gating dynamics. Everything is vectorised over the (4, N) state.
+"""
+
+#####################################################################
+
+
+def gate_step(x, alpha, beta, dt):
+    """
+    The exact solution of dx/dt = alpha * (1 - x) - beta * x after dt, with alpha and beta held constant.
+
+    :return: the gating variable after one step
+    """
+    total = alpha + beta
+    x_inf = alpha / total
+    return x_inf + (x - x_inf) * np.exp(-dt * total)
+
+
+def membrane_terms(n, m, h, source, dt=None):
+    """
+    Writes the membrane equation as C dv/dt = g_total * (E_total - v), which holds for fixed gates.
+
+    :param source: the Neuron or NeuronPopulation with the conductances, reversal potentials and current
+    :param dt: the step, over which the mean of any synaptic conductances and currents is used
+    :return: the total conductance and the voltage the membrane is relaxing towards
+    """
+    gK = source.gK * n**4
+    gNa = source.gNa * m**3 * h
+    g_total = gK + gNa + source.gL
+    synapses = getattr(source, "synapses", None)
+    if not synapses:
+        return g_total, (gK * source.EK + gNa * source.ENa + source.gL * source.EL + source.I) / g_total
+
+    # Conductance based synapses are one more conductance, so they don't make the step any less stable
+    g_synapses, g_E_synapses, I_synapses = synaptic_terms(synapses, dt)
+    g_total = g_total + g_synapses
+    E_total = (gK * source.EK + gNa * source.ENa + source.gL * source.EL + source.I + g_E_synapses +
+               I_synapses) / g_total
+    return g_total, E_total
+
+
+def exp_euler_step(state, source, dt):
+    """
+    Exponential Euler, the method brian_singleneuron.py uses. Every variable (including v) is advanced with its exact
+    exponential solution, using the coefficients at the start of the step.
+
+    :param state: the (4, N) state, updated in place
+    :param source: the Neuron or NeuronPopulation being integrated
+    :param dt: the step in ms
+    """
+    n, m, h, v = state
+    alphan, betan, alpham, betam, alphah, betah = source.rates(v)
+    g_total, E_total = membrane_terms(n, m, h, source, dt)
+
+    state[0] = gate_step(n, alphan, betan, dt)
+    state[1] = gate_step(m, alpham, betam, dt)
+    state[2] = gate_step(h, alphah, betah, dt)
+    state[3] = E_total + (v - E_total) * np.exp(-dt * g_total / source.C)
+    advance_synapses(source, dt)
+
+
+def rush_larsen_step(state, source, dt):
+    """
+    Rush-Larsen. The gates are advanced with their exact exponential solutions first, then the voltage takes a
+    semi-implicit (backward Euler) step using the new gates.
+
+    :param state: the (4, N) state, updated in place
+    :param source: the Neuron or NeuronPopulation being integrated
+    :param dt: the step in ms
+    """
+    n, m, h, v = state
+    alphan, betan, alpham, betam, alphah, betah = source.rates(v)
+
+    state[0] = gate_step(n, alphan, betan, dt)
+    state[1] = gate_step(m, alpham, betam, dt)
+    state[2] = gate_step(h, alphah, betah, dt)
+
+    g_total, E_total = membrane_terms(state[0], state[1], state[2], source, dt)
+    scale = dt * g_total / source.C
+    state[3] = (v + scale * E_total) / (1 + scale)
+    advance_synapses(source, dt)
+
+
+STEPPERS = {
+    "exp_euler": exp_euler_step,
+    "rush_larsen": rush_larsen_step,
+}
+
+
+def apply_current(source, current):
+    """
+    Sets the injected current of a Neuron (a scalar I) or a NeuronPopulation (an array I, which is filled in place).
+    """
+    if isinstance(source.I, np.ndarray):
+        source.I[:] = current
+    else:
+        source.I = current
+
+
+def integrate(state, source, start_time, time_length, dt, method, samples, current=None, stop_threshold=None):
+    """
+    Runs a fixed-step integrator over a time period, keeping the state at evenly spread steps.
+
+    :param state: the (4, N) state to start from, updated in place to the final state
+    :param source: the Neuron or NeuronPopulation being integrated
+    :param start_time: the time the state is at
+    :param time_length: the length of time to run for. dt is shrunk slightly if it doesn't divide it exactly.
+    :param dt: the largest step to take in ms
+    :param method: one of the STEPPERS
+    :param samples: the number of time points to keep
+    :param current: optionally a function of the time since start_time giving the current to inject. It is evaluated
+                    at the middle of every step. Without it the source's current I is used throughout.
+    :param stop_threshold: if given, the run stops at the end of the first step where any neuron's v reaches this
+    :return: the kept timestamps (samples,), the state at each of them (samples, 4, N) and the solver statistics. If
+             the run stopped early, the last sample is the step it stopped at.
+    """
+    if method not in STEPPERS:
+        raise ValueError(f"Unknown integration method {method}, expected one of {', '.join(STEPPERS)}")
+    step = STEPPERS[method]
+
+    steps = max(int(np.ceil(time_length / dt - 1e-9)), 1)
+    dt = time_length / steps
+
+    # The steps we keep the state at, always including the first and last
+    kept_steps = np.unique(np.round(np.linspace(0, steps, min(samples, steps + 1))).astype(int))
+    solution = np.empty((len(kept_steps),) + state.shape)
+    solution[0] = state
+
+    kept = 1
+    for i in range(1, steps + 1):
+        if current is not None:
+            apply_current(source, current((i - 0.5) * dt))
+        step(state, source, dt)
+        stop = stop_threshold is not None and np.any(state[3] >= stop_threshold)
+        if i == kept_steps[kept] or stop:
+            kept_steps[kept] = i
+            solution[kept] = state
+            kept += 1
+        if stop:
+            return start_time + kept_steps[:kept] * dt, solution[:kept], {"nfe": i, "nje": 0, "steps": i}
+
+    return start_time + kept_steps * dt, solution, {"nfe": steps, "nje": 0, "steps": steps}
+
+
+#####################################################################
+
+
+def benchmark(size=1, dts=(0.1, 0.05, 0.01, 0.005)):
+    """
+    Compares the fixed-step methods against odeint on the nobrian_singleneuron_defaultHH.py protocol: 50 ms rest, 3 ms
+    at 1 uA, then 50 ms rest. Each is checked against a tight tolerance odeint reference. The upstroke is so fast that a
+    tiny shift in spike time shows up as a large pointwise error, so the spike time and peak are compared too.
+
+    :param size: the number of neurons in the population
+    :param dts: the step sizes to try
+    :return: a list of dicts of the method, dt, wall time and errors against the reference
+    """
+    from population import NeuronPopulation
+
+    protocol = ((50, 0), (3, 1), (50, 0))
+
+    def run(method, dt=None, **odeint_options):
+        population = NeuronPopulation(size)
+        times = []
+        voltages = []
+        start = time.perf_counter()
+        for time_length, current in protocol:
+            if method == "odeint":
+                population.I[:] = current
+                time_region = np.linspace(population.time, population.time + time_length, int(time_length / 0.1) + 1)
+                solution = odeint(population.f, population.state.T.ravel(), time_region,
+                                  **{**population.odeint_options(), **odeint_options})
+                solution = solution.reshape(len(time_region), size, 4).transpose(0, 2, 1)
+                population.state[:] = solution[-1]
+                population.time = time_region[-1]
+            else:
+                time_region, solution = population.run(time_length, current, samples=int(time_length / 0.1) + 1,
+                                                       method=method, dt=dt)
+            times.append(time_region)
+            voltages.append(solution[:, 3, 0])
+        elapsed = time.perf_counter() - start
+
+        times = np.concatenate(times)
+        voltages = np.concatenate(voltages)
+        # First upward crossing of 0 mV, linearly interpolated between samples
+        crossing = np.flatnonzero((voltages[:-1] < 0) & (voltages[1:] >= 0))[0]
+        spike_time = times[crossing] + (times[crossing + 1] - times[crossing]) * \
+            -voltages[crossing] / (voltages[crossing + 1] - voltages[crossing])
+        return elapsed, voltages, spike_time
+
+    _, reference, reference_spike = run("odeint", rtol=1e-9, atol=1e-9, mxstep=100000)
+
+    def compare(method, dt, elapsed, voltages, spike_time):
+        return {"method": method, "dt": dt, "seconds": elapsed,
+                "max_error_mV": float(np.abs(voltages - reference).max()),
+                "peak_error_mV": float(abs(voltages.max() - reference.max())),
+                "spike_time_error_ms": float(abs(spike_time - reference_spike))}
+
+    results = [compare("odeint", None, *run("odeint"))]
+    for method in STEPPERS:
+        for dt in dts:
+            results.append(compare(method, dt, *run(method, dt)))
+    return results
+
+
+if __name__ == "__main__":
+    for size in (1, 1000):
+        print(f"50/3/50 ms protocol, {size} neuron(s)")
+        for result in benchmark(size):
+            dt = "adaptive" if result["dt"] is None else f"dt={result['dt']}"
+            print(f"  {result['method']:>12} {dt:>10}: {result['seconds'] * 1e3:8.1f} ms, "
+                  f"max error {result['max_error_mV']:.3g} mV, peak error {result['peak_error_mV']:.3g} mV, "
+                  f"spike time error {result['spike_time_error_ms']:.3g} ms")
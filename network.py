@@ -0,0 +1,205 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from neuron import Neuron
+
+"""
+Connectivity for large networks. Rather than every Neuron holding a list of the Neuron objects it connects to, a Network
+holds all of its connections as a compressed sparse row (CSR) matrix: one row per presynaptic neuron listing its
+postsynaptic neurons, with a weight and delay per connection. The synaptic input to every neuron from a step's spikes is
+then a single sparse matrix-vector product.
+"""
+
+#####################################################################
+
+
+class Network:
+    """
+    A class to represent the connections between N neurons.
+
+    ...
+
+    Attributes
+    ----------
+    size : int
+        the number of neurons, numbered 0 to size - 1
+    indptr : np.ndarray
+        the connections of neuron i are indptr[i] to indptr[i + 1] in the arrays below
+    post : np.ndarray
+        the postsynaptic neuron of each connection (int32)
+    weight : np.ndarray
+        the weight of each connection (float32)
+    delay : np.ndarray
+        the delay of each connection in ms (float32)
+    matrix : scipy.sparse.csr_matrix
+        the (pre, post) weight matrix, sharing its arrays with the above
+
+    Methods
+    -------
+    synaptic_input(spikes):
+        The total weight arriving at every neuron from a vector of which neurons spiked.
+
+    targets(neuron) / pre:
+        The neurons one neuron connects to, and the presynaptic neuron of every connection.
+
+    outgoing(neurons) / delay_steps(dt):
+        The connections from a set of neurons, and every delay in whole steps.
+
+    incoming(neurons):
+        The connections ending in a set of neurons, grouped by presynaptic neuron like the whole network's.
+    """
+
+    def __init__(self, size, pre, post, weight=1.0, delay=0.0):
+        """
+        :param size: the number of neurons
+        :param pre: the presynaptic neuron of each connection
+        :param post: the postsynaptic neuron of each connection
+        :param weight: the weight of each connection, or one weight shared by all of them
+        :param delay: the delay of each connection in ms, or one delay shared by all of them
+        """
+        pre = np.asarray(pre, dtype=np.int64)
+        post = np.asarray(post, dtype=np.int64)
+        if pre.shape != post.shape:
+            raise ValueError("pre and post must list the same number of connections")
+        if len(pre) and (min(pre.min(), post.min()) < 0 or max(pre.max(), post.max()) >= size):
+            raise ValueError(f"Connections must be between neurons 0 and {size - 1}")
+
+        # Grouping the connections by presynaptic neuron, keeping the order they were given in within each group
+        order = np.argsort(pre, kind="stable")
+        self.size = size
+        self.indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pre, minlength=size), out=self.indptr[1:])
+        self.post = post[order].astype(np.int32)
+        self.weight = np.broadcast_to(np.asarray(weight, dtype=np.float32), pre.shape)[order]
+        self.delay = np.broadcast_to(np.asarray(delay, dtype=np.float32), pre.shape)[order]
+        if np.any(self.delay < 0):
+            raise ValueError("Connection delays cannot be negative")
+
+        self.matrix = csr_matrix((self.weight, self.post, self.indptr), shape=(size, size), copy=False)
+
+    @classmethod
+    def chain(cls, size, weight=1.0, delay=0.0):
+        """
+        The network line_of_neurons_model.py builds, where every neuron connects to the next one along.
+
+        :param size: the number of neurons in the chain
+        :return: the Network
+        """
+        return cls(size, np.arange(size - 1), np.arange(1, size), weight, delay)
+
+    @classmethod
+    def random(cls, size, connections_per_neuron, weight=1.0, delay=0.0, seed=None):
+        """
+        A network where every neuron connects to connections_per_neuron neurons chosen at random.
+
+        :param seed: the seed for the random number generator
+        :return: the Network
+        """
+        rng = np.random.default_rng(seed)
+        pre = np.repeat(np.arange(size), connections_per_neuron)
+        post = rng.integers(0, size, len(pre))
+        return cls(size, pre, post, weight, delay)
+
+    @classmethod
+    def from_neurons(cls, neurons, weight=1.0, delay=0.0):
+        """
+        Reads the forward_connections of a list of Neurons into a Network. Neurons are numbered by their position in
+        the list, and every connection must be to a neuron in the list.
+
+        :param neurons: the list of neuron.Neuron objects
+        :return: the Network
+        """
+        numbers = {id(neuron): i for i, neuron in enumerate(neurons)}
+        pre = [numbers[id(neuron)] for neuron in neurons for _ in neuron.forward_connections]
+        post = [numbers[id(connection)] for neuron in neurons for connection in neuron.forward_connections]
+        return cls(len(neurons), pre, post, weight, delay)
+
+    def to_neurons(self, waveform_cache=None):
+        """
+        Builds a neuron.Neuron for every neuron in the network, numbered from 1, with forward_connections set from the
+        network's connections.
+
+        :param waveform_cache: an optional waveform_cache.WaveformCache for all the neurons to share
+        :return: the list of Neurons
+        """
+        neurons = [Neuron([], i + 1, waveform_cache=waveform_cache) for i in range(self.size)]
+        for i, neuron in enumerate(neurons):
+            neuron.forward_connections = [neurons[j] for j in self.targets(i)]
+        return neurons
+
+    @property
+    def connections(self):
+        return len(self.post)
+
+    @property
+    def pre(self):
+        """
+        :return: the presynaptic neuron of every connection, in the same order as post, weight and delay
+        """
+        return np.repeat(np.arange(self.size, dtype=np.int32), np.diff(self.indptr))
+
+    @property
+    def nbytes(self):
+        """
+        :return: the memory used by the connection arrays in bytes
+        """
+        return self.indptr.nbytes + self.post.nbytes + self.weight.nbytes + self.delay.nbytes
+
+    def targets(self, neuron):
+        """
+        :param neuron: the presynaptic neuron
+        :return: the neurons it connects to
+        """
+        return self.post[self.indptr[neuron]:self.indptr[neuron + 1]]
+
+    def outgoing(self, neurons):
+        """
+        :param neurons: presynaptic neurons, which can repeat
+        :return: the index of every connection from each of them in turn, in the order of the connection arrays
+        """
+        return csr_runs(self.indptr, neurons)
+
+    def incoming(self, neurons):
+        """
+        Picks out the connections ending in some neurons, e.g. the ones a partition of the network needs spikes for.
+
+        :param neurons: the postsynaptic neurons
+        :return: an indptr over every presynaptic neuron and the connections it indexes, so that the connections from
+        neuron i into the neurons are connections[indptr[i]:indptr[i + 1]], in the order of the connection arrays
+        """
+        into = np.zeros(self.size, dtype=bool)
+        into[neurons] = True
+        connections = np.flatnonzero(into[self.post])
+        # The connections are sorted by presynaptic neuron already, so keeping a subset in order keeps them grouped
+        indptr = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.pre[connections], minlength=self.size), out=indptr[1:])
+        return indptr, connections
+
+    def delay_steps(self, dt):
+        """
+        :param dt: the step in ms
+        :return: the delay of every connection rounded to a whole number of steps (int64)
+        """
+        return np.rint(self.delay / dt).astype(np.int64)
+
+    def synaptic_input(self, spikes):
+        """
+        Sums the weights of every connection from a neuron that spiked, for each postsynaptic neuron.
+
+        :param spikes: a length N vector with 1 (or True) for each neuron that spiked and 0 otherwise
+        :return: a length N vector of the total weight arriving at each neuron
+        """
+        # spikes @ matrix is computed by scipy as matrix.T @ spikes without building the transpose
+        return np.asarray(spikes, dtype=np.float32) @ self.matrix
+
+
+def csr_runs(indptr, rows):
+    """
+    :param indptr: the start of every row's run of entries, and the end of the last one
+    :param rows: rows, which can repeat
+    :return: the index of every entry of each row in turn
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    counts = indptr[rows + 1] - indptr[rows]
+    # Each row's entries are a run from indptr[row], so this is an arange restarted at every row
+    return np.repeat(indptr[rows] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
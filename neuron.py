@@ -1,6 +1,14 @@
 import numpy as np
 from scipy.integrate import odeint
-import matplotlib.pyplot as plt
+from scipy.special import exprel
+
+from clock import Clock
+from instrumentation import INSTRUMENTS
+from integrators import integrate
+from jacobian import hh_jacobian, odeint_stats
+from scheduler import SpikeScheduler
+from stimulus import integrate_protocol
+from traces import unique_first
 
 """
 I've duplicated this file called "neuron.py" to facilitate the actual model. nobrian_singleneuron_modifiedHH.py will stay
@@ -14,7 +22,8 @@ as an archival piece for modelling just a single neuron without brian.
 
 
 def f_alphan(v):
-    return 0.01 * (v + 55) / (1 - (np.exp(-(v + 55) / 10)))
+    # 0.01 * (v + 55) / (1 - exp(-(v + 55) / 10)) is 0/0 at v = -55, exprel gives the correct limit of 0.1 there
+    return 0.1 / exprel(-(v + 55) / 10)
 
 
 def f_betan(v):
@@ -22,7 +31,8 @@ def f_betan(v):
 
 
 def f_alpham(v):
-    return 0.1 * (v + 40) / (1 - (np.exp(-(v + 40) / 10)))
+    # 0.1 * (v + 40) / (1 - exp(-(v + 40) / 10)) is 0/0 at v = -40, exprel gives the correct limit of 1 there
+    return 1 / exprel(-(v + 40) / 10)
 
 
 def f_betam(v):
@@ -50,22 +60,12 @@ def remove_duplicates(time_points, array):
     """
     print("Removing duplicates")
 
-    # removed duplicates
-    rd_time_points = []
-    rd_array = []
-
-    num = 0
-    for i in range(len(time_points)):
-        if time_points[i] not in rd_time_points:
-            rd_time_points.append(time_points[i])
-            rd_array.append(array[i])
-        else:
-            num += 1
-    time_points = rd_time_points
-    array = rd_array
+    with INSTRUMENTS.phase("post-process"):
+        rd_time_points, rd_array = unique_first(time_points, array)
+    num = len(time_points) - len(rd_time_points)
 
     print(f"Removed {num} duplicates")
-    return time_points, array
+    return rd_time_points.tolist(), rd_array.tolist()
 
 
 #####################################################################
@@ -79,17 +79,31 @@ class Neuron:
 
     Attributes
     ----------
+    clock : clock.Clock
+        the time this neuron's simulation has reached, which every run carries on from
 
     Methods
     -------
+    rest():
+        Puts the neuron into its resting state without simulating.
+
+    rates(v):
+        The six gating rates at a voltage.
+
     f(init, t):
-        Stores the equations necessary for solving the differential equations, as well as recording the data
-        for graphs.
+        Stores the equations necessary for solving the differential equations.
 
-    run(time_length, current_start):
-        Runs the differential equation solver over a specified time period in ms with a specified constant current.
+    jacobian(init, t):
+        The analytic Jacobian of f, passed to odeint.
+
+    run(time_length, current_start, method):
+        Runs the differential equation solver (odeint or a fixed-step method) over a specified time period in ms with
+        a specified constant current.
 
-    send_data_forward():
+    run_protocol(protocol):
+        Runs the differential equation solver through a piecewise stimulus protocol in one pass.
+
+    send_data_forward(delay):
         Sends the last voltage and timestamp we had from this neuron to the next one along to carry on the signal.
         Current just framework as this is not actually how neuron connections work.
 
@@ -111,11 +125,9 @@ class Neuron:
     n = 0.5
     C = 1e-6
     #R = 35.4
-    voltages = []
-    timestamps = [0]
     I = 0
 
-    def __init__(self, forward_connections, number_identifier):
+    def __init__(self, forward_connections, number_identifier, recorder=None, clock=None, waveform_cache=None):
         """
         The neuron specifics will be put here. For example:
          - different threshold limits
@@ -123,9 +135,51 @@ class Neuron:
          - numerical identifications
          - groups
          - etc
+
+        :param recorder: an optional recorder.TraceRecorder that every run() is also recorded into
+        :param clock: the clock.Clock of this neuron's simulation, by default a new one starting at 0 ms
+        :param waveform_cache: an optional waveform_cache.WaveformCache, usually shared by every neuron in a network,
+                               which get_data_behind reuses identical action potentials from
         """
         self.forward_connections = forward_connections
         self.number_identifier = number_identifier
+        self.recorder = recorder
+        self.clock = Clock() if clock is None else clock
+        self.waveform_cache = waveform_cache
+        # The voltages and timestamps of the last run
+        self.voltages = []
+        self.timestamps = []
+        # The RHS evaluations (nfe), Jacobian evaluations (nje) and steps the solver took in the last run
+        self.solver_stats = {}
+
+    def rest(self):
+        """
+        Puts the neuron straight into its resting state for its current I, with every gate at x_inf(v) and v where the
+        membrane current is zero, rather than simulating until it settles there.
+        """
+        from steady_state import initialise_at_rest
+        initialise_at_rest(self)
+
+    def state_snapshot(self):
+        """
+        :return: everything needed to carry on from this point: n, m, h, v, the current and the time
+        """
+        return {"n": float(self.n), "m": float(self.m), "h": float(self.h), "v": float(self.v), "I": float(self.I),
+                "t": self.clock.t}
+
+    def restore(self, snapshot):
+        """
+        Puts the neuron back to a snapshot taken with state_snapshot().
+        """
+        self.n, self.m, self.h, self.v, self.I = (snapshot[name] for name in ("n", "m", "h", "v", "I"))
+        self.clock.restore(snapshot)
+
+    def rates(self, v):
+        """
+        :param v: the voltage (or array of voltages) to evaluate the gating rates at
+        :return: alpha_n, beta_n, alpha_m, beta_m, alpha_h, beta_h at that voltage
+        """
+        return f_alphan(v), f_betan(v), f_alpham(v), f_betam(v), f_alphah(v), f_betah(v)
 
     def f(self, init, t):
         """
@@ -136,72 +190,148 @@ class Neuron:
         :param t: the time instant this solution is being made for
         :return: the four functions odeint will solve
         """
-        self.n = init[0]
-        self.m = init[1]
-        self.h = init[2]
-        self.v = init[3]
+        n, m, h, v = init
 
         # The differential equations that will be solved
-        dndt = f_alphan(self.v) * (1 - self.n) - f_betan(self.v) * self.n
-        dmdt = f_alpham(self.v) * (1 - self.m) - f_betam(self.v) * self.m
-        dhdt = f_alphah(self.v) * (1 - self.h) - f_betah(self.v) * self.h
-        dvdt = (1/self.C) * (self.I + self.gK * self.n**4 * (self.EK-self.v) +
-                             self.gNa * self.m**3 * self.h * (self.ENa-self.v) + self.gL * (self.EL-self.v))
-
-        # Recording the data the sim has calculated (could do directly but seems to be messy)
-        self.voltages.append(self.v)
-        self.timestamps.append(t)
+        dndt = f_alphan(v) * (1 - n) - f_betan(v) * n
+        dmdt = f_alpham(v) * (1 - m) - f_betam(v) * m
+        dhdt = f_alphah(v) * (1 - h) - f_betah(v) * h
+        dvdt = (1/self.C) * (self.I + self.gK * n**4 * (self.EK-v) +
+                             self.gNa * m**3 * h * (self.ENa-v) + self.gL * (self.EL-v))
 
         return [dndt, dmdt, dhdt, dvdt]
 
-    def run(self, time_length, current_start):
+    def jacobian(self, init, t):
+        """
+        The analytic Jacobian of f, which odeint is given rather than estimating it by finite differences.
+
+        :param init: an array of n, m, h and v
+        :param t: the time instant (unused, the equations don't depend on time directly)
+        :return: the 4 x 4 matrix of the derivatives of f's four outputs with respect to n, m, h and v
+        """
+        return hh_jacobian(np.reshape(init, (4, 1)), self)[0]
+
+    def run(self, time_length, current_start, method="odeint", dt=0.01):
         """
         Runs the differential equation solver over a specified time period in ms with a specified constant current.
 
         :param time_length: the length of time to run the simulation for
         :param current_start: the current the simulation will run with over the time period
+        :param method: "odeint", or one of the fixed-step methods in integrators.STEPPERS ("exp_euler", "rush_larsen")
+        :param dt: the step size in ms for the fixed-step methods
         :return: two arrays of voltages and timestamps as calculated by the simulation
         """
-        # We want each successive run() to start from the last simulation timestamp so it looks continuous.
-        new_start_time = np.floor(self.timestamps[-1])
+        # Each successive run() starts exactly where the clock says the last one finished, so it is continuous.
+        time_region = np.linspace(self.clock.t, self.clock.t + time_length, 1000)
 
-        # Temporary fix for misalignment
-        if new_start_time == 50:
-            new_start_time += 1
+        self.I = current_start
 
-        time_region = np.linspace(new_start_time, new_start_time + time_length, 1000).tolist()
+        # The actual differential equation solving. The solution is only taken on the time grid we asked for, not on
+        # every trial step odeint makes internally.
+        with INSTRUMENTS.phase("integrate", self.number_identifier):
+            if method == "odeint":
+                # LSODA can use up the default 500 steps before it notices how stiff the small C makes this and
+                # switches to its stiff method, so it is given more room.
+                solution, info = odeint(INSTRUMENTS.rhs(self.f), [self.n, self.m, self.h, self.v], time_region,
+                                        Dfun=self.jacobian, mxstep=5000, full_output=True)
+                self.solver_stats = odeint_stats(info)
+            else:
+                state = np.array([[self.n], [self.m], [self.h], [self.v]])
+                time_region, solution, self.solver_stats = integrate(state, self, time_region[0], time_length, dt,
+                                                                     method, len(time_region))
+                solution = solution[:, :, 0]
+        INSTRUMENTS.solver_call(self.solver_stats)
+        self.n, self.m, self.h, self.v = solution[-1]
+        self.clock.advance_to(time_region[-1])
+
+        # Recording the data the sim has calculated
+        with INSTRUMENTS.phase("record", self.number_identifier):
+            if self.recorder is not None:
+                self.recorder.record(time_region, solution, self)
+            self.voltages = solution[:, 3].tolist()
+            self.timestamps = time_region.tolist()
 
-        # Initialising the recording system
-        self.voltages = [self.v]
-        self.timestamps = [time_region[0]]  # Defining where we want to start with our timestamps
+        return self.voltages, self.timestamps
 
-        self.I = current_start
+    def run_protocol(self, protocol, method="odeint", dt=0.01, stop_threshold=None):
+        """
+        Runs the differential equation solver through a whole stimulus.StimulusProtocol in one pass, rather than one
+        run() per piece of the protocol.
+
+        :param protocol: the StimulusProtocol giving the current to inject over time
+        :param method: "odeint", or one of the fixed-step methods in integrators.STEPPERS ("exp_euler", "rush_larsen")
+        :param dt: the step size in ms for the fixed-step methods
+        :param stop_threshold: if given, the run stops as soon as v reaches this
+        :return: two arrays of voltages and timestamps as calculated by the simulation
+        """
+        state = np.array([[self.n], [self.m], [self.h], [self.v]])
+        samples = max(int(protocol.duration * 1000 / 3), 2)  # the same density as run(), 1000 samples per 3 ms
+        with INSTRUMENTS.phase("integrate", self.number_identifier):
+            time_region, solution, self.solver_stats = integrate_protocol(self, state, self.clock.t, protocol,
+                                                                          samples, method, dt, stop_threshold,
+                                                                          Dfun=self.jacobian, mxstep=5000)
+        INSTRUMENTS.solver_call(self.solver_stats)
+        solution = solution[:, :, 0]
+        self.n, self.m, self.h, self.v = solution[-1]
+        self.clock.advance_to(time_region[-1])
+
+        # Recording the data the sim has calculated
+        with INSTRUMENTS.phase("record", self.number_identifier):
+            if self.recorder is not None:
+                self.recorder.record(time_region, solution, self)
+            self.voltages = solution[:, 3].tolist()
+            self.timestamps = time_region.tolist()
 
-        # The actual differential equation solving
-        odeint(self.f, [self.n, self.m, self.h, self.v], time_region)
         return self.voltages, self.timestamps
 
-    def send_data_forward(self):
+    def send_data_forward(self, delay=0):
         """
         Called when we want to progress from this neuron's action potential to our connections. This will propagate
         the timing and voltage info to all the other connections we have, and starting an action potential.
+
+        Spikes are delivered through a scheduler.SpikeScheduler in time order, so every neuron downstream is simulated
+        once even if there are several paths to it from here.
+        :param delay: the delay in ms between a neuron finishing and its connections starting
         :return: the data needed for plotting this neuron's graph
         """
-        # Propagating to our connections
+        # Numbering every neuron we can reach and listing the connections between them
+        with INSTRUMENTS.phase("propagate"):
+            neurons = [self]
+            numbers = {id(self): 0}
+            pre = []
+            post = []
+            for neuron in neurons:
+                for connection in neuron.forward_connections:
+                    if id(connection) not in numbers:
+                        numbers[id(connection)] = len(neurons)
+                        neurons.append(connection)
+                    pre.append(numbers[id(neuron)])
+                    post.append(numbers[id(connection)])
+
         data = []
-        for connection in self.forward_connections:
-            data += connection.get_data_behind(self.v, self.timestamps[-1])
-            data += connection.send_data_forward()
+
+        def deliver(number, arrivals):
+            # The first neuron to reach this one starts its action potential
+            time, source = arrivals[0]
+            data.extend(neurons[number].get_data_behind(neurons[source].v, time))
+            return [neurons[number].clock.t]
+
+        # Propagating to our connections. Only building the scheduler is timed as propagation, the neurons it runs
+        # time their own phases.
+        with INSTRUMENTS.phase("propagate"):
+            scheduler = SpikeScheduler(pre, post, delay, size=len(neurons))
+            scheduler.emit(0, self.clock.t)
+        scheduler.run(deliver)
 
         # Sending data back for graph
         return data
 
-    def get_data_behind(self, voltage=None, last_time=0):
+    def get_data_behind(self, voltage=None, last_time=None):
         """
         After this neuron's back-connections are ready to send data, they send data ahead to their connections like this
         call. This uses the data to start a new action potential with the data given and this neuron's settings.
         :param voltage: the new voltage to start at as being sent from the connection
-        :param last_time: the last time stamp to use (temporary)
+        :param last_time: the time the action potential starts at, by default where this neuron's clock is
         :return: the data needed for plotting this neuron's graph
         """
 
@@ -210,15 +340,37 @@ class Neuron:
         if voltage is not None:
             # Instantiating the new start values
             self.v = voltage
-        self.timestamps[-1] = last_time
+        if last_time is not None:
+            self.clock.advance_to(last_time)
+        last_time = self.clock.t
+
+        trigger_time_ms = 10
+        # If activation const is not high enough the neuron will fail to fire
+        activation_const = 2
+
+        # A neuron starting from the same state with the same parameters as one simulated before fires the same
+        # waveform, so it can be copied with a time offset. Runs being recorded are always simulated.
+        key = None
+        if self.waveform_cache is not None and self.recorder is None:
+            key = self.waveform_cache.key(self.n, self.m, self.h, self.v, self.EL, self.ENa, self.EK, self.gL, self.gNa,
+                                          self.gK, self.C, trigger_time_ms, activation_const)
+            waveform = self.waveform_cache.get(key)
+            if waveform is not None:
+                self.n, self.m, self.h, self.v, self.I = waveform["final_state"].tolist()
+                self.clock.advance_to(last_time + waveform["duration"])
+                self.voltages = waveform["last_voltages"].tolist()
+                self.timestamps = (waveform["last_timestamps"] + last_time).tolist()
+                return [[(waveform["times"] + last_time).tolist(), waveform["voltages"].tolist(),
+                         self.number_identifier]]
 
         # Running action potential
         run1 = []
         timestamps1 = []
         testv = self.v
-        trigger_time_ms = 10
-        # If activation const is not high enough the neuron will fail to fire
-        activation_const = 2
+        # The neuron rests for 1 ms for every point of the activation ramp, so the ramp is worked out first and the rest
+        # is simulated in one run rather than one run per ms.
+        rest_ms = 0
+        fired = False
         for i in range(100):
             # Run normally
             if i > trigger_time_ms:
@@ -230,18 +382,34 @@ class Neuron:
                 inaccurate but it makes a good looking signal."""
                 if testv <= -62:
                     break
-            self.run(1, 0)
+            rest_ms += 1
             run1.append(testv)
             timestamps1.append(last_time + i)
             if testv > -55:
-                self.v = testv
-                run2, timestamps2 = self.run(3, 1)
-                run2 = [x + 10 for x in run2]
+                fired = True
                 break
-            else:
-                run2, timestamps2 = [], []
+
+        if rest_ms:
+            self.run(rest_ms, 0)
+        run2, timestamps2 = [], []
+        if fired:
+            self.v = testv
+            run2, timestamps2 = self.run(3, 1)
+            run2 = [x + 10 for x in run2]
         run3, timestamps3 = self.run(30, 0)
         run2, timestamps2 = run2[200:], timestamps2[200:]
+        times = timestamps1 + timestamps2 + timestamps3
+        voltages = run1 + run2 + run3
+
+        if key is not None:
+            self.waveform_cache.put(key, {
+                "times": np.array(times) - last_time,
+                "voltages": np.array(voltages),
+                "final_state": np.array([self.n, self.m, self.h, self.v, self.I], dtype=float),
+                "duration": self.clock.t - last_time,
+                "last_voltages": np.array(self.voltages),
+                "last_timestamps": np.array(self.timestamps) - last_time,
+            })
 
         # Sending data back for graph
-        return [[timestamps1 + timestamps2 + timestamps3, run1 + run2 + run3, self.number_identifier]]
+        return [[times, voltages, self.number_identifier]]
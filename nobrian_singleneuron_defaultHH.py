@@ -1,8 +1,9 @@
 import numpy as np
 from scipy.integrate import odeint
-import matplotlib.pyplot as plt
 from scipy.special import exprel
-import gui
+#import gui
+
+from traces import unique_first
 
 """
 This file is the default Hodgkin-Huxley model for a single neuron. There is no extra modelling here.
@@ -15,7 +16,8 @@ This file is the default Hodgkin-Huxley model for a single neuron. There is no e
 
 
 def f_alphan(v):
-    return 0.01 * (v + 55) / (1 - (np.exp(-(v + 55) / 10)))
+    # 0.01 * (v + 55) / (1 - exp(-(v + 55) / 10)) is 0/0 at v = -55, exprel gives the correct limit of 0.1 there
+    return 0.1 / exprel(-(v + 55) / 10)
 
 
 def f_betan(v):
@@ -23,7 +25,8 @@ def f_betan(v):
 
 
 def f_alpham(v):
-    return 0.1 * (v + 40) / (1 - (np.exp(-(v + 40) / 10)))
+    # 0.1 * (v + 40) / (1 - exp(-(v + 40) / 10)) is 0/0 at v = -40, exprel gives the correct limit of 1 there
+    return 1 / exprel(-(v + 40) / 10)
 
 
 def f_betam(v):
@@ -51,20 +54,11 @@ def remove_duplicates(time_points, array):
     """
     print("Removing duplicates")
 
-    # removed duplicates
-    rd_time_points = []
-    rd_array = []
-
-    num = 0
-    for i in range(len(time_points)):
-        if time_points[i] not in rd_time_points:
-            rd_time_points.append(time_points[i])
-            rd_array.append(array[i])
-        else:
-            num += 1
+    rd_time_points, rd_array = unique_first(time_points, array)
+    num = len(time_points) - len(rd_time_points)
 
     print(f"Removed {num} duplicates")
-    return rd_time_points, rd_array
+    return rd_time_points.tolist(), rd_array.tolist()
 
 
 def plot_graph(time_points, array):
@@ -74,6 +68,9 @@ def plot_graph(time_points, array):
     :param time_points: the time points to plot along x-axis
     :param array: voltage array to plot along y-axis
     """
+    # matplotlib is only imported when there is something to plot, so the simulation itself runs headless
+    import matplotlib.pyplot as plt
+
     # Removes any duplicates we have generated in the sample to provide a clearer-looking graph
     time_points, array = remove_duplicates(time_points, array)
 
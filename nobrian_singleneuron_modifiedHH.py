@@ -1,8 +1,10 @@
 import numpy as np
 from scipy.integrate import odeint
-import matplotlib.pyplot as plt
+from scipy.special import exprel
 #import gui
 
+from traces import unique_first
+
 """
 This file is the modified Hodgkin-Huxley model for a single neuron. There is no some more custom modelling here,
 especially in regards to how we treat the initial current and hypopolarisation.
@@ -15,7 +17,8 @@ especially in regards to how we treat the initial current and hypopolarisation.
 
 
 def f_alphan(v):
-    return 0.01 * (v + 55) / (1 - (np.exp(-(v + 55) / 10)))
+    # 0.01 * (v + 55) / (1 - exp(-(v + 55) / 10)) is 0/0 at v = -55, exprel gives the correct limit of 0.1 there
+    return 0.1 / exprel(-(v + 55) / 10)
 
 
 def f_betan(v):
@@ -23,7 +26,8 @@ def f_betan(v):
 
 
 def f_alpham(v):
-    return 0.1 * (v + 40) / (1 - (np.exp(-(v + 40) / 10)))
+    # 0.1 * (v + 40) / (1 - exp(-(v + 40) / 10)) is 0/0 at v = -40, exprel gives the correct limit of 1 there
+    return 1 / exprel(-(v + 40) / 10)
 
 
 def f_betam(v):
@@ -51,20 +55,11 @@ def remove_duplicates(time_points, array):
     """
     print("Removing duplicates")
 
-    # removed duplicates
-    rd_time_points = []
-    rd_array = []
-
-    num = 0
-    for i in range(len(time_points)):
-        if time_points[i] not in rd_time_points:
-            rd_time_points.append(time_points[i])
-            rd_array.append(array[i])
-        else:
-            num += 1
+    rd_time_points, rd_array = unique_first(time_points, array)
+    num = len(time_points) - len(rd_time_points)
 
     print(f"Removed {num} duplicates")
-    return rd_time_points, rd_array
+    return rd_time_points.tolist(), rd_array.tolist()
 
 
 def plot_graph(time_points, array):
@@ -74,6 +69,9 @@ def plot_graph(time_points, array):
     :param time_points: the time points to plot along x-axis
     :param array: voltage array to plot along y-axis
     """
+    # matplotlib is only imported when there is something to plot, so the simulation itself runs headless
+    import matplotlib.pyplot as plt
+
     # Removes any duplicates we have generated in the sample to provide a clearer-looking graph
     time_points, array = remove_duplicates(time_points, array)
 
@@ -206,6 +204,10 @@ if __name__ == "__main__":
     given simulations of HH and another which is slightly not true to life but gives a "better signal" using some forced
     thresholding.
     """
+    # The neuron rests for 1 ms for every point of the activation ramp, so the ramp is worked out first and the rest is
+    # simulated in one run rather than one run per ms.
+    rest_ms = 0
+    fired = False
     for i in range(100):
         # Run normally
         if i > trigger_time_ms:
@@ -217,17 +219,21 @@ if __name__ == "__main__":
             inaccurate but it makes a good looking signal."""
             if testv <= -62:
                 break
-        neuron.run(1, 0)
+        rest_ms += 1
         run1.append(testv)
         timestamps1.append(i)
         print(f"Voltage: {testv}")
         if testv > -55:
-            neuron.v = testv
-            run2, timestamps2 = neuron.run(3, 1)
-            run2 = [x + 10 for x in run2]
+            fired = True
             break
-        else:
-            run2, timestamps2 = [], []
+
+    if rest_ms:
+        neuron.run(rest_ms, 0)
+    run2, timestamps2 = [], []
+    if fired:
+        neuron.v = testv
+        run2, timestamps2 = neuron.run(3, 1)
+        run2 = [x + 10 for x in run2]
     run3, timestamps3 = neuron.run(30, 0)
 
     run2, timestamps2 = run2[200:], timestamps2[200:]
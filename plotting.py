@@ -0,0 +1,80 @@
+import numpy as np
+
+from instrumentation import INSTRUMENTS
+
+"""
+Plotting. None of the simulation modules import matplotlib, so they load quickly and run headless (e.g. in sweep worker
+processes); matplotlib is only imported the first time one of these functions is called.
+"""
+
+#####################################################################
+
+
+def pyplot():
+    """
+    :return: matplotlib.pyplot, imported on first use
+    """
+    with INSTRUMENTS.phase("plot"):
+        import matplotlib.pyplot as plt
+    return plt
+
+
+def plot_action_potential(time_points, array, show=True):
+    """
+    Plots one voltage trace, as the nobrian_singleneuron scripts do.
+
+    :param time_points: the time points to plot along x-axis
+    :param array: voltage array to plot along y-axis
+    :param show: whether to show the figure straight away
+    """
+    plt = pyplot()
+    plt.plot(time_points, array, 'b', linewidth=1)
+    plt.xlabel('Time (ms)')
+    plt.ylabel('Action potential (mV)')
+    if show:
+        with INSTRUMENTS.phase("plot"):
+            plt.show()
+
+
+def plot_chain(data, time_scale=0.1, show=True):
+    """
+    Plots the data get_data_behind and send_data_forward return, one line per neuron.
+
+    :param data: a list of [time points, voltages, number identifier] for each neuron
+    :param time_scale: what the time points are multiplied by, to make the timings more realistic
+    :param show: whether to show the figure straight away
+    """
+    plt = pyplot()
+    for d in data:
+        if not d:  # We've reached the end of the neuron chain as no more chain data
+            break
+        time_points, volt_array, number_identifier = d
+        plt.plot([x * time_scale for x in time_points], volt_array, label=f"Neuron {number_identifier}")
+    plt.legend()
+    plt.xlabel('Time (ms)')
+    plt.ylabel('Action potential (mV)')
+    if show:
+        with INSTRUMENTS.phase("plot"):
+            plt.show()
+
+
+def plot_traces(times, traces, neurons=None, ylabel='Action potential (mV)', show=True):
+    """
+    Plots the traces of a recorder (recorder.TraceRecorder.traces or trace_files.TraceFile.read).
+
+    :param times: the (samples,) recorded times
+    :param traces: the (samples, N) recorded trace
+    :param neurons: the columns to plot, by default all of them
+    :param ylabel: the label of the y-axis
+    :param show: whether to show the figure straight away
+    """
+    plt = pyplot()
+    traces = np.asarray(traces)
+    for neuron in range(traces.shape[1]) if neurons is None else neurons:
+        plt.plot(times, traces[:, neuron], linewidth=1, label=f"Neuron {neuron}")
+    plt.legend()
+    plt.xlabel('Time (ms)')
+    plt.ylabel(ylabel)
+    if show:
+        with INSTRUMENTS.phase("plot"):
+            plt.show()
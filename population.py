@@ -0,0 +1,462 @@
+import numpy as np
+from scipy.integrate import ode, odeint
+
+from clock import Clock
+from instrumentation import INSTRUMENTS
+from integrators import integrate
+from jacobian import add_stats, banded_jacobian, hh_jacobian, odeint_stats, sparse_jacobian
+from neuron import Neuron, f_alphan, f_betan, f_alpham, f_betam, f_alphah, f_betah
+from rate_tables import get_rate_table
+from recorder import SpikeMonitor
+from steady_state import initialise_at_rest
+from synapses import synaptic_terms
+from stimulus import integrate_protocol
+
+"""
+A vectorised version of neuron.py. Instead of every neuron owning its own scalar n, m, h and v and calling odeint on its
+own, a population keeps the state of all N neurons in one (4, N) array and evaluates the gating rates and dvdt for the
+whole population in a single call.
+"""
+
+#####################################################################
+
+# Order of the rows in the state array, the same order Neuron.f uses for odeint
+STATE_VARIABLES = ("n", "m", "h", "v")
+
+# Per-neuron parameters which are stored as arrays of length N
+PARAMETERS = ("EL", "ENa", "EK", "gL", "gNa", "gK", "C", "I")
+
+
+class NeuronPopulation:
+    """
+    A class to represent a population of N Hodgkin-Huxley neurons that are integrated together.
+
+    ...
+
+    Attributes
+    ----------
+    size : int
+        number of neurons in the population
+    state : np.ndarray
+        contiguous (4, N) array holding the n, m, h and v of every neuron
+    EL, ENa, EK, gL, gNa, gK, C, I : np.ndarray
+        per-neuron parameters, each an array of length N
+    rate_table : rate_tables.RateTable or None
+        if set, the gating rates are looked up from this table rather than evaluated directly
+    synapses : list
+        the synapses.ExponentialSynapses onto the neurons, whose conductances and currents add to the membrane current
+    recorder : recorder.TraceRecorder or None
+        if set, the solution of every run is recorded into it
+    solver_stats : dict
+        the RHS evaluations (nfe), Jacobian evaluations (nje) and steps of the last run
+    clock : clock.Clock
+        the time the population has reached (also readable as time)
+
+    Methods
+    -------
+    rest():
+        Puts every neuron into its resting state without simulating.
+
+    rates(v):
+        Returns the six gating rates at the voltages v.
+
+    derivatives(state):
+        Evaluates dn/dt, dm/dt, dh/dt and dv/dt for the whole population in one vectorised call.
+
+    f(init, t):
+        The function odeint integrates over, a flattened wrapper around derivatives().
+
+    jacobian(init, t):
+        The analytic Jacobian of f, which odeint is given rather than estimating it by finite differences.
+
+    run(time_length, current_start, method):
+        Runs the differential equation solver (odeint or a fixed-step method) for every neuron over a specified time
+        period in ms.
+
+    run_protocol(protocol):
+        Runs every neuron through a piecewise stimulus protocol in one pass.
+
+    stream(duration, chunk_ms):
+        A generator running the population chunk by chunk, yielding the times, states and spikes of each chunk as
+        soon as it has been integrated.
+    """
+
+    def __init__(self, size, rate_table=None, recorder=None, at_rest=False, synapses=(), **parameters):
+        """
+        Any of the parameters or initial conditions of neuron.Neuron can be given as a scalar (shared by every neuron)
+        or as an array of length N (one value per neuron). Anything left out takes the Neuron default.
+
+        :param size: the number of neurons in the population
+        :param rate_table: a rate_tables.RateTable to look the gating rates up from, or True for the default table
+        :param recorder: an optional recorder.TraceRecorder that every run() is recorded into
+        :param at_rest: start every neuron at its resting state rather than the initial conditions of neuron.Neuron
+        :param synapses: synapses.ExponentialSynapses of the same size, e.g. ExponentialSynapses.preset("AMPA", size)
+        :param parameters: per-neuron overrides, e.g. gNa=np.linspace(100, 140, size) or v=-65
+        """
+        unknown = set(parameters) - set(PARAMETERS) - set(STATE_VARIABLES)
+        if unknown:
+            raise ValueError(f"Unknown population parameters: {', '.join(sorted(unknown))}")
+
+        self.size = size
+
+        self.state = np.empty((len(STATE_VARIABLES), size))
+        for row, name in enumerate(STATE_VARIABLES):
+            self.state[row] = parameters.get(name, getattr(Neuron, name))
+
+        for name in PARAMETERS:
+            setattr(self, name, np.full(size, parameters.get(name, getattr(Neuron, name)), dtype=float))
+
+        if rate_table is True:
+            rate_table = get_rate_table()
+        self.rate_table = rate_table
+        self.recorder = recorder
+        self.synapses = list(synapses)
+
+        self.clock = Clock()
+        self.solver_stats = {}
+
+        if at_rest:
+            self.rest()
+
+    def __len__(self):
+        return self.size
+
+    # The time the population has reached, kept by its clock
+    @property
+    def time(self):
+        return self.clock.t
+
+    @time.setter
+    def time(self, value):
+        self.clock.advance_to(value)
+        # The synapses decay up to the same time in closed form (the fixed-step methods have stepped them there already)
+        for synapse in self.synapses:
+            synapse.advance_to(value)
+
+    def state_snapshot(self):
+        """
+        :return: everything needed to carry on from this point: the state, the per-neuron parameters, the time and the
+                 state of every synapse
+        """
+        snapshot = {"state": self.state.copy(), "t": self.clock.t,
+                    "synapses": [synapse.state_snapshot() for synapse in self.synapses]}
+        for name in PARAMETERS:
+            snapshot[name] = getattr(self, name).copy()
+        return snapshot
+
+    def restore(self, snapshot):
+        """
+        Puts the population back to a snapshot taken with state_snapshot(), which must be of the same size.
+        """
+        if snapshot["state"].shape != self.state.shape:
+            raise ValueError(f"A snapshot of {snapshot['state'].shape[1]} neurons can't be restored into {self.size}")
+        self.state[:] = snapshot["state"]
+        synapses = snapshot.get("synapses", [])
+        if len(synapses) != len(self.synapses):
+            raise ValueError(f"A snapshot of {len(synapses)} synapse types can't be restored into {len(self.synapses)}")
+        for name in PARAMETERS:
+            getattr(self, name)[:] = snapshot[name]
+        self.clock.restore(snapshot)
+        for synapse, synapse_snapshot in zip(self.synapses, synapses):
+            synapse.restore(synapse_snapshot)
+
+    def __getitem__(self, index):
+        return NeuronView(self, index)
+
+    # Named views onto the rows of the state array, writing to these writes straight into the population
+    @property
+    def n(self):
+        return self.state[0]
+
+    @n.setter
+    def n(self, value):
+        self.state[0] = value
+
+    @property
+    def m(self):
+        return self.state[1]
+
+    @m.setter
+    def m(self, value):
+        self.state[1] = value
+
+    @property
+    def h(self):
+        return self.state[2]
+
+    @h.setter
+    def h(self, value):
+        self.state[2] = value
+
+    @property
+    def v(self):
+        return self.state[3]
+
+    @v.setter
+    def v(self, value):
+        self.state[3] = value
+
+    def rest(self):
+        """
+        Puts every neuron straight into its resting state (steady_state.resting_state) for its current I, rather than
+        simulating until it settles there.
+        """
+        initialise_at_rest(self)
+
+    def rates(self, v):
+        """
+        :param v: an array of voltages in mV
+        :return: alpha_n, beta_n, alpha_m, beta_m, alpha_h, beta_h at those voltages
+        """
+        if self.rate_table is not None:
+            return self.rate_table.lookup(v)
+        return f_alphan(v), f_betan(v), f_alpham(v), f_betam(v), f_alphah(v), f_betah(v)
+
+    def derivatives(self, state, t=None):
+        """
+        The same equations as Neuron.f, evaluated for every neuron at once.
+
+        :param state: a (4, N) array of n, m, h and v
+        :param t: the time, which only matters for the synapses. By default it is the time the population is at.
+        :return: a (4, N) array of dn/dt, dm/dt, dh/dt and dv/dt
+        """
+        n, m, h, v = state
+        alphan, betan, alpham, betam, alphah, betah = self.rates(v)
+
+        dndt = alphan * (1 - n) - betan * n
+        dmdt = alpham * (1 - m) - betam * m
+        dhdt = alphah * (1 - h) - betah * h
+        dvdt = (1/self.C) * (self.I + self.gK * n**4 * (self.EK-v) +
+                             self.gNa * m**3 * h * (self.ENa-v) + self.gL * (self.EL-v))
+        if self.synapses:
+            g_synapses, g_E_synapses, I_synapses = synaptic_terms(self.synapses, t=t)
+            dvdt = dvdt + (g_E_synapses - g_synapses * v + I_synapses) / self.C
+
+        return np.array([dndt, dmdt, dhdt, dvdt])
+
+    def f(self, init, t):
+        """
+        The function we are integrating over with odeint. odeint only works on flat arrays, so the state is passed
+        neuron by neuron (n0, m0, h0, v0, n1, m1, ...). That keeps the Jacobian banded (each neuron only depends on its
+        own four variables) so odeint never has to build a dense 4N x 4N matrix.
+
+        :param init: the flattened (N, 4) state
+        :param t: the time instant this solution is being made for
+        :return: the flattened (N, 4) derivatives
+        """
+        return self.derivatives(init.reshape(self.size, 4).T, t).T.ravel()
+
+    def jacobian(self, init, t):
+        """
+        The analytic Jacobian of f, in the form odeint takes it. With more than one neuron that is the banded layout
+        matching odeint_options(), otherwise the full 4 x 4 matrix.
+
+        :param init: the flattened (N, 4) state
+        :param t: the time instant (unused, the equations don't depend on time directly)
+        :return: the (7, 4N) banded Jacobian, or the (4, 4) Jacobian of a single neuron
+        """
+        blocks = self._blocks(init, t)
+        if self.size == 1:
+            return blocks[0]
+        return banded_jacobian(blocks)
+
+    def sparse_jacobian(self, init, t=None):
+        """
+        :param init: the flattened (N, 4) state
+        :return: the block-diagonal (4N, 4N) Jacobian of f as a sparse matrix, for the implicit solve_ivp methods
+        """
+        return sparse_jacobian(self._blocks(init, t))
+
+    def _blocks(self, init, t):
+        """
+        :return: the (N, 4, 4) per-neuron Jacobians at the flattened state init, including the synaptic conductances
+        """
+        blocks = hh_jacobian(init.reshape(self.size, 4).T, self)
+        if self.synapses:
+            blocks[:, 3, 3] -= synaptic_terms(self.synapses, t=t)[0] / self.C
+        return blocks
+
+    def odeint_options(self):
+        """
+        Every neuron only couples to its own 4 variables, so the Jacobian has 3 bands either side of the diagonal. For a
+        single neuron the full 4 x 4 matrix is no bigger, and LSODA fails if asked to treat it as banded.
+
+        :return: the odeint keyword arguments giving the analytic Jacobian and its bands
+        """
+        if self.size == 1:
+            return {"Dfun": self.jacobian, "mxstep": 5000}
+        return {"Dfun": self.jacobian, "ml": 3, "mu": 3, "mxstep": 5000}
+
+    def run(self, time_length, current_start=None, samples=1000, method="odeint", dt=0.01):
+        """
+        Runs the differential equation solver for the whole population over a specified time period in ms.
+
+        :param time_length: the length of time to run the simulation for
+        :param current_start: the current to inject, a scalar or one value per neuron. None keeps the current I.
+        :param samples: the number of time points to return the solution at
+        :param method: "odeint", or one of the fixed-step methods in integrators.STEPPERS ("exp_euler", "rush_larsen")
+        :param dt: the step size in ms for the fixed-step methods
+        :return: the timestamps (samples,) and the solution as a (samples, 4, N) array
+        """
+        if current_start is not None:
+            self.I[:] = current_start
+
+        with INSTRUMENTS.phase("integrate"):
+            if method == "odeint":
+                time_region = np.linspace(self.time, self.time + time_length, samples)
+
+                solution, info = odeint(INSTRUMENTS.rhs(self.f), self.state.T.ravel(), time_region, full_output=True,
+                                        **self.odeint_options())
+                self.solver_stats = odeint_stats(info)
+                solution = solution.reshape(samples, self.size, 4).transpose(0, 2, 1)
+                self.state[:] = solution[-1]
+            else:
+                time_region, solution, self.solver_stats = integrate(self.state, self, self.time, time_length, dt,
+                                                                     method, samples)
+        INSTRUMENTS.solver_call(self.solver_stats)
+
+        self.time = time_region[-1]
+
+        if self.recorder is not None:
+            with INSTRUMENTS.phase("record"):
+                self.recorder.record(time_region, solution, self)
+
+        return time_region, solution
+
+    def run_protocol(self, protocol, samples=1000, method="odeint", dt=0.01, stop_threshold=None):
+        """
+        Runs the whole population through a stimulus.StimulusProtocol in one pass, rather than one run() per piece.
+
+        :param protocol: the StimulusProtocol giving the current to inject over time
+        :param samples: the number of time points to return the solution at
+        :param method: "odeint", or one of the fixed-step methods in integrators.STEPPERS ("exp_euler", "rush_larsen")
+        :param dt: the step size in ms for the fixed-step methods
+        :param stop_threshold: if given, the run stops as soon as any neuron's v reaches this
+        :return: the timestamps and the solution as a (samples, 4, N) array, ending early if the threshold was reached
+        """
+        with INSTRUMENTS.phase("integrate"):
+            time_region, solution, self.solver_stats = integrate_protocol(self, self.state, self.time, protocol,
+                                                                          samples, method, dt, stop_threshold,
+                                                                          **self.odeint_options())
+        INSTRUMENTS.solver_call(self.solver_stats)
+        self.time = time_region[-1]
+
+        if self.recorder is not None:
+            with INSTRUMENTS.phase("record"):
+                self.recorder.record(time_region, solution, self)
+
+        return time_region, solution
+
+    def stream(self, duration, chunk_ms=10, method="rush_larsen", dt=0.01, every=1, threshold=0.0):
+        """
+        Runs the population for duration ms, a chunk of chunk_ms at a time, yielding every chunk as soon as it has
+        been integrated. Nothing is kept between chunks beyond the state itself, so memory stays the same however long
+        the run is. The generator can be paused between chunks, e.g. to change I.
+
+        With odeint the same LSODA solver carries on from chunk to chunk (its step size and history are kept), rather
+        than being restarted for every chunk as separate run() calls would. The fixed-step methods have nothing to
+        carry over but the state.
+
+        :param duration: the length of time to run for in ms
+        :param chunk_ms: the length of each chunk. The last one is shorter if it doesn't divide duration.
+        :param method: "odeint", or one of the fixed-step methods in integrators.STEPPERS ("exp_euler", "rush_larsen")
+        :param dt: the step size in ms for the fixed-step methods, and the sample spacing with every
+        :param every: only every k-th step of dt is kept in the chunk
+        :param threshold: the voltage an upward crossing of is a spike
+        :return: a generator of (times, states, spikes) for each chunk: the (samples,) times after the start of the
+                 chunk, the (samples, 4, N) state at each and the (neuron_ids, times) arrays of the spikes in it
+        """
+        spikes = SpikeMonitor(threshold)
+        spikes.record([self.time], self.state[np.newaxis], self)
+        self.solver_stats = {}
+        end = self.time + duration
+
+        solver = None
+        if method == "odeint":
+            solver, counts = self._lsoda_solver()
+
+        while self.time < end - 1e-9:
+            length = min(chunk_ms, end - self.time)
+            with INSTRUMENTS.phase("integrate"):
+                if solver is None:
+                    steps = max(int(np.ceil(length / dt - 1e-9)), 1)
+                    times, states, stats = integrate(self.state, self, self.time, length, dt, method,
+                                                     steps // every + 1)
+                    times, states = times[1:], states[1:]
+                else:
+                    samples = max(int(np.ceil(length / (dt * every) - 1e-9)), 1)
+                    times = self.time + np.linspace(length / samples, length, samples)
+                    states = np.empty((samples, 4, self.size))
+                    before = dict(counts)
+                    for i, t in enumerate(times):
+                        y = solver.integrate(t)
+                        if not solver.successful():
+                            raise RuntimeError(f"LSODA failed at t = {solver.t} ms")
+                        states[i] = y.reshape(self.size, 4).T
+                    self.state[:] = states[-1]
+                    stats = {key: counts[key] - before[key] for key in counts}
+            add_stats(self.solver_stats, stats)
+            INSTRUMENTS.solver_call(stats)
+            self.time = times[-1]
+
+            with INSTRUMENTS.phase("record"):
+                spikes.record(times, states, self)
+                if self.recorder is not None:
+                    self.recorder.record(times, states, self)
+            yield times, states, spikes.drain()
+
+    def _lsoda_solver(self):
+        """
+        :return: an LSODA solver (scipy.integrate.ode) starting from the current state, with the analytic Jacobian,
+                 and the counts of its RHS and Jacobian evaluations
+        """
+        counts = {"nfe": 0, "nje": 0}
+        rhs = INSTRUMENTS.rhs(self.f)
+
+        # ode passes t and y the other way round to odeint
+        def f(t, y):
+            counts["nfe"] += 1
+            return rhs(y, t)
+
+        def jacobian(t, y):
+            counts["nje"] += 1
+            return self.jacobian(y, t)
+
+        options = self.odeint_options()
+        solver = ode(f, jacobian)
+        solver.set_integrator("lsoda", lband=options.get("ml"), uband=options.get("mu"), nsteps=options["mxstep"])
+        solver.set_initial_value(self.state.T.ravel(), self.time)
+        return solver, counts
+
+
+class NeuronView:
+    """
+    A thin view onto a single neuron of a NeuronPopulation. Reading or setting n, m, h, v or any of the parameters goes
+    straight through to the population's arrays, so nothing is copied.
+    """
+
+    def __init__(self, population, index):
+        """
+        :param population: the population this neuron belongs to
+        :param index: the index of the neuron within the population
+        """
+        if not -population.size <= index < population.size:
+            raise IndexError(f"Neuron index {index} out of range for a population of {population.size}")
+        self.population = population
+        self.index = index % population.size
+
+    def __getattr__(self, name):
+        if name in STATE_VARIABLES:
+            return float(getattr(self.population, name)[self.index])
+        if name in PARAMETERS:
+            return float(getattr(self.population, name)[self.index])
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in STATE_VARIABLES or name in PARAMETERS:
+            getattr(self.population, name)[self.index] = value
+        else:
+            super().__setattr__(name, value)
+
+    def __repr__(self):
+        return f"NeuronView(index={self.index}, v={self.v:.3f})"
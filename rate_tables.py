@@ -0,0 +1,138 @@
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from neuron import f_alphan, f_betan, f_alpham, f_betam, f_alphah, f_betah
+
+"""
+Precomputed lookup tables for the six gating rate functions. Evaluating the exponentials on every RHS call is the most
+expensive part of the HH equations, so instead we tabulate alpha/beta once on a fine voltage grid and look them up with
+linear interpolation.
+"""
+
+#####################################################################
+
+# The order the rates are stored in the table, and returned by RateTable.lookup
+RATE_FUNCTIONS = (f_alphan, f_betan, f_alpham, f_betam, f_alphah, f_betah)
+
+
+class RateTable:
+    """
+    A class to represent the six gating rates tabulated over a voltage grid.
+
+    ...
+
+    Attributes
+    ----------
+    v_min, v_max, dv : float
+        the voltage range covered by the table and the spacing between points, all in mV
+    table : np.ndarray
+        (6, K) array of alpha_n, beta_n, alpha_m, beta_m, alpha_h, beta_h at each grid voltage
+
+    Methods
+    -------
+    lookup(v):
+        Returns all six rates at the voltages v by linear interpolation.
+    """
+
+    def __init__(self, v_min=-150, v_max=100, dv=0.01):
+        """
+        The rate functions in neuron.py use exprel for alpha_n and alpha_m, so the 0/0 points at v = -55 and v = -40 are
+        tabulated as their true limits rather than NaN.
+
+        :param v_min: the lowest voltage in the table. Voltages below this use the value at v_min.
+        :param v_max: the highest voltage in the table. Voltages above this use the value at v_max.
+        :param dv: the spacing of the voltage grid
+        """
+        if v_max <= v_min or dv <= 0:
+            raise ValueError("Rate table needs v_max > v_min and dv > 0")
+
+        self.v_min = v_min
+        self.dv = dv
+        self.points = int(round((v_max - v_min) / dv)) + 1
+        self.v_max = v_min + (self.points - 1) * dv
+
+        voltages = np.linspace(self.v_min, self.v_max, self.points)
+        self.table = np.array([f(voltages) for f in RATE_FUNCTIONS])
+        # Storing the slopes between points means a lookup is just a gather and a multiply-add
+        self.slopes = np.diff(self.table, axis=1)
+
+    def lookup(self, v):
+        """
+        Finds the six rates at the given voltages by vectorised linear interpolation.
+
+        :param v: an array of voltages in mV
+        :return: a tuple of alpha_n, beta_n, alpha_m, beta_m, alpha_h, beta_h, each shaped like v
+        """
+        position = (np.clip(v, self.v_min, self.v_max) - self.v_min) * (1 / self.dv)
+        index = np.minimum(position.astype(np.intp), self.points - 2)
+        fraction = position - index
+        # np.take on each 1D row is several times faster than fancy indexing the whole (6, K) table at once
+        return tuple(np.take(rates, index) + fraction * np.take(slopes, index)
+                     for rates, slopes in zip(self.table, self.slopes))
+
+
+@lru_cache(maxsize=None)
+def get_rate_table(v_min=-150, v_max=100, dv=0.01):
+    """
+    Building a table costs six exponential evaluations per grid point, so tables are shared between every population
+    that asks for the same grid.
+
+    :return: the cached RateTable for this voltage range and spacing
+    """
+    return RateTable(v_min, v_max, dv)
+
+
+def exact_rates(v):
+    """
+    :param v: an array of voltages in mV
+    :return: a tuple of the six rates evaluated directly, in the same order as RateTable.lookup
+    """
+    return tuple(f(v) for f in RATE_FUNCTIONS)
+
+
+#####################################################################
+
+
+def benchmark(size=100000, repeats=20, dv=0.01):
+    """
+    Compares the rate table against evaluating the rate functions directly, over the voltages a neuron actually visits.
+
+    :param size: the number of voltages evaluated per call (i.e. the population size)
+    :param repeats: the number of calls to average over
+    :param dv: the table spacing to test
+    :return: a dict of the timings, speedup and the largest absolute and relative errors of the table
+    """
+    table = get_rate_table(dv=dv)
+    v = np.random.default_rng(0).uniform(-100, 60, size)
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        exact = exact_rates(v)
+    exact_time = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        looked_up = table.lookup(v)
+    table_time = (time.perf_counter() - start) / repeats
+
+    exact = np.array(exact)
+    error = np.abs(np.array(looked_up) - exact)
+    return {
+        "size": size,
+        "dv": dv,
+        "exact_ms": exact_time * 1e3,
+        "table_ms": table_time * 1e3,
+        "speedup": exact_time / table_time,
+        "max_abs_error": float(error.max()),
+        "max_rel_error": float((error / np.abs(exact)).max()),
+    }
+
+
+if __name__ == "__main__":
+    for dv in (0.1, 0.01, 0.001):
+        result = benchmark(dv=dv)
+        print(f"dv={result['dv']} mV: exact {result['exact_ms']:.2f} ms, table {result['table_ms']:.2f} ms "
+              f"({result['speedup']:.1f}x), max abs error {result['max_abs_error']:.2e}, "
+              f"max rel error {result['max_rel_error']:.2e}")
@@ -0,0 +1,386 @@
+import numpy as np
+
+"""
+Recording of simulation results. Rather than appending to Python lists from inside the function odeint integrates (which
+also records every internal trial step odeint takes), recorders are handed the solution odeint returns on the requested
+time grid and copy it into preallocated NumPy buffers.
+"""
+
+#####################################################################
+
+# The state variables a recorder can take straight from the solution, and their row in it
+STATE_ROWS = {"n": 0, "m": 1, "h": 2, "v": 3}
+
+# The membrane currents a recorder can calculate from the solution
+CURRENTS = ("INa", "IK", "IL")
+
+
+def membrane_currents(state, source):
+    """
+    Calculates the ionic currents flowing at each sample, using the same terms as Neuron.f.
+
+    :param state: a (samples, 4, N) array of n, m, h and v
+    :param source: the Neuron or NeuronPopulation the state came from, for its conductances and reversal potentials
+    :return: a dict of INa, IK and IL, each (samples, N)
+    """
+    n, m, h, v = state[:, 0], state[:, 1], state[:, 2], state[:, 3]
+    return {
+        "INa": source.gNa * m**3 * h * (source.ENa - v),
+        "IK": source.gK * n**4 * (source.EK - v),
+        "IL": source.gL * (source.EL - v),
+    }
+
+
+def variable_values(solution, source, variables):
+    """
+    :param solution: a (samples, 4, N) array of n, m, h and v
+    :param source: the Neuron or NeuronPopulation the solution came from
+    :param variables: the names of the variables wanted
+    :return: a dict of the (samples, N) values of each variable
+    """
+    currents = membrane_currents(solution, source) if set(CURRENTS) & set(variables) else {}
+    return {name: solution[:, STATE_ROWS[name]] if name in STATE_ROWS else currents[name] for name in variables}
+
+
+class TraceRecorder:
+    """
+    A class to record chosen variables of a neuron or population into preallocated arrays.
+
+    ...
+
+    Attributes
+    ----------
+    variables : tuple
+        the names of the variables being recorded, any of n, m, h, v, INa, IK and IL
+    every : int
+        only every k-th sample of the solution is kept
+    samples : int
+        the number of samples recorded so far
+
+    Methods
+    -------
+    record(time_points, solution, source):
+        Copies a solution returned by odeint into the buffers.
+
+    times / traces(name):
+        The recorded timestamps and the recorded (samples, N) trace of a variable.
+    """
+
+    def __init__(self, variables=("v",), every=1, capacity=1024):
+        """
+        :param variables: the variables to record
+        :param every: keep every k-th sample of the solution
+        :param capacity: the number of samples to allocate space for up front. The buffers double in size if a run
+                         records more than this.
+        """
+        unknown = set(variables) - set(STATE_ROWS) - set(CURRENTS)
+        if unknown:
+            raise ValueError(f"Unknown variables to record: {', '.join(sorted(unknown))}")
+        if every < 1:
+            raise ValueError("every must be at least 1")
+
+        self.variables = tuple(variables)
+        self.every = every
+        self.capacity = capacity
+        self.samples = 0
+        # Counts every sample offered, including the ones skipped by every, so decimation is continuous across runs
+        self.offered = 0
+
+        self._times = None
+        self._buffers = None
+
+    def _allocate(self, size, required):
+        if self._buffers is None:
+            self.capacity = max(self.capacity, required)
+            self._times = np.empty(self.capacity)
+            self._buffers = {name: np.empty((self.capacity, size)) for name in self.variables}
+            return
+
+        if required <= self.capacity:
+            return
+
+        # Doubling keeps the total copying linear in the number of samples recorded
+        while self.capacity < required:
+            self.capacity *= 2
+        self._times = np.resize(self._times, self.capacity)
+        for name, buffer in self._buffers.items():
+            grown = np.empty((self.capacity, size))
+            grown[:self.samples] = buffer[:self.samples]
+            self._buffers[name] = grown
+
+    def record(self, time_points, solution, source):
+        """
+        Copies the solution of one solver call into the buffers.
+
+        :param time_points: the (samples,) time grid the solution is on
+        :param solution: the solution odeint returned, (samples, 4) for a Neuron or (samples, 4, N) for a population
+        :param source: the Neuron or NeuronPopulation being recorded, used when recording currents
+        """
+        solution = np.asarray(solution)
+        if solution.ndim == 2:
+            solution = solution[:, :, np.newaxis]
+
+        # Picking out the samples which fall on every k-th position of the overall sample count
+        first = (-self.offered) % self.every
+        self.offered += len(time_points)
+        kept = slice(first, None, self.every)
+        time_points = np.asarray(time_points)[kept]
+        solution = solution[kept]
+        if len(time_points) == 0:
+            return
+
+        values = variable_values(solution, source, self.variables)
+        self._store(time_points, values)
+
+    def _store(self, time_points, values):
+        start = self.samples
+        self._allocate(values[self.variables[0]].shape[1], start + len(time_points))
+        stop = start + len(time_points)
+
+        self._times[start:stop] = time_points
+        for name in self.variables:
+            self._buffers[name][start:stop] = values[name]
+
+        self.samples = stop
+
+    @property
+    def times(self):
+        """
+        :return: the recorded timestamps, (samples,)
+        """
+        if self._times is None:
+            return np.empty(0)
+        return self._times[:self.samples]
+
+    def traces(self, name):
+        """
+        :param name: the variable to get the trace of
+        :return: the recorded trace as a (samples, N) array, one column per neuron
+        """
+        if name not in self.variables:
+            raise KeyError(f"{name} is not being recorded")
+        if self._buffers is None:
+            return np.empty((0, 0))
+        return self._buffers[name][:self.samples]
+
+    def state_snapshot(self):
+        """
+        :return: how far the recorder has got, so a resumed run carries on with the same samples kept
+        """
+        return {"offered": self.offered, "samples": self.samples}
+
+    def restore(self, snapshot):
+        """
+        Carries on from a snapshot taken with state_snapshot(). Anything recorded after the snapshot is forgotten; what
+        was recorded before it is only kept if this is the recorder it was taken from.
+        """
+        self.offered = snapshot["offered"]
+        self.samples = min(self.samples, snapshot["samples"])
+
+    def clear(self):
+        """
+        Forgets everything recorded so far, keeping the allocated buffers for reuse.
+        """
+        self.samples = 0
+        self.offered = 0
+
+
+#####################################################################
+
+
+class SpikeMonitor:
+    """
+    A class to record only the times neurons spike, as (neuron, time) pairs, rather than whole voltage traces.
+
+    ...
+
+    Attributes
+    ----------
+    threshold : float
+        the voltage an upward crossing of is a spike
+    refractory : float
+        crossings less than this many ms after a neuron's last spike are ignored, so noise around the threshold isn't
+        counted as several spikes
+    interpolation : str
+        "linear" or "cubic", how the crossing time is placed between the two samples either side of it
+    trace : TraceRecorder or None
+        if set, every solution is also passed on to this recorder for full traces
+    count : int
+        the number of spikes recorded so far
+
+    Methods
+    -------
+    record(time_points, solution, source):
+        Finds the threshold crossings in a solution, in the same way a TraceRecorder is given one.
+
+    neuron_ids / times / spike_times(neuron):
+        The neuron and time of every spike in the order they were found, and the spike times of one neuron.
+
+    drain():
+        Hands over the spikes found so far and forgets them, for streaming runs.
+    """
+
+    def __init__(self, threshold=0.0, refractory=1.0, interpolation="linear", trace=None, capacity=1024):
+        """
+        :param threshold: the spike threshold in mV
+        :param refractory: the shortest time in ms between two spikes of the same neuron
+        :param interpolation: "linear" or "cubic"
+        :param trace: an optional TraceRecorder to also record full traces into
+        :param capacity: the number of spikes to allocate space for up front. The arrays double in size when full.
+        """
+        if interpolation not in ("linear", "cubic"):
+            raise ValueError("interpolation must be linear or cubic")
+        self.threshold = threshold
+        self.refractory = refractory
+        self.interpolation = interpolation
+        self.trace = trace
+        self.capacity = capacity
+        self.count = 0
+
+        self._neuron_ids = np.empty(capacity, dtype=np.int32)
+        self._times = np.empty(capacity, dtype=np.float64)
+        self._last_spike = None
+        # The last two samples of the previous solution, so crossings between calls aren't missed
+        self._previous_t = np.empty(0)
+        self._previous_v = None
+
+    def record(self, time_points, solution, source):
+        """
+        Finds every upward threshold crossing in the solution of one solver call.
+
+        :param time_points: the (samples,) time grid the solution is on
+        :param solution: the solution, (samples, 4) for a Neuron or (samples, 4, N) for a population
+        :param source: the Neuron or NeuronPopulation being recorded
+        """
+        if self.trace is not None:
+            self.trace.record(time_points, solution, source)
+
+        solution = np.asarray(solution)
+        if solution.ndim == 2:
+            solution = solution[:, :, np.newaxis]
+        t = np.asarray(time_points, dtype=float)
+        v = solution[:, STATE_ROWS["v"]]
+
+        if self._previous_v is None:
+            self._previous_v = np.empty((0, v.shape[1]))
+            self._last_spike = np.full(v.shape[1], -np.inf)
+        # A run usually starts with the sample the last one ended on, which is dropped
+        if len(self._previous_t):
+            new = t > self._previous_t[-1]
+            t, v = t[new], v[new]
+        carried = len(self._previous_t)
+        t = np.concatenate((self._previous_t, t))
+        v = np.concatenate((self._previous_v, v))
+        self._previous_t, self._previous_v = t[-2:], v[-2:]
+        if len(t) < 2:
+            return
+
+        below = v < self.threshold
+        step, neuron = np.nonzero(below[:-1] & ~below[1:])
+        # The carried samples are only kept as neighbours for the interpolation. A crossing between the two of them
+        # ended in the last call's samples and was counted then, so only the ones ending in new samples are kept.
+        new = step >= carried - 1
+        step, neuron = step[new], neuron[new]
+        if len(step) == 0:
+            return
+        times = self._crossing_times(t, v, step, neuron)
+
+        # Going through the crossings in time order to apply the refractory guard
+        for i in np.argsort(times, kind="stable"):
+            if times[i] - self._last_spike[neuron[i]] < self.refractory:
+                continue
+            self._last_spike[neuron[i]] = times[i]
+            self._append(neuron[i], times[i])
+
+    def _crossing_times(self, t, v, step, neuron):
+        """
+        :return: the time each crossing from sample step to step + 1 of a neuron reaches the threshold
+        """
+        t0, t1 = t[step], t[step + 1]
+        v0, v1 = v[step, neuron], v[step + 1, neuron]
+        fraction = (self.threshold - v0) / (v1 - v0)
+        if self.interpolation == "cubic" and len(t) > 2:
+            # A cubic Hermite curve through the two samples, with slopes from their neighbours where there are any
+            before = np.maximum(step - 1, 0)
+            after = np.minimum(step + 2, len(t) - 1)
+            slope0 = (v1 - v[before, neuron]) / (t1 - t[before])
+            slope1 = (v[after, neuron] - v0) / (t[after] - t0)
+            width = t1 - t0
+            d0, d1 = slope0 * width, slope1 * width
+
+            # Polishing the linear estimate with Newton's method on the cubic, staying between the samples
+            for _ in range(4):
+                s = fraction
+                h00, h10, h01, h11 = 2*s**3 - 3*s**2 + 1, s**3 - 2*s**2 + s, -2*s**3 + 3*s**2, s**3 - s**2
+                value = h00 * v0 + h10 * d0 + h01 * v1 + h11 * d1 - self.threshold
+                derivative = (6*s**2 - 6*s) * (v0 - v1) + (3*s**2 - 4*s + 1) * d0 + (3*s**2 - 2*s) * d1
+                fraction = np.clip(s - value / np.where(derivative > 0, derivative, np.inf), 0, 1)
+        return t0 + fraction * (t1 - t0)
+
+    def _append(self, neuron, time):
+        if self.count == self.capacity:
+            self.capacity *= 2
+            self._neuron_ids = np.resize(self._neuron_ids, self.capacity)
+            self._times = np.resize(self._times, self.capacity)
+        self._neuron_ids[self.count] = neuron
+        self._times[self.count] = time
+        self.count += 1
+
+    @property
+    def neuron_ids(self):
+        """
+        :return: the neuron of every spike (int32), in the order the spikes were found
+        """
+        return self._neuron_ids[:self.count]
+
+    @property
+    def times(self):
+        """
+        :return: the time of every spike in ms (float64), in the same order as neuron_ids
+        """
+        return self._times[:self.count]
+
+    def spike_times(self, neuron):
+        """
+        :param neuron: the index of the neuron in the population (0 for a single Neuron)
+        :return: the times that neuron spiked, in order
+        """
+        return np.sort(self.times[self.neuron_ids == neuron])
+
+    def state_snapshot(self):
+        """
+        :return: how far the monitor has got: the spike count, the last spike of every neuron and the samples carried
+                 over to the next call
+        """
+        return {"count": self.count, "last_spike": self._last_spike, "previous_t": self._previous_t,
+                "previous_v": self._previous_v}
+
+    def restore(self, snapshot):
+        """
+        Carries on from a snapshot taken with state_snapshot(). As with TraceRecorder.restore, spikes found after the
+        snapshot are forgotten.
+        """
+        self.count = min(self.count, snapshot["count"])
+        self._last_spike = None if snapshot["last_spike"] is None else np.array(snapshot["last_spike"])
+        self._previous_t = np.array(snapshot["previous_t"])
+        self._previous_v = None if snapshot["previous_v"] is None else np.array(snapshot["previous_v"])
+
+    def drain(self):
+        """
+        Hands over the spikes recorded since the last drain and forgets them. Unlike clear(), the last spike of every
+        neuron and the samples carried over are kept, so the next record() carries straight on.
+
+        :return: copies of the neuron_ids and times of those spikes
+        """
+        neuron_ids, times = self.neuron_ids.copy(), self.times.copy()
+        self.count = 0
+        return neuron_ids, times
+
+    def clear(self):
+        """
+        Forgets every spike recorded so far, keeping the allocated arrays for reuse.
+        """
+        self.count = 0
+        self._last_spike = None
+        self._previous_t = np.empty(0)
+        self._previous_v = None
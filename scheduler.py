@@ -0,0 +1,149 @@
+import heapq
+import itertools
+from collections import defaultdict
+
+import numpy as np
+
+"""
+Event driven spike propagation. Instead of every neuron recursively running its connections (which re-runs a neuron once
+for every path that reaches it), spikes are put on a priority queue and delivered in global time order, with a delay per
+connection. All the arrivals a neuron gets within one time window are handed to it together, so it is simulated once per
+window however many upstream neurons it has.
+"""
+
+#####################################################################
+
+
+class SpikeScheduler:
+    """
+    A class to represent a priority queue of spikes travelling along a fixed set of connections.
+
+    ...
+
+    Attributes
+    ----------
+    size : int
+        the number of neurons, which are numbered 0 to size - 1
+    window : float
+        the length of the time windows arrivals are grouped into, by default the shortest delay
+    delivered : int
+        the number of spike arrivals delivered so far
+    simulations : int
+        the number of times a neuron has been handed its arrivals so far
+
+    Methods
+    -------
+    emit(source, time):
+        Sends a spike from a neuron along all of its connections.
+
+    run(handler, until):
+        Delivers spikes in time order until the queue is empty or until is reached.
+    """
+
+    def __init__(self, pre, post, delay=0.0, size=None, window=None):
+        """
+        :param pre: the presynaptic neuron of each connection
+        :param post: the postsynaptic neuron of each connection
+        :param delay: the delay of each connection in ms, or one delay shared by all of them
+        :param size: the number of neurons, by default one more than the largest index in pre or post
+        :param window: the length of the time windows arrivals are grouped into. This must not be longer than the
+                       shortest delay, otherwise a spike could arrive in a window that has already been simulated.
+        """
+        pre = np.asarray(pre, dtype=np.intp)
+        post = np.asarray(post, dtype=np.intp)
+        delay = np.broadcast_to(np.asarray(delay, dtype=float), pre.shape)
+        if np.any(delay < 0):
+            raise ValueError("Connection delays cannot be negative")
+
+        if size is None:
+            size = int(max(pre.max(initial=-1), post.max(initial=-1))) + 1
+        self.size = size
+
+        min_delay = float(delay.min()) if len(delay) else 0.0
+        if window is None:
+            window = min_delay
+        elif window > min_delay:
+            raise ValueError(f"The window ({window} ms) cannot be longer than the shortest delay ({min_delay} ms)")
+        self.window = window
+
+        # Connections are sorted by source then delay, and every run of equal (source, delay) becomes one group. A
+        # spike then only needs one queue entry per distinct delay of its source, rather than one per connection.
+        order = np.lexsort((delay, pre))
+        pre, post, delay = pre[order], post[order], delay[order]
+        new_group = np.ones(len(pre), dtype=bool)
+        new_group[1:] = (pre[1:] != pre[:-1]) | (delay[1:] != delay[:-1])
+        self.group_start = np.append(np.flatnonzero(new_group), len(pre))
+        self.group_delay = delay[new_group]
+        self.source_groups = np.searchsorted(pre[new_group], np.arange(size + 1))
+        self.post = post
+
+        self.queue = []
+        self.sequence = itertools.count()
+        self.delivered = 0
+        self.simulations = 0
+
+    def emit(self, source, time):
+        """
+        Sends a spike from a neuron along all of its connections, each arriving after that connection's delay.
+
+        :param source: the neuron that spiked
+        :param time: the time it spiked at
+        """
+        for group in range(self.source_groups[source], self.source_groups[source + 1]):
+            # The sequence number keeps the order of equal times stable and stops the heap comparing further
+            heapq.heappush(self.queue, (time + self.group_delay[group], next(self.sequence), group, source))
+
+    def state_snapshot(self):
+        """
+        :return: the spikes still on the queue, the next sequence number and the counters
+        """
+        # Reading the next sequence number uses it up, so the counter is restarted from it
+        sequence = next(self.sequence)
+        self.sequence = itertools.count(sequence)
+        times, sequences, groups, sources = zip(*self.queue) if self.queue else ((), (), (), ())
+        return {
+            "times": np.array(times, dtype=np.float64), "sequences": np.array(sequences, dtype=np.int64),
+            "groups": np.array(groups, dtype=np.int64), "sources": np.array(sources, dtype=np.int64),
+            "sequence": sequence, "delivered": self.delivered, "simulations": self.simulations,
+        }
+
+    def restore(self, snapshot):
+        """
+        Puts back the queue and counters of a snapshot taken with state_snapshot(), for the same connections.
+        """
+        # The saved list is already in heap order
+        self.queue = [(float(time), int(sequence), int(group), int(source)) for time, sequence, group, source in
+                      zip(snapshot["times"], snapshot["sequences"], snapshot["groups"], snapshot["sources"])]
+        self.sequence = itertools.count(snapshot["sequence"])
+        self.delivered = snapshot["delivered"]
+        self.simulations = snapshot["simulations"]
+
+    def run(self, handler, until=np.inf):
+        """
+        Delivers spikes in time order. Arrivals are grouped into windows starting at the earliest undelivered spike, and
+        each neuron with arrivals in the window is handed all of them in one call. Any spike times the handler returns
+        are emitted from that neuron.
+
+        :param handler: called as handler(neuron, arrivals) with arrivals a time-ordered list of (time, source)
+                        tuples. It returns the times the neuron spikes at (possibly none).
+        :param until: spikes arriving after this time are left on the queue
+        """
+        while self.queue and self.queue[0][0] <= until:
+            window_start = self.queue[0][0]
+            window_end = window_start + self.window
+
+            arrivals = defaultdict(list)
+            while self.queue and (self.queue[0][0] < window_end or self.queue[0][0] == window_start) \
+                    and self.queue[0][0] <= until:
+                time, _, group, source = heapq.heappop(self.queue)
+                for target in self.post[self.group_start[group]:self.group_start[group + 1]]:
+                    arrivals[target].append((time, source))
+                self.delivered += int(self.group_start[group + 1] - self.group_start[group])
+
+            # Neurons are simulated in order of their first arrival. None of the spikes they produce can land in
+            # this window, since the window is no longer than the shortest delay.
+            for target in sorted(arrivals, key=lambda target: (arrivals[target][0][0], target)):
+                target = int(target)
+                self.simulations += 1
+                for spike_time in handler(target, arrivals[target]):
+                    self.emit(target, spike_time)
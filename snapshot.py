@@ -0,0 +1,110 @@
+import json
+
+import numpy as np
+
+"""
+Checkpointing. A snapshot holds everything needed to carry a simulation on from where it was: the state arrays and clock
+of every neuron or population, the spikes still waiting on a scheduler's queue, how far every recorder has got and the
+state of any random number generators. Saved to a binary .npz file and loaded back into freshly built objects, the
+resumed run is bit-for-bit the same as if the original had never stopped.
+
+Anything with state_snapshot() and restore() can be checkpointed, e.g.
+    save_snapshot("equilibrated.npz", population=population, recorder=recorder, rng=rng)
+    ...
+    load_snapshot("equilibrated.npz", population=new_population, recorder=new_recorder, rng=new_rng)
+"""
+
+#####################################################################
+
+
+def take_snapshot(components):
+    """
+    :param components: a dict of the objects to snapshot by name. numpy.random.Generator objects are saved too.
+    :return: a dict of their snapshots by name
+    """
+    snapshots = {}
+    for name, component in components.items():
+        if isinstance(component, np.random.Generator):
+            snapshots[name] = {"bit_generator": component.bit_generator.state}
+        else:
+            snapshots[name] = component.state_snapshot()
+    return snapshots
+
+
+def restore_snapshot(snapshots, components):
+    """
+    Restores every object from its snapshot, in place.
+
+    :param snapshots: a dict of snapshots by name, as made by take_snapshot
+    :param components: a dict of the objects to restore by the same names
+    """
+    missing = set(components) - set(snapshots)
+    if missing:
+        raise KeyError(f"The snapshot has nothing for {', '.join(sorted(missing))}")
+    for name, component in components.items():
+        if isinstance(component, np.random.Generator):
+            component.bit_generator.state = snapshots[name]["bit_generator"]
+        else:
+            component.restore(snapshots[name])
+
+
+def _split_arrays(value, key, arrays):
+    """
+    Takes the arrays out of a snapshot, which can hold them inside nested dicts and lists (e.g. a population's list of
+    synapse snapshots).
+
+    :param value: the snapshot, or a part of one
+    :param key: the path to it, with its parts separated by "/"
+    :param arrays: the dict every array is put into under its path
+    :return: the value without its arrays. An array in a list leaves a None in its place, to keep the indices.
+    """
+    if isinstance(value, np.ndarray):
+        arrays[key] = value
+        return None
+    if isinstance(value, dict):
+        # An array in a dict is left out altogether, and put back under its field when loading
+        values = {}
+        for field, item in value.items():
+            item = _split_arrays(item, f"{key}/{field}", arrays)
+            if item is not None or value[field] is None:
+                values[field] = item
+        return values
+    if isinstance(value, (list, tuple)):
+        return [_split_arrays(item, f"{key}/{index}", arrays) for index, item in enumerate(value)]
+    return value
+
+
+def save_snapshot(path, **components):
+    """
+    Saves the snapshots of some objects to a binary file. Arrays are stored as they are, everything else (times,
+    counters, generator states) as JSON alongside them.
+
+    :param path: the .npz file to write
+    :param components: the objects to snapshot, by the names to save them under
+    """
+    arrays = {}
+    values = {name: _split_arrays(snapshot, name, arrays) for name, snapshot in take_snapshot(components).items()}
+    arrays["values.json"] = np.frombuffer(json.dumps(values).encode(), dtype=np.uint8)
+    with open(path, "wb") as file:
+        np.savez(file, **arrays)
+
+
+def load_snapshot(path, **components):
+    """
+    Loads a file written by save_snapshot back into objects built the same way as the ones it was saved from.
+
+    :param path: the .npz file to read
+    :param components: the objects to restore, by the names they were saved under
+    :return: the dict of snapshots that was read
+    """
+    with np.load(path) as file:
+        snapshots = json.loads(file["values.json"].tobytes().decode())
+        for key in file.files:
+            if key != "values.json":
+                *path, field = key.split("/")
+                container = snapshots
+                for part in path:
+                    container = container[int(part)] if isinstance(container, list) else container[part]
+                container[int(field) if isinstance(container, list) else field] = file[key]
+    restore_snapshot(snapshots, components)
+    return snapshots
@@ -0,0 +1,128 @@
+import numpy as np
+
+from neuron import f_alphan, f_betan, f_alpham, f_betam, f_alphah, f_betah
+
+"""
+The resting state of the HH equations, worked out directly instead of by simulating until the neuron settles. At rest
+every gate sits at x_inf(v) = alpha_x(v) / (alpha_x(v) + beta_x(v)), and v is where the total membrane current with the
+gates there is zero. The whole population is solved at once, and every distinct parameter set is only ever solved once.
+"""
+
+#####################################################################
+
+# The parameters the resting state depends on, in the order they make up a cache key
+REST_PARAMETERS = ("EL", "ENa", "EK", "gL", "gNa", "gK", "I")
+
+# The range searched for the resting potential, and the spacing of the scan for sign changes
+V_RANGE = (-150.0, 100.0)
+V_SCAN_STEP = 2.0
+
+# Resting potentials already worked out, by parameter set
+_resting_cache = {}
+
+
+def gate_steady_state(v):
+    """
+    :param v: a voltage or array of voltages in mV
+    :return: n_inf, m_inf and h_inf at those voltages
+    """
+    alphan, betan = f_alphan(v), f_betan(v)
+    alpham, betam = f_alpham(v), f_betam(v)
+    alphah, betah = f_alphah(v), f_betah(v)
+    return alphan / (alphan + betan), alpham / (alpham + betam), alphah / (alphah + betah)
+
+
+def steady_state_current(v, EL, ENa, EK, gL, gNa, gK, I=0.0):
+    """
+    :return: the total current into the membrane at v with every gate at its steady state, C dv/dt at that point
+    """
+    n, m, h = gate_steady_state(v)
+    return I + gK * n**4 * (EK - v) + gNa * m**3 * h * (ENa - v) + gL * (EL - v)
+
+
+def _solve(parameters):
+    """
+    Finds the resting potential for every row of parameters at once. The steady state current is scanned for the first
+    place it changes from positive to negative (a stable point, where v is pushed back if it moves either way), and that
+    is narrowed down by bisection until the interval can't be split any further.
+
+    :param parameters: a (rows, 7) array with the columns in REST_PARAMETERS order
+    :return: the resting potential of each row, NaN where there isn't a stable one in V_RANGE
+    """
+    columns = [parameters[:, [i]] for i in range(len(REST_PARAMETERS))]
+    grid = np.arange(V_RANGE[0], V_RANGE[1] + V_SCAN_STEP, V_SCAN_STEP)
+    current = steady_state_current(grid[np.newaxis, :], *columns)
+
+    falling = (current[:, :-1] > 0) & (current[:, 1:] <= 0)
+    found = falling.any(axis=1)
+    first = falling.argmax(axis=1)
+    low = grid[first]
+    high = grid[first + 1]
+
+    columns = [column[:, 0] for column in columns]
+    for _ in range(60):
+        middle = (low + high) / 2
+        positive = steady_state_current(middle, *columns) > 0
+        low = np.where(positive, middle, low)
+        high = np.where(positive, high, middle)
+    return np.where(found, (low + high) / 2, np.nan)
+
+
+def resting_potential(EL, ENa, EK, gL, gNa, gK, I=0.0):
+    """
+    Every argument can be a scalar or an array, for a population with different parameters per neuron.
+
+    :return: the resting potential in mV for each neuron, NaN where there isn't a stable one
+    """
+    arrays = np.broadcast_arrays(*(np.asarray(value, dtype=float) for value in (EL, ENa, EK, gL, gNa, gK, I)))
+    shape = arrays[0].shape
+    parameters = np.stack([array.ravel() for array in arrays], axis=1)
+
+    # Only the distinct parameter sets that haven't been solved before need solving
+    unique, inverse = np.unique(parameters, axis=0, return_inverse=True)
+    keys = [tuple(row) for row in unique.tolist()]
+    unsolved = [i for i, key in enumerate(keys) if key not in _resting_cache]
+    if unsolved:
+        for i, v in zip(unsolved, _solve(unique[unsolved])):
+            _resting_cache[keys[i]] = float(v)
+
+    v = np.array([_resting_cache[key] for key in keys])[np.ravel(inverse)]
+    return v.reshape(shape) if shape else float(v[0])
+
+
+def resting_state(source):
+    """
+    :param source: a Neuron, NeuronPopulation or cable.CableNeuron
+    :return: the resting n, m, h and v, scalars for a Neuron and arrays for the others
+    """
+    v = resting_potential(*(getattr(source, name, 0.0) for name in REST_PARAMETERS))
+    n, m, h = gate_steady_state(v)
+    return n, m, h, v
+
+
+def initialise_at_rest(source):
+    """
+    Sets n, m, h and v of a Neuron, NeuronPopulation or cable.CableNeuron to its resting state, in place.
+    """
+    source.n, source.m, source.h, source.v = resting_state(source)
+
+
+def clear_cache():
+    _resting_cache.clear()
+
+
+if __name__ == "__main__":
+    import time
+    from population import NeuronPopulation
+
+    v = resting_potential(-54.4, 50, -70, 0.3, 120, 36)
+    print(f"Resting state of the default Neuron: v = {v:.6f} mV, n, m, h = "
+          f"{', '.join(f'{x:.6f}' for x in gate_steady_state(v))}, residual current "
+          f"{steady_state_current(v, -54.4, 50, -70, 0.3, 120, 36):.2e}")
+
+    population = NeuronPopulation(100000, gNa=np.linspace(100, 140, 100000), gK=np.tile([30, 36, 42], 33334)[:100000])
+    for attempt in ("cold", "cached"):
+        start = time.perf_counter()
+        initialise_at_rest(population)
+        print(f"100000 neurons, {attempt}: {(time.perf_counter() - start) * 1e3:.1f} ms")
+    print(f"dv/dt after: {np.abs(population.derivatives(population.state)).max():.2e}")
@@ -0,0 +1,201 @@
+import numpy as np
+from scipy.integrate import odeint, solve_ivp
+
+from instrumentation import INSTRUMENTS
+from integrators import apply_current, integrate
+from jacobian import add_stats, odeint_stats
+
+"""
+Stimulus protocols. A protocol is a piecewise current schedule (holds, ramps, pulse trains) that is integrated in one
+pass, rather than as hundreds of separate 1 ms runs. The solver only restarts at the edges between pieces, so it never
+steps across a jump in the current.
+"""
+
+#####################################################################
+
+
+class StimulusProtocol:
+    """
+    A class to represent a piecewise linear injected current.
+
+    ...
+
+    Attributes
+    ----------
+    segments : list
+        (duration, start current, end current) of each piece in order. Holds have equal start and end currents.
+
+    Methods
+    -------
+    hold(duration, current) / rest(duration) / ramp(duration, start, end) / pulse_train(...):
+        Add pieces to the end of the protocol. Each returns the protocol so calls can be chained.
+
+    current(t):
+        The current at times t (measured from the start of the protocol).
+    """
+
+    def __init__(self):
+        self.segments = []
+
+    @classmethod
+    def default_hh(cls):
+        """
+        The protocol of nobrian_singleneuron_defaultHH.py and brian_singleneuron.py: 50 ms of rest, a 3 ms pulse of
+        1 uA, then 50 ms of rest.
+        """
+        return cls().rest(50).hold(3, 1).rest(50)
+
+    def hold(self, duration, current):
+        """
+        Holds the current constant for a length of time.
+        """
+        if duration <= 0:
+            raise ValueError("Protocol segments must have a positive duration")
+        self.segments.append((duration, current, current))
+        return self
+
+    def rest(self, duration):
+        """
+        Injects no current for a length of time.
+        """
+        return self.hold(duration, 0)
+
+    def ramp(self, duration, start_current, end_current):
+        """
+        Changes the current linearly from start_current to end_current over a length of time.
+        """
+        if duration <= 0:
+            raise ValueError("Protocol segments must have a positive duration")
+        self.segments.append((duration, start_current, end_current))
+        return self
+
+    def pulse_train(self, pulses, width, interval, current, baseline=0):
+        """
+        Adds a train of square pulses.
+
+        :param pulses: the number of pulses
+        :param width: the length of each pulse in ms
+        :param interval: the time from the start of one pulse to the start of the next in ms
+        :param current: the current during a pulse
+        :param baseline: the current between pulses
+        """
+        if interval < width:
+            raise ValueError("The interval between pulses cannot be shorter than a pulse")
+        for pulse in range(pulses):
+            self.hold(width, current)
+            if interval > width and pulse < pulses - 1:
+                self.hold(interval - width, baseline)
+        return self
+
+    @property
+    def duration(self):
+        return sum(segment[0] for segment in self.segments)
+
+    @property
+    def boundaries(self):
+        """
+        :return: the times every segment starts and ends, from 0 to the duration
+        """
+        return np.concatenate(([0.0], np.cumsum([segment[0] for segment in self.segments], dtype=float)))
+
+    def current(self, t):
+        """
+        :param t: a time (or array of times) measured from the start of the protocol. Times past the end use the
+                  current at the end.
+        :return: the current at each time
+        """
+        boundaries = self.boundaries
+        durations, starts, ends = (np.array(column, dtype=float) for column in zip(*self.segments))
+
+        # A time exactly on a boundary belongs to the segment starting there
+        segment = np.clip(np.searchsorted(boundaries, t, side="right") - 1, 0, len(self.segments) - 1)
+        fraction = np.clip((np.asarray(t) - boundaries[segment]) / durations[segment], 0, 1)
+        current = starts[segment] + fraction * (ends[segment] - starts[segment])
+        # odeint misbehaves if a scalar current comes back as a 0-d array, so single times give a plain float
+        return float(current) if np.ndim(current) == 0 else current
+
+
+#####################################################################
+
+
+def integrate_protocol(source, state, start_time, protocol, samples=1000, method="odeint", dt=0.01,
+                       stop_threshold=None, **odeint_options):
+    """
+    Integrates a Neuron or NeuronPopulation through a whole protocol in one pass.
+
+    With odeint the solver is only restarted at the segment boundaries, where the current can jump, rather than for
+    every sample. odeint can't stop early, so with a stop_threshold solve_ivp's LSODA is used instead with a terminal
+    threshold event. The fixed-step methods evaluate the current at the middle of every step.
+
+    :param source: the Neuron or NeuronPopulation, whose f is integrated and whose I is set by the protocol
+    :param state: the (4, N) state to start from, updated in place to the final state
+    :param start_time: the time the state is at
+    :param protocol: the StimulusProtocol to run
+    :param samples: the number of evenly spaced time points to keep
+    :param method: "odeint", or one of the fixed-step methods in integrators.STEPPERS
+    :param dt: the step size in ms for the fixed-step methods
+    :param stop_threshold: if given, the run stops as soon as any neuron's v reaches this
+    :param odeint_options: any extra arguments for odeint (e.g. the Jacobian and its bands)
+    :return: the timestamps, the (samples, 4, N) solution and the solver statistics. If the run stopped early these
+             end at the crossing.
+    """
+    if method != "odeint":
+        return integrate(state, source, start_time, protocol.duration, dt, method, samples,
+                         current=protocol.current, stop_threshold=stop_threshold)
+
+    size = state.shape[1]
+    stats = {}
+
+    def protocol_f(y, t):
+        apply_current(source, protocol.current(t - start_time))
+        return source.f(y, t)
+    f = INSTRUMENTS.rhs(protocol_f)
+
+    def crossing(t, y):
+        return np.max(y[3::4]) - stop_threshold
+    crossing.terminal = True
+    crossing.direction = 1
+
+    time_region = np.linspace(start_time, start_time + protocol.duration, samples)
+    y0 = state.T.ravel()
+
+    times = [time_region[:1]]
+    solutions = [y0[np.newaxis]]
+    boundaries = start_time + protocol.boundaries
+    for segment_start, segment_end in zip(boundaries[:-1], boundaries[1:]):
+        # The samples that fall in this segment, plus its ends so the next segment starts from the right state
+        kept = time_region[(time_region > segment_start) & (time_region <= segment_end)]
+        points = np.concatenate(([segment_start], kept))
+        if not len(kept) or kept[-1] < segment_end:
+            points = np.append(points, segment_end)
+
+        if stop_threshold is None:
+            solution, info = odeint(f, y0, points, full_output=True, **odeint_options)
+            add_stats(stats, odeint_stats(info))
+            times.append(kept)
+            solutions.append(solution[1:len(kept) + 1])
+            y0 = solution[-1]
+            continue
+
+        # solve_ivp names odeint's Jacobian bands lband and uband, and passes its arguments the other way round
+        jacobian = odeint_options.get("Dfun")
+        result = solve_ivp(lambda t, y: f(y, t), (segment_start, segment_end), y0, method="LSODA",
+                           t_eval=points[1:], events=crossing, lband=odeint_options.get("ml"),
+                           uband=odeint_options.get("mu"),
+                           jac=None if jacobian is None else lambda t, y: jacobian(y, t))
+        # solve_ivp doesn't report LSODA's step count
+        add_stats(stats, {"nfe": int(result.nfev), "nje": int(result.njev)})
+        reached = min(len(result.t), len(kept))
+        times.append(result.t[:reached])
+        solutions.append(result.y.T[:reached])
+        if result.status == 1:
+            # Finishing on the exact crossing
+            times.append(result.t_events[0])
+            solutions.append(result.y_events[0])
+            break
+        y0 = result.y[:, -1]
+
+    time_region = np.concatenate(times)
+    solution = np.concatenate(solutions).reshape(len(time_region), size, 4).transpose(0, 2, 1)
+    state[:] = solution[-1]
+    return time_region, solution, stats
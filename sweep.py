@@ -0,0 +1,205 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from integrators import STEPPERS
+from population import NeuronPopulation, PARAMETERS, STATE_VARIABLES
+
+"""
+Parameter sweeps, for f-I curves and excitability maps. A grid of parameter values is split into chunks, every chunk is
+simulated as one vectorised NeuronPopulation (one neuron per grid point), and the chunks are spread over a pool of
+worker processes. The grid is handed to every worker once when the pool starts, so a task is only a pair of indices.
+
+From the command line, e.g. an f-I curve over 8 processes:
+    python sweep.py --param current=0:20:201 --param gNa=100,120,140 --workers 8 --output fi.npy
+"""
+
+#####################################################################
+
+# Sweepable parameters of the stimulus: a pulse of current starting at delay ms and lasting width ms. The defaults are
+# the run(3, 1) pulse of nobrian_singleneuron_defaultHH.py, after its 50 ms of rest.
+STIMULUS_PARAMETERS = {"current": 1.0, "delay": 50.0, "width": 3.0}
+
+# What is measured at every grid point
+RESULT_DTYPE = np.dtype([("spike_count", np.int32), ("first_spike_latency", np.float64), ("peak_v", np.float64)])
+
+
+def parameter_grid(**values):
+    """
+    Builds every combination of the given parameter values.
+
+    :param values: a list of values for each parameter to sweep, any of population.PARAMETERS, STATE_VARIABLES (the
+                   starting state) or STIMULUS_PARAMETERS
+    :return: a structured array with one float field per parameter and one row per combination
+    """
+    unknown = set(values) - set(PARAMETERS) - set(STATE_VARIABLES) - set(STIMULUS_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+
+    names = list(values)
+    grid = np.empty([len(values[name]) for name in names], dtype=[(name, np.float64) for name in names])
+    for axis, name in enumerate(names):
+        shape = [1] * len(names)
+        shape[axis] = -1
+        grid[name] = np.reshape(np.asarray(values[name], dtype=float), shape)
+    return grid.ravel()
+
+
+def simulate(points, duration=103.0, dt=0.01, method="rush_larsen", threshold=0.0):
+    """
+    Simulates one neuron per grid point, all together as one population, with a fixed-step method so every neuron can
+    have its own stimulus.
+
+    :param points: a structured array of grid points, as made by parameter_grid
+    :param duration: the length of every simulation in ms
+    :param dt: the step in ms
+    :param method: one of the fixed-step methods in integrators.STEPPERS
+    :param threshold: the voltage an upward crossing of counts as a spike
+    :return: a RESULT_DTYPE array with the spike count, the latency of the first spike after the start of the stimulus
+             (NaN if there wasn't one) and the peak voltage of every point
+    """
+    size = len(points)
+    fields = points.dtype.names
+    population = NeuronPopulation(size, **{name: points[name] for name in fields
+                                           if name in PARAMETERS or name in STATE_VARIABLES})
+    stimulus = {name: points[name] if name in fields else np.full(size, default)
+                for name, default in STIMULUS_PARAMETERS.items()}
+    step = STEPPERS[method]
+
+    results = np.zeros(size, dtype=RESULT_DTYPE)
+    results["first_spike_latency"] = np.nan
+    results["peak_v"] = population.v
+    above = population.v >= threshold
+
+    steps = max(int(np.ceil(duration / dt - 1e-9)), 1)
+    dt = duration / steps
+    for i in range(1, steps + 1):
+        # The current at the middle of the step
+        t = (i - 0.5) * dt
+        on = (t >= stimulus["delay"]) & (t < stimulus["delay"] + stimulus["width"])
+        population.I[:] = np.where(on, stimulus["current"], 0.0)
+
+        v_before = population.v.copy()
+        step(population.state, population, dt)
+        v = population.v
+        np.maximum(results["peak_v"], v, out=results["peak_v"])
+
+        now_above = v >= threshold
+        crossed = now_above & ~above
+        above = now_above
+        if not crossed.any():
+            continue
+        results["spike_count"] += crossed
+        # Placing the crossing within the step by linear interpolation. Spikes before the stimulus (a neuron that
+        # fires on its own) are counted but have no latency.
+        fraction = (threshold - v_before) / np.where(crossed, v - v_before, 1.0)
+        latency = (i - 1 + fraction) * dt - stimulus["delay"]
+        first = crossed & (latency >= 0) & np.isnan(results["first_spike_latency"])
+        results["first_spike_latency"][first] = latency[first]
+
+    return results
+
+
+#####################################################################
+
+# The grid and run options of a worker process, set once by the pool initializer
+_shared = {}
+
+
+def _initialise_worker(grid, options):
+    _shared["grid"] = grid
+    _shared["options"] = options
+
+
+def _simulate_chunk(bounds):
+    start, stop = bounds
+    return start, simulate(_shared["grid"][start:stop], **_shared["options"])
+
+
+def sweep(grid, workers=None, chunk_size=256, **options):
+    """
+    Simulates every point of a grid, spread over a pool of processes.
+
+    :param grid: a structured array of grid points, as made by parameter_grid
+    :param workers: the number of processes, by default one per core. With 1 everything runs in this process.
+    :param chunk_size: the number of grid points each process simulates together as one population. Bigger chunks
+                       vectorise better and spread the cost of sending results back, smaller ones balance the load.
+    :param options: duration, dt, method and threshold, passed on to simulate
+    :return: a structured array of the grid's fields followed by the RESULT_DTYPE fields, one row per grid point
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    results = np.empty(len(grid), dtype=RESULT_DTYPE)
+    chunks = [(start, min(start + chunk_size, len(grid))) for start in range(0, len(grid), chunk_size)]
+
+    if workers == 1:
+        for start, stop in chunks:
+            results[start:stop] = simulate(grid[start:stop], **options)
+    else:
+        with ProcessPoolExecutor(workers, initializer=_initialise_worker, initargs=(grid, options)) as pool:
+            for start, chunk_results in pool.map(_simulate_chunk, chunks):
+                results[start:start + len(chunk_results)] = chunk_results
+
+    table = np.empty(len(grid), dtype=grid.dtype.descr + RESULT_DTYPE.descr)
+    for name in grid.dtype.names:
+        table[name] = grid[name]
+    for name in RESULT_DTYPE.names:
+        table[name] = results[name]
+    return table
+
+
+#####################################################################
+
+
+def parse_values(text):
+    """
+    :param text: either start:stop:count for evenly spaced values including both ends, or a comma separated list
+    :return: the list of values
+    """
+    if ":" in text:
+        start, stop, count = text.split(":")
+        return np.linspace(float(start), float(stop), int(count)).tolist()
+    return [float(value) for value in text.split(",")]
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Sweep HH neuron parameters over a grid, in parallel.")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUES",
+                        help="a parameter to sweep, with VALUES as start:stop:count or a,b,c. Can be repeated.")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: one per core)")
+    parser.add_argument("--chunk-size", type=int, default=256, help="grid points per population")
+    parser.add_argument("--duration", type=float, default=103.0, help="length of every simulation in ms")
+    parser.add_argument("--dt", type=float, default=0.01, help="step in ms")
+    parser.add_argument("--method", choices=sorted(STEPPERS), default="rush_larsen")
+    parser.add_argument("--threshold", type=float, default=0.0, help="spike threshold in mV")
+    parser.add_argument("--output", help="save the results to this .npy file")
+    arguments = parser.parse_args(arguments)
+
+    values = {}
+    for param in arguments.param:
+        name, _, text = param.partition("=")
+        values[name] = parse_values(text)
+    if not values:
+        values["current"] = parse_values("0:10:11")
+    grid = parameter_grid(**values)
+
+    start = time.perf_counter()
+    table = sweep(grid, arguments.workers, arguments.chunk_size, duration=arguments.duration, dt=arguments.dt,
+                  method=arguments.method, threshold=arguments.threshold)
+    elapsed = time.perf_counter() - start
+    print(f"{len(grid)} points in {elapsed:.2f} s ({len(grid) / elapsed:.0f} points/s)")
+
+    if arguments.output:
+        np.save(arguments.output, table)
+    elif len(table) <= 50:
+        print(" ".join(f"{name:>19}" for name in table.dtype.names))
+        for row in table:
+            print(" ".join(f"{value:19.4g}" for value in row))
+    return table
+
+
+if __name__ == "__main__":
+    main()
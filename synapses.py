@@ -0,0 +1,220 @@
+import numpy as np
+
+"""
+Exponential synapses. Between spikes a synapse's conductance (or current) only decays, which is linear, so it is
+advanced with its exact closed-form solution rather than by the solver: a single exponential decays as exp(-t / tau),
+and a bi-exponential is the difference of two (one for the rise and one for the decay). A spike arriving adds its
+weight to the synapse state, scaled so the weight is the peak of the response.
+
+Every synapse of one type onto a neuron adds up linearly, so a population only keeps one state per neuron for each
+type, however many connections there are. A spike arrival is then one scatter-add into those arrays, so the cost is
+the number of synapses that are actually active, and as the synapses never enter the ODE they never force the solver
+to take smaller steps.
+"""
+
+#####################################################################
+
+# Synapse types in the units of neuron.py: time constants in ms and reversal potentials in mV, roughly as in Destexhe,
+# Mainen & Sejnowski (1994)
+PRESETS = {
+    "AMPA": {"tau_rise": 0.2, "tau_decay": 2.0, "E": 0.0},
+    "GABA_A": {"tau_rise": 0.5, "tau_decay": 6.0, "E": -80.0},
+    "GABA_B": {"tau_rise": 30.0, "tau_decay": 150.0, "E": -95.0},
+}
+
+
+def _step_mean(tau, dt):
+    """
+    :return: the mean of exp(-t / tau) over 0 <= t <= dt
+    """
+    return tau / dt * -np.expm1(-dt / tau)
+
+
+class ExponentialSynapses:
+    """
+    A class to represent the synapses of one type onto every neuron of a population.
+
+    ...
+
+    With E set they are conductance based, adding g * (E - v) to a neuron's membrane current, otherwise they are
+    current based and the value is the current itself. With tau_rise set they are bi-exponential, otherwise a single
+    exponential with an instant rise.
+
+    Attributes
+    ----------
+    size : int
+        the number of postsynaptic neurons
+    tau_decay, tau_rise : float
+        the time constants in ms. tau_rise is None for a single exponential.
+    E : float or None
+        the reversal potential in mV, None for current based synapses
+    decay, rise : np.ndarray
+        the two exponentials making up the value of each neuron's synapses, value = decay - rise. rise stays zero for
+        a single exponential.
+    t : float
+        the time the state is at
+
+    Methods
+    -------
+    preset(name, size):
+        Synapses of one of the PRESETS types.
+
+    receive(neurons, weights) / add(weights):
+        Adds the spikes arriving at some of the neurons, or a vector of the weight arriving at every neuron.
+
+    value(t) / step_mean(dt):
+        The conductance or current of every neuron at a time, or averaged over the next step.
+
+    advance(dt) / advance_to(t):
+        Decays the state exactly.
+    """
+
+    def __init__(self, size, tau_decay, tau_rise=None, E=None):
+        """
+        :param size: the number of postsynaptic neurons
+        :param tau_decay: the decay time constant in ms
+        :param tau_rise: the rise time constant in ms for a bi-exponential, shorter than tau_decay
+        :param E: the reversal potential in mV for conductance based synapses
+        """
+        if tau_rise is not None and not 0 < tau_rise < tau_decay:
+            raise ValueError("tau_rise must be positive and shorter than tau_decay")
+        self.size = size
+        self.tau_decay = tau_decay
+        self.tau_rise = tau_rise
+        self.E = E
+        self.decay = np.zeros(size)
+        self.rise = np.zeros(size)
+        self.t = 0.0
+
+        # A spike is scaled so the peak of its response is its weight. The bi-exponential peaks at t_peak.
+        if tau_rise is None:
+            self.scale = 1.0
+        else:
+            t_peak = tau_rise * tau_decay / (tau_decay - tau_rise) * np.log(tau_decay / tau_rise)
+            self.scale = 1 / (np.exp(-t_peak / tau_decay) - np.exp(-t_peak / tau_rise))
+
+        # The decay factors of the last step size, as the same dt is usually used over and over
+        self._dt = None
+        self._factors = None
+
+    @classmethod
+    def preset(cls, name, size):
+        """
+        :param name: one of PRESETS, e.g. "AMPA" or "GABA_A"
+        :param size: the number of postsynaptic neurons
+        """
+        return cls(size, **PRESETS[name])
+
+    @property
+    def conductance_based(self):
+        return self.E is not None
+
+    def receive(self, neurons, weights):
+        """
+        Adds spikes arriving now. A neuron can appear more than once, for several spikes arriving at the same time.
+
+        :param neurons: the postsynaptic neuron of each arriving spike
+        :param weights: the weight of each, a peak conductance in mS or a peak current in uA
+        """
+        increments = self.scale * np.broadcast_to(np.asarray(weights, dtype=float), np.shape(neurons))
+        np.add.at(self.decay, neurons, increments)
+        if self.tau_rise is not None:
+            np.add.at(self.rise, neurons, increments)
+
+    def add(self, weights):
+        """
+        Adds a weight arriving now at every neuron (zero for none), e.g. a slot taken off a delays.DelayRingBuffer.
+
+        :param weights: the (N,) weights
+        """
+        increments = self.scale * weights
+        self.decay += increments
+        if self.tau_rise is not None:
+            self.rise += increments
+
+    def value(self, t=None):
+        """
+        :param t: a time at or after the state's, by default the state's own time
+        :return: the conductance (or current) of every neuron at t
+        """
+        if t is None or t == self.t:
+            return self.decay - self.rise
+        elapsed = t - self.t
+        value = self.decay * np.exp(-elapsed / self.tau_decay)
+        if self.tau_rise is not None:
+            value -= self.rise * np.exp(-elapsed / self.tau_rise)
+        return value
+
+    def step_mean(self, dt):
+        """
+        :return: the exact mean conductance (or current) of every neuron over the next dt
+        """
+        value = self.decay * _step_mean(self.tau_decay, dt)
+        if self.tau_rise is not None:
+            value -= self.rise * _step_mean(self.tau_rise, dt)
+        return value
+
+    def advance(self, dt):
+        """
+        Decays the state through dt in place, with its exact solution.
+        """
+        if dt != self._dt:
+            self._dt = dt
+            self._factors = (np.exp(-dt / self.tau_decay),
+                             None if self.tau_rise is None else np.exp(-dt / self.tau_rise))
+        self.decay *= self._factors[0]
+        if self.tau_rise is not None:
+            self.rise *= self._factors[1]
+        self.t += dt
+
+    def advance_to(self, t):
+        """
+        Decays the state up to time t.
+        """
+        if t < self.t - 1e-9:
+            raise ValueError(f"Synapses can't go back in time from {self.t} ms to {t} ms")
+        if t > self.t + 1e-9:
+            self.advance(t - self.t)
+        # Exactly t, rather than whatever a sum of steps rounded to
+        self.t = t
+
+    def state_snapshot(self):
+        return {"decay": self.decay.copy(), "rise": self.rise.copy(), "t": self.t}
+
+    def restore(self, snapshot):
+        self.decay[:] = snapshot["decay"]
+        self.rise[:] = snapshot["rise"]
+        self.t = snapshot["t"]
+
+    def __repr__(self):
+        kind = "conductance" if self.conductance_based else "current"
+        return f"ExponentialSynapses(size={self.size}, {kind}, tau_rise={self.tau_rise}, tau_decay={self.tau_decay})"
+
+
+def synaptic_terms(synapses, dt=None, t=None):
+    """
+    Adds up the synapses of a neuron or population in the form the membrane equation takes them.
+
+    :param synapses: a list of ExponentialSynapses
+    :param dt: if given, every value is its exact mean over the next dt, for a fixed-step integrator
+    :param t: otherwise the values are at time t (by default the synapses' own time)
+    :return: the total synaptic conductance, the total of each conductance times its reversal potential, and the
+             total synaptic current, so the synaptic current is g_E - g * v + I
+    """
+    conductance = conductance_E = current = 0.0
+    for synapse in synapses:
+        value = synapse.value(t) if dt is None else synapse.step_mean(dt)
+        if synapse.conductance_based:
+            conductance = conductance + value
+            conductance_E = conductance_E + value * synapse.E
+        else:
+            current = current + value
+    return conductance, conductance_E, current
+
+
+def advance_synapses(source, dt):
+    """
+    Decays the synapses of a Neuron or NeuronPopulation (if it has any) through one step.
+    """
+    for synapse in getattr(source, "synapses", ()):
+        synapse.advance(dt)
@@ -0,0 +1,20 @@
+import numpy as np
+
+from distributed import simulate
+from network import Network
+
+number_of_neurons = 5
+
+# The same line of neurons as line_of_neurons_model.py, but every spike now opens an AMPA synapse on the next neuron
+# along after a 1 ms delay, rather than being passed on by recursion. The connection weights are the peak synaptic
+# conductances in mS/cm^2.
+network = Network.chain(number_of_neurons, weight=0.1, delay=1.0)
+
+# Only the first neuron is driven, so any spike further along has arrived through the synapses
+current = np.zeros(number_of_neurons)
+current[0] = 10.0
+state, spike_neurons, spike_times = simulate(network, duration=30.0, current=current, synapse="AMPA")
+
+for neuron in range(number_of_neurons):
+    times = ", ".join(f"{time:.2f}" for time in spike_times[spike_neurons == neuron])
+    print(f"Neuron {neuron} spiked at {times} ms")
@@ -0,0 +1,287 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.special import exprel
+
+from instrumentation import INSTRUMENTS
+
+"""
+Rush-Larsen stepping of a NeuronPopulation on a pool of threads. The population is split into contiguous chunks of
+neurons, small enough that a chunk's state, parameters and scratch arrays stay in cache, and every chunk is advanced
+through a whole window of steps by one thread of the pool. Every operation is a NumPy ufunc writing into a
+preallocated array (out=), so nothing is allocated per step and the GIL is released for the actual arithmetic, which
+is what lets the threads run at the same time.
+
+The threads only wait for each other at the end of a window, the point where spikes would be exchanged between
+neurons. The operations are the same, in the same order, as integrators.rush_larsen_step, so the result is identical
+to population.run(method="rush_larsen") whatever the number of threads.
+"""
+
+#####################################################################
+
+# The neurons in a chunk by default. A chunk has 4 state, 8 parameter and 12 scratch arrays of float64, which at this
+# size comes to 1.5 MB, about a per-core L2 cache. Smaller chunks fit a smaller cache, but the ~40 ufunc calls a
+# step makes per chunk then cost more than the cache saves (1024 neurons a chunk is almost twice as slow).
+CHUNK_SIZE = 8192
+
+# The scratch arrays every chunk has, one per rate plus the membrane terms and two temporaries
+_SCRATCH = ("alphan", "betan", "alpham", "betam", "alphah", "betah", "g_K", "g_Na", "g_total", "E_total", "a", "b")
+
+
+def _exp_rate(v, shift, scale, factor, out):
+    """
+    factor * exp(-(v + shift) / scale), as in f_betan, f_betam and f_alphah, written into out.
+    """
+    np.add(v, shift, out=out)
+    np.negative(out, out=out)
+    np.divide(out, scale, out=out)
+    np.exp(out, out=out)
+    np.multiply(factor, out, out=out)
+
+
+def _exprel_rate(v, shift, factor, out):
+    """
+    factor / exprel(-(v + shift) / 10), as in f_alphan and f_alpham, written into out.
+    """
+    np.add(v, shift, out=out)
+    np.negative(out, out=out)
+    np.divide(out, 10, out=out)
+    exprel(out, out=out)
+    np.divide(factor, out, out=out)
+
+
+def _gate_step(x, alpha, beta, dt, a, b):
+    """
+    integrators.gate_step in place: x is advanced, alpha is overwritten and a and b are scratch.
+    """
+    np.add(alpha, beta, out=a)
+    np.divide(alpha, a, out=alpha)
+    np.multiply(-dt, a, out=a)
+    np.exp(a, out=a)
+    np.subtract(x, alpha, out=b)
+    np.multiply(b, a, out=b)
+    np.add(alpha, b, out=x)
+
+
+def rush_larsen_chunk(chunk, dt, steps, solution=None, kept_steps=None, first_step=0):
+    """
+    Advances one chunk of neurons through a number of Rush-Larsen steps, in place.
+
+    :param chunk: the dict of views and scratch arrays made by ThreadedStepper
+    :param dt: the step in ms
+    :param steps: the number of steps to take
+    :param solution: the (samples, 4, N) array of the whole run, which this chunk fills its own columns of
+    :param kept_steps: a dict of the step number of every sample to keep, to its index in solution
+    :param first_step: the step number the chunk is starting from
+    """
+    n, m, h, v = chunk["state"]
+    gK, gNa, gL, EK, ENa, EL, C, I = (chunk[name] for name in ("gK", "gNa", "gL", "EK", "ENa", "EL", "C", "I"))
+    scratch = chunk["scratch"]
+    alphan, betan, alpham, betam, alphah, betah = (scratch[name] for name in _SCRATCH[:6])
+    g_K, g_Na, g_total, E_total, a, b = (scratch[name] for name in _SCRATCH[6:])
+    columns = chunk["columns"]
+
+    for step in range(first_step + 1, first_step + steps + 1):
+        # The rates at the voltage at the start of the step
+        _exprel_rate(v, 55, 0.1, alphan)
+        _exp_rate(v, 65, 80, 0.125, betan)
+        _exprel_rate(v, 40, 1, alpham)
+        _exp_rate(v, 65, 18, 4, betam)
+        _exp_rate(v, 65, 20, 0.07, alphah)
+        np.add(v, 35, out=betah)
+        np.negative(betah, out=betah)
+        np.divide(betah, 10, out=betah)
+        np.exp(betah, out=betah)
+        np.add(1, betah, out=betah)
+        np.divide(1, betah, out=betah)
+
+        _gate_step(n, alphan, betan, dt, a, b)
+        _gate_step(m, alpham, betam, dt, a, b)
+        _gate_step(h, alphah, betah, dt, a, b)
+
+        # integrators.membrane_terms with the new gates
+        np.power(n, 4, out=g_K)
+        np.multiply(gK, g_K, out=g_K)
+        np.power(m, 3, out=g_Na)
+        np.multiply(gNa, g_Na, out=g_Na)
+        np.multiply(g_Na, h, out=g_Na)
+        np.add(g_K, g_Na, out=g_total)
+        np.add(g_total, gL, out=g_total)
+        np.multiply(g_K, EK, out=E_total)
+        np.multiply(g_Na, ENa, out=a)
+        np.add(E_total, a, out=E_total)
+        np.multiply(gL, EL, out=a)
+        np.add(E_total, a, out=E_total)
+        np.add(E_total, I, out=E_total)
+        np.divide(E_total, g_total, out=E_total)
+
+        # The semi-implicit voltage step, (v + scale * E_total) / (1 + scale)
+        np.multiply(dt, g_total, out=g_total)
+        np.divide(g_total, C, out=g_total)
+        np.multiply(g_total, E_total, out=E_total)
+        np.add(v, E_total, out=E_total)
+        np.add(1, g_total, out=g_total)
+        np.divide(E_total, g_total, out=v)
+
+        if solution is not None and step in kept_steps:
+            solution[kept_steps[step], :, columns] = chunk["state"]
+
+
+class ThreadedStepper:
+    """
+    A class to represent a NeuronPopulation stepped in chunks on a persistent pool of threads.
+
+    ...
+
+    Attributes
+    ----------
+    population : population.NeuronPopulation
+        the population being stepped, whose state is updated in place
+    threads : int
+        the number of threads in the pool
+    chunks : list
+        for every chunk of neurons, views onto its columns of the state and parameters, and its scratch arrays
+
+    Methods
+    -------
+    run(time_length, current_start, samples, dt, window_ms, exchange):
+        As NeuronPopulation.run with method="rush_larsen", with the chunks advanced in parallel.
+
+    close():
+        Shuts the thread pool down. The stepper can also be used as a context manager.
+    """
+
+    def __init__(self, population, threads=None, chunk_size=CHUNK_SIZE):
+        """
+        :param population: the population.NeuronPopulation to step. Its gating rates must be evaluated directly, not
+                           looked up from a rate table, and it can't have synapses.
+        :param threads: the number of threads, by default one per CPU
+        :param chunk_size: the number of neurons in a chunk
+        """
+        if population.rate_table is not None:
+            raise ValueError("ThreadedStepper evaluates the rates directly, so the population can't use a rate table")
+        if population.synapses:
+            raise ValueError("ThreadedStepper doesn't step synapses, so the population can't have any")
+        self.population = population
+        self.threads = threads or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="population")
+
+        self.chunks = []
+        for start in range(0, population.size, chunk_size):
+            columns = slice(start, min(start + chunk_size, population.size))
+            chunk = {name: getattr(population, name)[columns]
+                     for name in ("gK", "gNa", "gL", "EK", "ENa", "EL", "C", "I")}
+            chunk["columns"] = columns
+            # The state rows are made contiguous for the chunk, and copied back into the population after every run
+            chunk["state"] = np.ascontiguousarray(population.state[:, columns])
+            chunk["scratch"] = {name: np.empty(columns.stop - columns.start) for name in _SCRATCH}
+            self.chunks.append(chunk)
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def run(self, time_length, current_start=None, samples=1000, dt=0.01, window_ms=None, exchange=None):
+        """
+        Runs the whole population with Rush-Larsen steps, every chunk on a thread of the pool.
+
+        :param time_length: the length of time to run the simulation for
+        :param current_start: the current to inject, a scalar or one value per neuron. None keeps the current I.
+        :param samples: the number of time points to return the solution at
+        :param dt: the step size in ms. It is shrunk slightly if it doesn't divide time_length exactly.
+        :param window_ms: the threads only wait for each other every window_ms, by default only at the end of the run
+        :param exchange: called as exchange(t, state) with the population's (4, N) state at the end of every window,
+                         where spikes would be passed between neurons. Changes it makes to the state or I carry on.
+        :return: the timestamps (samples,) and the solution as a (samples, 4, N) array
+        """
+        population = self.population
+        if current_start is not None:
+            population.I[:] = current_start
+        for chunk in self.chunks:
+            chunk["state"][:] = population.state[:, chunk["columns"]]
+
+        # The same step count and kept steps as integrators.integrate
+        steps = max(int(np.ceil(time_length / dt - 1e-9)), 1)
+        dt = time_length / steps
+        kept = np.unique(np.round(np.linspace(0, steps, min(samples, steps + 1))).astype(int))
+        kept_steps = {int(step): index for index, step in enumerate(kept)}
+        solution = np.empty((len(kept), 4, population.size))
+        solution[0] = population.state
+
+        window = steps if window_ms is None else max(int(round(window_ms / dt)), 1)
+        with INSTRUMENTS.phase("integrate"):
+            for first_step in range(0, steps, window):
+                length = min(window, steps - first_step)
+                futures = [self.pool.submit(rush_larsen_chunk, chunk, dt, length, solution, kept_steps, first_step)
+                           for chunk in self.chunks]
+                for future in futures:
+                    future.result()
+                if exchange is not None:
+                    for chunk in self.chunks:
+                        population.state[:, chunk["columns"]] = chunk["state"]
+                    exchange(population.time + (first_step + length) * dt, population.state)
+                    for chunk in self.chunks:
+                        chunk["state"][:] = population.state[:, chunk["columns"]]
+
+        for chunk in self.chunks:
+            population.state[:, chunk["columns"]] = chunk["state"]
+        population.solver_stats = {"nfe": steps, "nje": 0, "steps": steps}
+        INSTRUMENTS.solver_call(population.solver_stats)
+
+        time_region = population.time + kept * dt
+        population.time = time_region[-1]
+        if population.recorder is not None:
+            with INSTRUMENTS.phase("record"):
+                population.recorder.record(time_region, solution, population)
+        return time_region, solution
+
+
+#####################################################################
+
+
+def scaling_benchmark(size=100000, threads=(1, 2, 4, 8, 16, 32), duration=5.0, dt=0.01):
+    """
+    Strong scaling: the same population stepped with more and more threads, against the serial rush_larsen run.
+
+    :param size: the number of neurons
+    :param threads: the thread counts to try
+    :param duration: the ms to simulate
+    :param dt: the step in ms
+    :return: a list of dicts of the thread count, wall time, neuron steps per second and speedup over serial
+    """
+    from population import NeuronPopulation
+
+    def population():
+        return NeuronPopulation(size, at_rest=True, I=np.linspace(0, 20, size))
+
+    serial = population()
+    start = time.perf_counter()
+    _, reference = serial.run(duration, samples=11, method="rush_larsen", dt=dt)
+    serial_seconds = time.perf_counter() - start
+    neuron_steps = size * int(round(duration / dt))
+
+    results = [{"threads": "serial", "seconds": serial_seconds, "neuron_steps_per_s": neuron_steps / serial_seconds,
+                "speedup": 1.0, "identical": True}]
+    for count in threads:
+        with ThreadedStepper(population(), count) as stepper:
+            start = time.perf_counter()
+            _, solution = stepper.run(duration, samples=11, dt=dt)
+            seconds = time.perf_counter() - start
+        results.append({"threads": count, "seconds": seconds, "neuron_steps_per_s": neuron_steps / seconds,
+                        "speedup": serial_seconds / seconds, "identical": bool(np.array_equal(solution, reference))})
+    return results
+
+
+if __name__ == "__main__":
+    print(f"{os.cpu_count()} CPUs")
+    print(f"{'threads':>8}{'seconds':>10}{'neuron steps/s':>16}{'speedup':>9}{'identical':>11}")
+    for result in scaling_benchmark():
+        print(f"{result['threads']:>8}{result['seconds']:10.3f}{result['neuron_steps_per_s']:16.4g}"
+              f"{result['speedup']:9.2f}{str(result['identical']):>11}")
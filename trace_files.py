@@ -0,0 +1,319 @@
+import ast
+import json
+import os
+
+import numpy as np
+
+from recorder import TraceRecorder
+
+"""
+Streaming traces to disk. A StreamingRecorder is a recorder.TraceRecorder which only holds one chunk of samples in memory
+and appends every full chunk to a directory of .npy files, one per recorded variable, alongside a metadata.json sidecar.
+The .npy headers are padded so their shapes can be rewritten in place as the files grow, which keeps every file a plain
+.npy that np.load can memory-map. A TraceFile then reads any neurons and time range back without loading the rest.
+
+Layout of a trace directory:
+    metadata.json   variables, neuron ids, dt, units and the number of samples written
+    times.npy       (samples,) timestamps in ms
+    <variable>.npy  (samples, N) for every recorded variable
+"""
+
+#####################################################################
+
+UNITS = {"time": "ms", "v": "mV", "n": "1", "m": "1", "h": "1", "INa": "uA/cm^2", "IK": "uA/cm^2", "IL": "uA/cm^2"}
+
+# The space reserved for every .npy header, enough for any shape the file could grow to
+HEADER_LENGTH = 256
+
+
+def write_npy_header(file, dtype, shape):
+    """
+    Writes a version 1.0 .npy header padded to HEADER_LENGTH bytes at the start of a file, so it can be rewritten with a
+    longer shape without moving the data after it.
+
+    :param file: the file, open for writing in binary mode
+    :param dtype: the dtype of the array
+    :param shape: the shape of the array
+    """
+    header = repr({"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False,
+                   "shape": tuple(shape)})
+    # The magic string, the version, the header length and then the header, padded with spaces and ending in \n
+    preamble = b"\x93NUMPY\x01\x00" + (HEADER_LENGTH - 10).to_bytes(2, "little")
+    header = header.encode("latin1").ljust(HEADER_LENGTH - len(preamble) - 1) + b"\n"
+    if len(header) + len(preamble) != HEADER_LENGTH:
+        raise ValueError(f"The .npy header for shape {shape} doesn't fit in {HEADER_LENGTH} bytes")
+    file.seek(0)
+    file.write(preamble + header)
+
+
+def read_npy_shape(path):
+    """
+    :param path: a .npy file written by a StreamingRecorder
+    :return: the shape its header says it holds
+    """
+    with open(path, "rb") as file:
+        preamble = file.read(10)
+        header = file.read(int.from_bytes(preamble[8:10], "little"))
+    return ast.literal_eval(header.decode("latin1"))["shape"]
+
+
+class StreamingRecorder(TraceRecorder):
+    """
+    A class to record chosen variables of a neuron or population straight to disk, in chunks.
+
+    ...
+
+    Attributes
+    ----------
+    path : str
+        the directory the traces are written to
+    chunk_samples : int
+        the number of samples held in memory before they are appended to the files
+    written : int
+        the number of samples on disk so far
+
+    Methods
+    -------
+    record(time_points, solution, source):
+        Adds a solution to the current chunk, writing it out whenever it fills.
+
+    flush() / close():
+        Writes out whatever is in the current chunk and brings the headers and metadata up to date.
+    """
+
+    def __init__(self, path, variables=("v",), every=1, chunk_samples=4096, dtype=np.float64, neuron_ids=None, dt=None):
+        """
+        :param path: the directory to write to. It is created if needed, and any traces already in it are replaced.
+        :param variables: the variables to record
+        :param every: keep every k-th sample of the solution
+        :param chunk_samples: the number of samples to hold in memory between writes
+        :param dtype: the dtype the traces are stored as, e.g. np.float32 to halve the file sizes. Times are always
+                      stored as float64.
+        :param neuron_ids: an id for every neuron recorded, by default 0 to N - 1
+        :param dt: the time between samples in ms, for the metadata. By default it is taken from the first samples.
+        """
+        super().__init__(variables, every, capacity=chunk_samples)
+        self.path = path
+        self.chunk_samples = chunk_samples
+        self.dtype = np.dtype(dtype)
+        self.neuron_ids = None if neuron_ids is None else np.asarray(neuron_ids).tolist()
+        self.dt = dt
+        self.written = 0
+        self.size = None
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, name):
+        return os.path.join(self.path, name + ".npy")
+
+    def _store(self, time_points, values):
+        if self.size is None:
+            self._create(time_points, values)
+
+        # Filling the in-memory chunk, writing it out every time it fills up
+        done = 0
+        while done < len(time_points):
+            space = self.chunk_samples - self.samples
+            taken = slice(done, done + space)
+            super()._store(time_points[taken], {name: value[taken] for name, value in values.items()})
+            done += space
+            if self.samples == self.chunk_samples:
+                self.flush()
+
+    def _create(self, time_points, values):
+        self.size = values[self.variables[0]].shape[1]
+        if self.neuron_ids is None:
+            self.neuron_ids = list(range(self.size))
+        elif len(self.neuron_ids) != self.size:
+            raise ValueError(f"{len(self.neuron_ids)} neuron ids given for {self.size} neurons")
+        if self.dt is None and len(time_points) > 1:
+            self.dt = float(time_points[1] - time_points[0])
+
+        with open(self._file("times"), "wb") as file:
+            write_npy_header(file, np.float64, (0,))
+        for name in self.variables:
+            with open(self._file(name), "wb") as file:
+                write_npy_header(file, self.dtype, (0, self.size))
+        self._write_metadata()
+
+    def _write_metadata(self):
+        metadata = {
+            "variables": list(self.variables),
+            "neurons": self.size,
+            "neuron_ids": self.neuron_ids,
+            "samples": self.written,
+            "dt": self.dt,
+            "every": self.every,
+            "dtype": self.dtype.str,
+            "units": {name: UNITS[name] for name in ("time",) + self.variables},
+        }
+        with open(os.path.join(self.path, "metadata.json"), "w") as file:
+            json.dump(metadata, file, indent=2)
+
+    def flush(self):
+        """
+        Appends the samples held in memory to the files, then updates their headers and the metadata. The directory is
+        a complete, readable recording after every flush.
+        """
+        if self.size is None:
+            return
+        written = self.written + self.samples
+        if self.samples:
+            with open(self._file("times"), "r+b") as file:
+                file.seek(0, os.SEEK_END)
+                file.write(self._times[:self.samples].tobytes())
+                write_npy_header(file, np.float64, (written,))
+            for name in self.variables:
+                with open(self._file(name), "r+b") as file:
+                    file.seek(0, os.SEEK_END)
+                    file.write(self._buffers[name][:self.samples].astype(self.dtype, copy=False).tobytes())
+                    write_npy_header(file, self.dtype, (written, self.size))
+        self.written = written
+        self.samples = 0
+        self._write_metadata()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def times(self):
+        """
+        :return: every timestamp recorded, memory-mapped from disk (after flushing the current chunk)
+        """
+        self.flush()
+        return TraceFile(self.path).times
+
+    def traces(self, name):
+        """
+        :param name: the variable to get the trace of
+        :return: the whole recorded trace, memory-mapped from disk (after flushing the current chunk)
+        """
+        if name not in self.variables:
+            raise KeyError(f"{name} is not being recorded")
+        self.flush()
+        return TraceFile(self.path).traces(name)
+
+    def state_snapshot(self):
+        """
+        Flushes the current chunk, so the snapshot only has to say how much of each file belongs to it.
+
+        :return: the number of samples offered and written so far
+        """
+        self.flush()
+        return {"offered": self.offered, "written": self.written}
+
+    def restore(self, snapshot):
+        """
+        Carries on from a snapshot taken with state_snapshot(), cutting the files in the directory back to the length
+        they were then. This works from a new StreamingRecorder on the same directory, e.g. in a new process.
+        """
+        if self.size is None:
+            with open(os.path.join(self.path, "metadata.json")) as file:
+                metadata = json.load(file)
+            self.size = metadata["neurons"]
+            self.neuron_ids = metadata["neuron_ids"]
+            self.dt = metadata["dt"]
+
+        self.offered = snapshot["offered"]
+        self.samples = 0
+        self.written = snapshot["written"]
+        with open(self._file("times"), "r+b") as file:
+            file.truncate(HEADER_LENGTH + self.written * 8)
+            write_npy_header(file, np.float64, (self.written,))
+        for name in self.variables:
+            with open(self._file(name), "r+b") as file:
+                file.truncate(HEADER_LENGTH + self.written * self.size * self.dtype.itemsize)
+                write_npy_header(file, self.dtype, (self.written, self.size))
+        self._write_metadata()
+
+    def clear(self):
+        """
+        Discards everything recorded so far, on disk and in memory.
+        """
+        super().clear()
+        self.written = 0
+        if self.size is not None:
+            with open(self._file("times"), "r+b") as file:
+                file.truncate(HEADER_LENGTH)
+                write_npy_header(file, np.float64, (0,))
+            for name in self.variables:
+                with open(self._file(name), "r+b") as file:
+                    file.truncate(HEADER_LENGTH)
+                    write_npy_header(file, self.dtype, (0, self.size))
+            self._write_metadata()
+
+
+#####################################################################
+
+
+class TraceFile:
+    """
+    A class to read back a directory written by a StreamingRecorder, without loading it into memory.
+
+    ...
+
+    Attributes
+    ----------
+    metadata : dict
+        the contents of metadata.json
+    times : np.memmap
+        the recorded timestamps
+
+    Methods
+    -------
+    traces(name):
+        The whole (samples, N) trace of a variable, memory-mapped.
+
+    read(name, neurons, start, stop):
+        Copies out the trace of some neurons over a time range.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the directory the traces were written to
+        """
+        self.path = path
+        with open(os.path.join(path, "metadata.json")) as file:
+            self.metadata = json.load(file)
+        self.times = self._load("times")
+
+    def _load(self, name):
+        path = os.path.join(self.path, name + ".npy")
+        # np.load can't memory-map an empty array
+        if read_npy_shape(path)[0] == 0:
+            return np.load(path)
+        return np.load(path, mmap_mode="r")
+
+    @property
+    def neuron_ids(self):
+        return self.metadata["neuron_ids"]
+
+    def traces(self, name):
+        """
+        :param name: the variable to get the trace of
+        :return: the (samples, N) trace, memory-mapped so only the parts used are read from disk
+        """
+        if name not in self.metadata["variables"]:
+            raise KeyError(f"{name} was not recorded")
+        return self._load(name)
+
+    def read(self, name, neurons=None, start=None, stop=None):
+        """
+        :param name: the variable to read
+        :param neurons: the neuron ids to read, by default all of them
+        :param start: the earliest time to read from in ms, by default the start of the recording
+        :param stop: the time to read up to (exclusive) in ms, by default the end of the recording
+        :return: the timestamps in the range and a (samples, len(neurons)) array of the trace
+        """
+        first = 0 if start is None else int(np.searchsorted(self.times, start, side="left"))
+        last = len(self.times) if stop is None else int(np.searchsorted(self.times, stop, side="left"))
+        trace = self.traces(name)[first:last]
+        if neurons is not None:
+            columns = {neuron_id: column for column, neuron_id in enumerate(self.neuron_ids)}
+            trace = trace[:, [columns[neuron_id] for neuron_id in neurons]]
+        return np.array(self.times[first:last]), np.array(trace)
@@ -0,0 +1,155 @@
+import numpy as np
+
+"""
+Post-processing of recorded traces. Everything here works on whole NumPy arrays at once, so it stays fast for traces of
+millions of samples (the list based remove_duplicates this replaces checked every point against every other point).
+"""
+
+#####################################################################
+
+
+def unique_first(time_points, *arrays):
+    """
+    Removes repeated timestamps, keeping the first sample recorded at each time and the original order of the rest.
+
+    :param time_points: the timestamps of the trace
+    :param arrays: any number of arrays with one entry (or row) per timestamp to be filtered in the same way
+    :return: the filtered timestamps, followed by each filtered array
+    """
+    time_points = np.asarray(time_points)
+    arrays = [np.asarray(array) for array in arrays]
+
+    if len(time_points) < 2:
+        return (time_points, *arrays)
+
+    if np.all(time_points[1:] >= time_points[:-1]):
+        # Already in time order (the usual case), so duplicates can only sit next to each other
+        keep = np.empty(len(time_points), dtype=bool)
+        keep[0] = True
+        np.not_equal(time_points[1:], time_points[:-1], out=keep[1:])
+    else:
+        # np.unique gives the index of the first occurrence of each time, sorting those puts them back in order
+        _, first = np.unique(time_points, return_index=True)
+        keep = np.sort(first)
+
+    return (time_points[keep], *[array[keep] for array in arrays])
+
+
+def sort_by_time(time_points, *arrays):
+    """
+    Puts a trace into time order. The sort is stable, so samples recorded at the same time keep their order.
+
+    :param time_points: the timestamps of the trace
+    :param arrays: any number of arrays with one entry (or row) per timestamp to be reordered in the same way
+    :return: the sorted timestamps, followed by each reordered array
+    """
+    time_points = np.asarray(time_points)
+    order = np.argsort(time_points, kind="stable")
+    return (time_points[order], *[np.asarray(array)[order] for array in arrays])
+
+
+def resample_uniform(time_points, array, dt=None, samples=None):
+    """
+    Linearly interpolates a trace onto an evenly spaced time grid. The trace must be in time order with no duplicates,
+    e.g. after unique_first and sort_by_time.
+
+    :param time_points: the timestamps of the trace
+    :param array: the values of the trace, 1D or (samples, N) for several neurons
+    :param dt: the spacing of the new grid
+    :param samples: the number of points on the new grid, used if dt is not given
+    :return: the new timestamps and the values at them
+    """
+    time_points = np.asarray(time_points, dtype=float)
+    array = np.asarray(array, dtype=float)
+
+    if dt is not None:
+        grid = np.arange(time_points[0], time_points[-1] + dt / 2, dt)
+    elif samples is not None:
+        grid = np.linspace(time_points[0], time_points[-1], samples)
+    else:
+        raise ValueError("Either dt or samples must be given to resample a trace")
+
+    if array.ndim == 1:
+        return grid, np.interp(grid, time_points, array)
+    return grid, np.column_stack([np.interp(grid, time_points, column) for column in array.T])
+
+
+#####################################################################
+
+# Decimation for plotting. Drawing a million points is slow and looks no different to drawing a couple of thousand.
+
+
+def decimate_minmax(time_points, array, target):
+    """
+    Splits the trace into target/2 equal buckets and keeps the smallest and largest sample of each, so spikes survive
+    however hard the trace is decimated.
+
+    :param time_points: the timestamps of the trace, in time order
+    :param array: the 1D values of the trace
+    :param target: the rough number of points to keep
+    :return: the kept timestamps and values, still in time order
+    """
+    time_points = np.asarray(time_points)
+    array = np.asarray(array)
+
+    buckets = max(target // 2, 1)
+    if len(array) <= target or len(array) < 2 * buckets:
+        return time_points, array
+
+    # Trimming the end so the trace divides evenly, the last few samples are added back as their own bucket
+    width = len(array) // buckets
+    body = array[:buckets * width].reshape(buckets, width)
+    offsets = np.arange(buckets) * width
+    lows = offsets + body.argmin(axis=1)
+    highs = offsets + body.argmax(axis=1)
+
+    keep = np.sort(np.concatenate((lows, highs)))
+    if buckets * width < len(array):
+        tail = array[buckets * width:]
+        keep = np.concatenate((keep, buckets * width + np.unique([tail.argmin(), tail.argmax()])))
+    keep = keep[np.concatenate(([True], keep[1:] != keep[:-1]))]
+
+    return time_points[keep], array[keep]
+
+
+def decimate_lttb(time_points, array, target):
+    """
+    Largest-Triangle-Three-Buckets decimation. Keeps the first and last samples and, from each bucket in between, the
+    sample forming the largest triangle with the previous kept sample and the average of the next bucket. This keeps
+    the visual shape of the trace better than min/max for the same number of points.
+
+    :param time_points: the timestamps of the trace, in time order
+    :param array: the 1D values of the trace
+    :param target: the number of points to keep (at least 3)
+    :return: the kept timestamps and values, still in time order
+    """
+    time_points = np.asarray(time_points, dtype=float)
+    array = np.asarray(array, dtype=float)
+
+    if target >= len(array) or target < 3:
+        return time_points, array
+
+    # Bucket edges for everything between the first and last sample
+    edges = np.linspace(1, len(array) - 1, target - 1).astype(np.intp)
+    # Averages of every bucket are calculated up front, only the choice within each bucket depends on the last choice
+    counts = np.diff(edges)
+    time_means = np.add.reduceat(time_points[:-1], edges[:-1]) / counts
+    value_means = np.add.reduceat(array[:-1], edges[:-1]) / counts
+    time_means = np.append(time_means[1:], time_points[-1])
+    value_means = np.append(value_means[1:], array[-1])
+
+    keep = np.empty(target, dtype=np.intp)
+    keep[0] = 0
+    keep[-1] = len(array) - 1
+    previous = 0
+    for bucket in range(target - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        t = time_points[start:stop]
+        y = array[start:stop]
+        # Twice the area of the triangle (previous point, candidate, next bucket average)
+        area = np.abs((time_points[previous] - time_means[bucket]) * (y - array[previous]) -
+                      (time_points[previous] - t) * (value_means[bucket] - array[previous]))
+        previous = start + area.argmax()
+        keep[bucket + 1] = previous
+
+    return time_points[keep], array[keep]
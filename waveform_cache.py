@@ -0,0 +1,104 @@
+from collections import OrderedDict
+
+import numpy as np
+
+"""
+Memoisation of action potential waveforms. Along a homogeneous chain every neuron gets the same starting voltage, has
+the same parameters and goes through the same stimulus, so get_data_behind works out the same waveform over and over,
+only shifted in time. A WaveformCache keeps each waveform the first time it is simulated, keyed on the quantised starting
+state, parameters and stimulus, and hands it back for every later neuron to use with its own time offset.
+"""
+
+#####################################################################
+
+
+class WaveformCache:
+    """
+    A class to represent a least recently used cache of waveforms with a memory budget.
+
+    ...
+
+    Attributes
+    ----------
+    max_bytes : int
+        the most memory the cached arrays may use. The least recently used waveforms are dropped to stay under it.
+    resolution : float
+        the values in a key are rounded to multiples of this, so states that only differ by rounding error match
+    hits, misses : int
+        the number of lookups that found a waveform and that didn't
+    nbytes : int
+        the memory used by the cached arrays
+
+    Methods
+    -------
+    key(*values):
+        Quantises values into a key.
+
+    get(key) / put(key, waveform):
+        Looks a waveform up, or adds one.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20, resolution=1e-6):
+        """
+        :param max_bytes: the memory budget in bytes
+        :param resolution: the quantisation step for the values in keys
+        """
+        self.max_bytes = max_bytes
+        self.resolution = resolution
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, *values):
+        """
+        :param values: the numbers that decide the waveform, e.g. the starting state, parameters and stimulus
+        :return: a hashable key, with each value rounded to a multiple of the resolution
+        """
+        return tuple(int(round(value / self.resolution)) for value in np.ravel(values))
+
+    def get(self, key):
+        """
+        :param key: a key made by key()
+        :return: the waveform stored under it, or None
+        """
+        waveform = self._entries.get(key)
+        if waveform is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return waveform
+
+    def put(self, key, waveform):
+        """
+        Stores a waveform, dropping the least recently used ones if the budget is exceeded. A waveform bigger than the
+        whole budget isn't stored.
+
+        :param key: a key made by key()
+        :param waveform: a dict whose NumPy array values count towards the budget
+        """
+        size = sum(value.nbytes for value in waveform.values() if isinstance(value, np.ndarray))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)["nbytes"]
+        waveform["nbytes"] = size
+        self._entries[key] = waveform
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, dropped = self._entries.popitem(last=False)
+            self.nbytes -= dropped["nbytes"]
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return (f"WaveformCache({len(self)} waveforms, {self.nbytes / 2**20:.1f} of {self.max_bytes / 2**20:.1f} MiB, "
+                f"{self.hits} hits, {self.misses} misses)")